@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AdminconsoleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'AdminConsole'
+
+    def ready(self):
+        from .rollups import get_user_tracker
+        get_user_tracker().connect()
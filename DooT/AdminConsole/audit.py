@@ -0,0 +1,204 @@
+"""Batched audit logging.
+
+Admin actions record what they did with ``log_action`` instead of saving an
+AuditLog row each. Entries are handed over when the action's transaction
+commits (entries of a rolled back action are dropped) and collected in an
+in-process buffer, which a background thread writes with one
+``bulk_create`` every ``AUDIT_LOG_FLUSH_INTERVAL`` seconds or as soon as
+``AUDIT_LOG_FLUSH_SIZE`` entries are waiting. Entries logged with
+``durable=True`` skip the buffer and are inserted by the commit hook itself,
+so they are on disk once the action has committed. Entries still buffered
+when a process is killed are lost; ``AUDIT_LOG_ASYNC = False`` writes every
+entry at commit.
+
+Views wrapped in ``@audited`` time the whole action: entries they log still
+commit or roll back with their transaction, but the ones committed while
+the view is running are held until it returns and get its duration as
+``duration_ms``.
+"""
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+# The running ``@audited`` view, whose duration its entries wait for
+_scope = contextvars.ContextVar('audit_scope', default=None)
+
+
+class _Scope:
+    def __init__(self):
+        self.running = True
+        # Every entry logged by the view, and the (entries, durable) batches already committed
+        self.entries = []
+        self.committed = []
+
+
+class _ValuesEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        try:
+            return super().default(o)
+        except TypeError:
+            # Files and other model values are logged by their text
+            return str(o)
+
+
+def _plain(values):
+    """``values`` as plain JSON types for old_values/new_values"""
+    return json.loads(json.dumps(values or {}, cls=_ValuesEncoder))
+
+
+def _log_id():
+    return f"AUDIT-{uuid.uuid4().hex[:8].upper()}"
+
+
+def _write(entries):
+    """Insert ``entries``; one bad entry (e.g. its admin was deleted) does not lose the others"""
+    try:
+        with transaction.atomic():
+            AuditLog.objects.bulk_create(entries)
+    except IntegrityError:
+        for entry in entries:
+            # A second try with a fresh log_id in case that was what clashed
+            for attempt in range(2):
+                try:
+                    with transaction.atomic():
+                        AuditLog.objects.bulk_create([entry])
+                    break
+                except IntegrityError:
+                    if attempt:
+                        logger.exception('Dropped audit log entry %s', entry.log_id)
+                    entry.log_id = _log_id()
+
+
+class AuditBuffer:
+    def __init__(self):
+        self._entries = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+
+    def add(self, entries):
+        with self._lock:
+            self._entries.extend(entries)
+            if len(self._entries) >= settings.AUDIT_LOG_FLUSH_SIZE:
+                self._wake.set()
+            if self._flusher is None or not self._flusher.is_alive():
+                # Started lazily, so forked workers get their own
+                self._flusher = threading.Thread(target=self._run, name='audit-log-flusher', daemon=True)
+                self._flusher.start()
+
+    def flush(self):
+        """Write out the buffered entries; returns how many were written"""
+        with self._lock:
+            entries, self._entries = self._entries, []
+        if not entries:
+            return 0
+        try:
+            _write(entries)
+        except Exception:
+            logger.exception('Could not flush %d audit log entries', len(entries))
+            with self._lock:
+                self._entries[:0] = entries
+                overflow = len(self._entries) - settings.AUDIT_LOG_MAX_BUFFERED
+                if overflow > 0:
+                    del self._entries[:overflow]
+                    logger.error('Dropped %d audit log entries', overflow)
+            return 0
+        return len(entries)
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.AUDIT_LOG_FLUSH_INTERVAL)
+            self._wake.clear()
+            close_old_connections()
+            self.flush()
+
+
+buffer = AuditBuffer()
+atexit.register(buffer.flush)
+
+
+def _store(entries, durable):
+    if durable or not settings.AUDIT_LOG_ASYNC:
+        _write(entries)
+    else:
+        buffer.add(entries)
+
+
+def _submit(entries, durable):
+    scope = _scope.get()
+
+    def apply():
+        if scope is not None and scope.running:
+            # Committed before the audited view returned; it stores them with the duration
+            scope.committed.append((entries, durable))
+        else:
+            _store(entries, durable)
+
+    transaction.on_commit(apply)
+
+
+def log_action(request, action, instance=None, resource_type='', resource_id='',
+               old_values=None, new_values=None, durable=False):
+    """Record ``action`` (an AuditLog action) by ``request.user`` on ``instance`` or a named resource"""
+    entry = AuditLog(
+        log_id=_log_id(),
+        admin_user=request.user,
+        action=action,
+        resource_type=resource_type,
+        resource_id=str(resource_id),
+        old_values=_plain(old_values),
+        new_values=_plain(new_values),
+        ip_address=request.META.get('REMOTE_ADDR') or None,
+        user_agent=request.META.get('HTTP_USER_AGENT', ''),
+        session_id=getattr(getattr(request, 'session', None), 'session_key', None) or '',
+        timestamp=timezone.now(),
+    )
+    if instance is not None:
+        entry.content_type = ContentType.objects.get_for_model(instance)
+        entry.object_id = instance.pk
+        entry.resource_type = entry.resource_type or instance._meta.model_name
+        entry.resource_id = entry.resource_id or str(instance.pk)
+
+    scope = _scope.get()
+    if scope is not None:
+        scope.entries.append(entry)
+    _submit([entry], durable)
+    return entry
+
+
+def audited(view):
+    """Time the wrapped view and store the duration on the entries it logs"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        scope = _Scope()
+        token = _scope.set(scope)
+        started = time.perf_counter()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _scope.reset(token)
+            scope.running = False
+            duration_ms = int((time.perf_counter() - started) * 1000)
+            # Entries whose transaction commits later (e.g. ATOMIC_REQUESTS) are stored by their hook
+            for entry in scope.entries:
+                entry.duration_ms = duration_ms
+            for durable in (True, False):
+                batch = [entry for entries, entry_durable in scope.committed if entry_durable is durable
+                         for entry in entries]
+                if batch:
+                    _store(batch, durable)
+
+    return wrapper
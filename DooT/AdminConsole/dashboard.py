@@ -0,0 +1,116 @@
+"""Admin dashboard statistics.
+
+Each table is read once with a conditional aggregation instead of a COUNT
+per number. With ``ADMIN_DASHBOARD_USE_ROLLUPS`` the user and order cards
+are sums over the daily ``UserRollup`` and ``OrderRollup`` rows instead, so
+any date range costs a few rows rather than a table scan. Either way the
+result is cached for ``ADMIN_DASHBOARD_CACHE_SECONDS`` per date range.
+
+Orders moved to the archive still count; the order rollups include them.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from Orders.models import Order, ArchivedOrder, OrderRollup
+from Users.models import User
+from .models import Dispute, Report, UserRollup
+
+# Disputes still waiting for a decision
+UNRESOLVED_DISPUTE_STATUSES = ['open', 'investigating', 'escalated']
+
+
+def _in_range(field, date_from, date_to):
+    """Q for ``field`` within the inclusive date range, or None when unbounded"""
+    condition = Q()
+    if date_from:
+        condition &= Q(**{f'{field}__gte': date_from})
+    if date_to:
+        condition &= Q(**{f'{field}__lte': date_to})
+    return condition or None
+
+
+def _case_statistics():
+    disputes = Dispute.objects.aggregate(
+        total=Count('id'),
+        resolved=Count('id', filter=Q(status='resolved')),
+        pending=Count('id', filter=Q(status__in=UNRESOLVED_DISPUTE_STATUSES)),
+    )
+    reports = Report.objects.aggregate(
+        total=Count('id'),
+        resolved=Count('id', filter=Q(status='resolved')),
+        pending=Count('id', filter=Q(status='pending')),
+    )
+    return disputes, reports
+
+
+def _table_statistics(date_from, date_to):
+    users = User.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        new=Count('id', filter=_in_range('created_at__date', date_from, date_to)),
+    )
+
+    paid = Q(payment_status='paid')
+    period = _in_range('created_at__date', date_from, date_to)
+    orders = {'total': 0, 'completed': 0, 'pending': 0}
+    revenue = 0
+    for model in (Order, ArchivedOrder):
+        stats = model.objects.aggregate(
+            total=Count('id'),
+            completed=Count('id', filter=Q(status='delivered')),
+            pending=Count('id', filter=Q(status='pending')),
+            revenue=Sum('total_amount', filter=paid & period if period else paid),
+        )
+        revenue += stats.pop('revenue') or 0
+        for key, value in stats.items():
+            orders[key] += value
+    return users, orders, revenue
+
+
+def _rollup_statistics(date_from, date_to):
+    users = UserRollup.objects.aggregate(
+        total=Sum('user_count'),
+        active=Sum('user_count', filter=Q(is_active=True)),
+        new=Sum('user_count', filter=_in_range('day', date_from, date_to)),
+    )
+
+    # Every order has one seller row and one customer row; count the seller rows
+    paid = Q(payment_status='paid')
+    period = _in_range('day', date_from, date_to)
+    orders = OrderRollup.objects.filter(user__isnull=True).aggregate(
+        total=Sum('order_count'),
+        completed=Sum('order_count', filter=Q(status='delivered')),
+        pending=Sum('order_count', filter=Q(status='pending')),
+        revenue=Sum('total_amount', filter=paid & period if period else paid),
+    )
+    revenue = orders.pop('revenue') or 0
+    users = {key: value or 0 for key, value in users.items()}
+    orders = {key: value or 0 for key, value in orders.items()}
+    return users, orders, revenue
+
+
+def dashboard_statistics(date_from=None, date_to=None):
+    """Dashboard numbers; ``date_from``/``date_to`` bound new users and revenue"""
+    use_rollups = settings.ADMIN_DASHBOARD_USE_ROLLUPS
+    key = f"adminconsole:dashboard:{'rollups' if use_rollups else 'tables'}:{date_from or ''}:{date_to or ''}"
+    statistics = cache.get(key)
+    if statistics is not None:
+        return statistics
+
+    if use_rollups:
+        users, orders, revenue = _rollup_statistics(date_from, date_to)
+    else:
+        users, orders, revenue = _table_statistics(date_from, date_to)
+    disputes, reports = _case_statistics()
+    statistics = {
+        'users': users,
+        'orders': orders,
+        'revenue': {
+            'total': revenue,
+            'period': f"{date_from or 'All time'} - {date_to or 'Now'}"
+        },
+        'disputes': disputes,
+        'reports': reports,
+    }
+    cache.set(key, statistics, timeout=settings.ADMIN_DASHBOARD_CACHE_SECONDS)
+    return statistics
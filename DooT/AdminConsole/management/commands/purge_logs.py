@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Orders.archive import relation_sizes
+from AdminConsole.retention import POLICIES, purge_logs
+
+
+class Command(BaseCommand):
+    help = 'Fold EmailLog/SMSLog/AuditLog rows past LOG_RETENTION_DAYS into daily summaries and delete them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', dest='names', action='append', choices=[policy.name for policy in POLICIES],
+                            help='Only purge this log (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=settings.LOG_RETENTION_BATCH_SIZE)
+        parser.add_argument('--export', dest='export_dir', help='Also append purged rows to <table>.ndjson.gz in this directory')
+
+    def handle(self, *args, **options):
+        models = [policy.model for policy in POLICIES if not options['names'] or policy.name in options['names']]
+
+        before = relation_sizes(models)
+        deleted = purge_logs(
+            names=options['names'],
+            batch_size=options['batch_size'],
+            export_dir=options['export_dir'],
+        )
+        after = relation_sizes(models)
+
+        for name, count in deleted.items():
+            self.stdout.write(self.style.SUCCESS(f'Purged {count} {name} log rows'))
+        for table, size in after.items():
+            line = f"{table}: {before[table]['rows']} -> {size['rows']} rows"
+            if size['table_bytes'] is not None:
+                line += (
+                    f", table {before[table]['table_bytes']} -> {size['table_bytes']} bytes"
+                    f", indexes {before[table]['index_bytes']} -> {size['index_bytes']} bytes"
+                )
+            self.stdout.write(line)
@@ -166,11 +166,15 @@ class AuditLog(models.Model):
     session_id = models.CharField(max_length=100, blank=True)
     
     # Timestamps
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the action happens; entries are written later in batches (AdminConsole.audit)
+    timestamp = models.DateTimeField(default=timezone.now)
     duration_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Action duration in milliseconds")
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='auditlog_timestamp_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.log_id:
@@ -180,6 +184,39 @@ class AuditLog(models.Model):
     def __str__(self):
         return f"{self.admin_user.name} - {self.action} - {self.timestamp}"
 
+class AuditLogSummary(models.Model):
+    """Daily counts of audit log entries removed by the retention purge"""
+    day = models.DateField()
+    action = models.CharField(max_length=20, choices=AuditLog.ACTION_CHOICES)
+    resource_type = models.CharField(max_length=100, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'action', 'resource_type'], name='unique_audit_log_summary'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.action} - {self.resource_type}: {self.count}"
+
+class UserRollup(models.Model):
+    """Daily counts of registered users by whether they are active.
+
+    ``day`` is the day the user registered. Kept in step with User saves by
+    ``AdminConsole.rollups`` and rebuilt with ``manage.py rebuild_statistics_rollups``.
+    """
+    day = models.DateField()
+    is_active = models.BooleanField()
+    user_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'is_active'], name='unique_user_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {'active' if self.is_active else 'inactive'}: {self.user_count}"
+
 class Dispute(models.Model):
     """Handle disputes between users, sellers, and platform"""
     DISPUTE_TYPE_CHOICES = [
@@ -0,0 +1,107 @@
+"""Retention of append-only logs.
+
+EmailLog, SMSLog and AuditLog grow with every message sent and every admin
+action. ``purge_logs`` removes rows older than their ``LOG_RETENTION_DAYS``
+policy in primary-key ranges, one short transaction per range, so the
+DELETEs never hold long locks or build one huge transaction. Before a range
+is deleted its rows are folded into per-day summary counters (which the
+statistics endpoints add to the live counts) and optionally appended to a
+gzip compressed NDJSON export.
+"""
+import gzip
+import json
+import os
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from Orders.archive import _row
+from Orders.rollups import bump_rollup
+from Notifications.models import EmailLog, SMSLog, DeliveryLogSummary
+from .models import AuditLog, AuditLogSummary
+
+
+def summarize_email_logs(rows):
+    for row in rows.annotate(day=TruncDate('sent_at')).values('day', 'status').annotate(total=Count('id')):
+        bump_rollup(DeliveryLogSummary, {'day': row['day'], 'channel': 'email', 'status': row['status']},
+                    {'count': row['total']})
+
+
+def summarize_sms_logs(rows):
+    grouped = rows.annotate(day=TruncDate('sent_at')).values('day', 'status').annotate(
+        total=Count('id'), cost=Sum('cost')
+    )
+    for row in grouped:
+        bump_rollup(DeliveryLogSummary, {'day': row['day'], 'channel': 'sms', 'status': row['status']},
+                    {'count': row['total'], 'cost': row['cost'] or 0})
+
+
+def summarize_audit_logs(rows):
+    grouped = rows.annotate(day=TruncDate('timestamp')).values('day', 'action', 'resource_type').annotate(
+        total=Count('id')
+    )
+    for row in grouped:
+        bump_rollup(AuditLogSummary, {'day': row['day'], 'action': row['action'], 'resource_type': row['resource_type']},
+                    {'count': row['total']})
+
+
+RetentionPolicy = namedtuple('RetentionPolicy', ['name', 'model', 'date_field', 'summarize'])
+
+POLICIES = [
+    RetentionPolicy('email', EmailLog, 'sent_at', summarize_email_logs),
+    RetentionPolicy('sms', SMSLog, 'sent_at', summarize_sms_logs),
+    RetentionPolicy('audit', AuditLog, 'timestamp', summarize_audit_logs),
+]
+
+
+def purge(policy, before, batch_size=None, export_dir=None):
+    """Summarize and delete ``policy`` rows older than ``before``; returns the number deleted.
+
+    With ``export_dir`` the rows are also appended to ``<table>.ndjson.gz``
+    in that directory before they are deleted.
+    """
+    batch_size = batch_size or settings.LOG_RETENTION_BATCH_SIZE
+    model = policy.model
+    old = model._base_manager.filter(**{f'{policy.date_field}__lt': before})
+    bounds = old.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return 0
+
+    export_file = None
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+        export_file = gzip.open(os.path.join(export_dir, f'{model._meta.db_table}.ndjson.gz'), 'at', encoding='utf-8')
+    total = 0
+    try:
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            batch = old.filter(pk__gte=start, pk__lt=start + batch_size)
+            with transaction.atomic():
+                policy.summarize(batch)
+                if export_file is not None:
+                    for instance in batch.order_by('pk').iterator():
+                        export_file.write(json.dumps(_row(instance), cls=DjangoJSONEncoder) + '\n')
+                deleted, _ = batch.delete()
+            total += deleted
+    finally:
+        if export_file is not None:
+            export_file.close()
+    return total
+
+
+def purge_logs(names=None, batch_size=None, export_dir=None, now=None):
+    """Apply every retention policy (or those in ``names``); returns ``{name: rows deleted}``"""
+    now = now or timezone.now()
+    deleted = {}
+    for policy in POLICIES:
+        if names and policy.name not in names:
+            continue
+        days = settings.LOG_RETENTION_DAYS.get(policy.name)
+        if not days:
+            # No policy: keep the rows forever
+            continue
+        deleted[policy.name] = purge(policy, now - timedelta(days=days), batch_size, export_dir)
+    return deleted
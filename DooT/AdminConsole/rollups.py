@@ -0,0 +1,34 @@
+"""Daily user rollups for the admin dashboard.
+
+Uses the same ``RollupTracker`` machinery as ``Orders.rollups``: registrations
+are counted per day and active flag, so user totals and new users over any
+date range are sums over a few rows.
+"""
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from Orders.rollups import RollupTracker, rollup_day, bulk_create_chunked
+
+
+def user_contributions(state):
+    return [({'day': rollup_day(state['created_at']), 'is_active': state['is_active']}, {'user_count': 1})]
+
+
+def get_user_tracker():
+    from Users.models import User
+    from .models import UserRollup
+    return RollupTracker(User, UserRollup, fields=['created_at', 'is_active'], contributions=user_contributions)
+
+
+def rebuild_user_rollups(batch_size=1000):
+    """Recompute every UserRollup row from the User table"""
+    from Users.models import User
+    from .models import UserRollup
+    grouped = (
+        User.objects.annotate(day=TruncDate('created_at'))
+        .values('day', 'is_active').annotate(user_count=Count('id')).order_by()
+    )
+    rows = (UserRollup(**row) for row in grouped.iterator())
+    with transaction.atomic():
+        UserRollup.objects.all().delete()
+        return bulk_create_chunked(UserRollup, rows, batch_size)
@@ -31,8 +31,7 @@ class SystemSettingsUpdateSerializer(serializers.ModelSerializer):
         fields = ['value', 'description', 'is_active']
 
 class AuditLogSerializer(serializers.ModelSerializer):
-    user_name = serializers.CharField(source='user.name', read_only=True)
-    admin_name = serializers.CharField(source='admin.name', read_only=True)
+    admin_name = serializers.CharField(source='admin_user.name', read_only=True)
     
     class Meta:
         model = AuditLog
@@ -4,9 +4,12 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Sum, Count
+from django.db.models import Q, Count
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.contrib.auth import get_user_model
+from .audit import audited, log_action
+from .dashboard import dashboard_statistics as get_dashboard_statistics
 from .models import AdminProfile, SystemSettings, AuditLog, Dispute, DisputeMessage, Report, SystemMaintenance
 from .serializers import (
     AdminProfileSerializer, AdminProfileCreateSerializer, SystemSettingsSerializer,
@@ -20,6 +23,9 @@ from .serializers import (
 
 User = get_user_model()
 
+# Content moderation action -> AuditLog action
+MODERATION_ACTIONS = {'approve': 'approve', 'reject': 'reject', 'flag': 'update', 'remove': 'delete'}
+
 # Keep generics for simple listing and retrieval
 class AdminProfileListView(generics.ListAPIView):
     serializer_class = AdminProfileSerializer
@@ -45,10 +51,11 @@ class SystemSettingsDetailView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAdminUser]
 
 class AuditLogListView(generics.ListAPIView):
+    queryset = AuditLog.objects.select_related('admin_user')
     serializer_class = AuditLogSerializer
     permission_classes = [permissions.IsAdminUser]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['action', 'user', 'admin', 'object_type']
+    filterset_fields = ['action', 'admin_user', 'resource_type', 'resource_id']
     ordering_fields = ['timestamp', 'action']
     ordering = ['-timestamp']
 
@@ -157,6 +164,7 @@ class SystemSettingsUpdateView(APIView):
         except SystemSettings.DoesNotExist:
             return None
     
+    @audited
     def put(self, request, pk):
         """Update system setting with custom validation"""
         setting = self.get_object(pk)
@@ -172,17 +180,15 @@ class SystemSettingsUpdateView(APIView):
                         'error': f'Invalid value for setting type: {setting.setting_type}'
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
+                old_value = setting.get_value()
                 serializer.save()
                 
                 # Log the change
-                AuditLog.objects.create(
-                    user=request.user,
-                    admin=request.user,
-                    action='update',
-                    object_type='system_setting',
-                    object_id=setting.id,
-                    details=f'Updated {setting.key} to {serializer.validated_data.get("value")}',
-                    ip_address=request.META.get('REMOTE_ADDR', '')
+                log_action(
+                    request, 'system_change', setting, resource_type='system_setting',
+                    old_values={'key': setting.key, 'value': old_value},
+                    new_values={'key': setting.key, 'value': setting.get_value()},
+                    durable=True
                 )
                 
                 return Response({
@@ -214,6 +220,7 @@ class SystemSettingsUpdateView(APIView):
 class DisputeCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
+    @audited
     def post(self, request):
         """Create dispute with custom validation"""
         serializer = DisputeCreateSerializer(data=request.data, context={'request': request})
@@ -237,14 +244,9 @@ class DisputeCreateView(APIView):
                 dispute = serializer.save()
                 
                 # Log the action
-                AuditLog.objects.create(
-                    user=request.user,
-                    admin=request.user if hasattr(request.user, 'admin_profile') else None,
-                    action='create',
-                    object_type='dispute',
-                    object_id=dispute.id,
-                    details=f'Created dispute for order {order.order_number}',
-                    ip_address=request.META.get('REMOTE_ADDR', '')
+                log_action(
+                    request, 'create', dispute,
+                    new_values={'order': order.order_number, 'status': dispute.status}
                 )
                 
                 return Response({
@@ -269,6 +271,7 @@ class DisputeUpdateView(APIView):
         except Dispute.DoesNotExist:
             return None
     
+    @audited
     def put(self, request, pk):
         """Update dispute with custom logic"""
         dispute = self.get_object(pk)
@@ -279,6 +282,7 @@ class DisputeUpdateView(APIView):
         if serializer.is_valid():
             try:
                 # Update dispute
+                old_status = dispute.status
                 serializer.save()
                 
                 # If resolved, set resolved_at
@@ -287,14 +291,9 @@ class DisputeUpdateView(APIView):
                     dispute.save()
                 
                 # Log the action
-                AuditLog.objects.create(
-                    user=request.user,
-                    admin=request.user,
-                    action='update',
-                    object_type='dispute',
-                    object_id=dispute.id,
-                    details=f'Updated dispute status to {serializer.validated_data.get("status")}',
-                    ip_address=request.META.get('REMOTE_ADDR', '')
+                log_action(
+                    request, 'update', dispute,
+                    old_values={'status': old_status}, new_values={'status': dispute.status}
                 )
                 
                 return Response({
@@ -391,6 +390,7 @@ class ReportUpdateView(APIView):
         except Report.DoesNotExist:
             return None
     
+    @audited
     def put(self, request, pk):
         """Update report with custom logic"""
         report = self.get_object(pk)
@@ -401,6 +401,7 @@ class ReportUpdateView(APIView):
         if serializer.is_valid():
             try:
                 # Update report
+                old_status = report.status
                 serializer.save()
                 
                 # If resolved, set resolved_at
@@ -409,14 +410,9 @@ class ReportUpdateView(APIView):
                     report.save()
                 
                 # Log the action
-                AuditLog.objects.create(
-                    user=request.user,
-                    admin=request.user,
-                    action='update',
-                    object_type='report',
-                    object_id=report.id,
-                    details=f'Updated report status to {serializer.validated_data.get("status")}',
-                    ip_address=request.META.get('REMOTE_ADDR', '')
+                log_action(
+                    request, 'update', report,
+                    old_values={'status': old_status}, new_values={'status': report.status}
                 )
                 
                 return Response({
@@ -434,6 +430,7 @@ class ReportUpdateView(APIView):
 class SystemMaintenanceCreateView(APIView):
     permission_classes = [permissions.IsAdminUser]
     
+    @audited
     def post(self, request):
         """Create system maintenance with custom validation"""
         serializer = SystemMaintenanceCreateSerializer(data=request.data, context={'request': request})
@@ -458,14 +455,13 @@ class SystemMaintenanceCreateView(APIView):
                 maintenance = serializer.save()
                 
                 # Log the action
-                AuditLog.objects.create(
-                    user=request.user,
-                    admin=request.user,
-                    action='create',
-                    object_type='system_maintenance',
-                    object_id=maintenance.id,
-                    details=f'Scheduled maintenance: {maintenance.maintenance_type}',
-                    ip_address=request.META.get('REMOTE_ADDR', '')
+                log_action(
+                    request, 'create', maintenance,
+                    new_values={
+                        'maintenance_type': maintenance.maintenance_type,
+                        'scheduled_start': maintenance.scheduled_start,
+                        'scheduled_end': maintenance.scheduled_end,
+                    }
                 )
                 
                 return Response({
@@ -490,6 +486,7 @@ class SystemMaintenanceUpdateView(APIView):
         except SystemMaintenance.DoesNotExist:
             return None
     
+    @audited
     def put(self, request, pk):
         """Update maintenance with custom logic"""
         maintenance = self.get_object(pk)
@@ -500,17 +497,13 @@ class SystemMaintenanceUpdateView(APIView):
         if serializer.is_valid():
             try:
                 # Update maintenance
+                old_status = maintenance.status
                 serializer.save()
                 
                 # Log the action
-                AuditLog.objects.create(
-                    user=request.user,
-                    admin=request.user,
-                    action='update',
-                    object_type='system_maintenance',
-                    object_id=maintenance.id,
-                    details=f'Updated maintenance status to {serializer.validated_data.get("status")}',
-                    ip_address=request.META.get('REMOTE_ADDR', '')
+                log_action(
+                    request, 'update', maintenance,
+                    old_values={'status': old_status}, new_values={'status': maintenance.status}
                 )
                 
                 return Response({
@@ -532,69 +525,18 @@ def dashboard_statistics(request):
     """Get comprehensive dashboard statistics"""
     try:
         # Parse date range
-        date_from = request.query_params.get('date_from')
-        date_to = request.query_params.get('date_to')
-        
-        # Base queryset with date filtering
-        base_filter = {}
-        if date_from:
-            base_filter['created_at__date__gte'] = date_from
-        if date_to:
-            base_filter['created_at__date__lte'] = date_to
-        
-        # User statistics
-        total_users = User.objects.count()
-        active_users = User.objects.filter(is_active=True).count()
-        new_users = User.objects.filter(**base_filter).count()
-        
-        # Order statistics
-        from Orders.models import Order
-        total_orders = Order.objects.count()
-        completed_orders = Order.objects.filter(status='delivered').count()
-        pending_orders = Order.objects.filter(status='pending').count()
-        
-        # Revenue statistics
-        total_revenue = Order.objects.filter(
-            payment_status='paid',
-            **base_filter
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        # Dispute statistics
-        total_disputes = Dispute.objects.count()
-        resolved_disputes = Dispute.objects.filter(status='resolved').count()
-        pending_disputes = Dispute.objects.filter(status='pending').count()
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    dates[name] = parse_date(value)
+                except ValueError:
+                    dates[name] = None
+                if dates[name] is None:
+                    return Response({'error': f'{name} must be a date (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Report statistics
-        total_reports = Report.objects.count()
-        resolved_reports = Report.objects.filter(status='resolved').count()
-        pending_reports = Report.objects.filter(status='pending').count()
-        
-        return Response({
-            'users': {
-                'total': total_users,
-                'active': active_users,
-                'new': new_users
-            },
-            'orders': {
-                'total': total_orders,
-                'completed': completed_orders,
-                'pending': pending_orders
-            },
-            'revenue': {
-                'total': total_revenue,
-                'period': f"{date_from or 'All time'} - {date_to or 'Now'}"
-            },
-            'disputes': {
-                'total': total_disputes,
-                'resolved': resolved_disputes,
-                'pending': pending_disputes
-            },
-            'reports': {
-                'total': total_reports,
-                'resolved': resolved_reports,
-                'pending': pending_reports
-            }
-        })
+        return Response(get_dashboard_statistics(**dates))
         
     except Exception as e:
         return Response({
@@ -603,6 +545,7 @@ def dashboard_statistics(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAdminUser])
+@audited
 def user_management(request):
     """Bulk user management actions"""
     serializer = UserManagementSerializer(data=request.data)
@@ -617,6 +560,7 @@ def user_management(request):
             
             for user in users:
                 try:
+                    was_active = user.is_active
                     if action == 'activate':
                         user.is_active = True
                         user.save()
@@ -631,14 +575,10 @@ def user_management(request):
                     affected_count += 1
                     
                     # Log the action
-                    AuditLog.objects.create(
-                        user=user,
-                        admin=request.user,
-                        action=action,
-                        object_type='user',
-                        object_id=user.id,
-                        details=f'User {action}ed. Reason: {reason}',
-                        ip_address=request.META.get('REMOTE_ADDR', '')
+                    log_action(
+                        request, 'update', user,
+                        old_values={'is_active': was_active},
+                        new_values={'is_active': user.is_active, 'operation': action, 'reason': reason}
                     )
                     
                 except Exception as e:
@@ -659,6 +599,7 @@ def user_management(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAdminUser])
+@audited
 def content_moderation(request):
     """Content moderation actions"""
     serializer = ContentModerationSerializer(data=request.data)
@@ -687,6 +628,10 @@ def content_moderation(request):
                 }, status=status.HTTP_404_NOT_FOUND)
             
             # Perform moderation action
+            old_values = {
+                field: getattr(content_object, field)
+                for field in ('status', 'is_active') if hasattr(content_object, field)
+            }
             if action == 'approve':
                 if hasattr(content_object, 'status'):
                     content_object.status = 'approved'
@@ -701,14 +646,13 @@ def content_moderation(request):
                     content_object.save()
             
             # Log the action
-            AuditLog.objects.create(
-                user=request.user,
-                admin=request.user,
-                action=action,
-                object_type=content_type,
-                object_id=content_id,
-                details=f'Content {action}ed. Reason: {reason}. Notes: {admin_notes}',
-                ip_address=request.META.get('REMOTE_ADDR', '')
+            log_action(
+                request, MODERATION_ACTIONS[action], content_object, resource_type=content_type,
+                old_values=old_values,
+                new_values={
+                    **{field: getattr(content_object, field) for field in old_values},
+                    'reason': reason, 'admin_notes': admin_notes,
+                }
             )
             
             return Response({
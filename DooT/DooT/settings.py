@@ -1,4 +1,5 @@
 from pathlib import Path
+from decimal import Decimal
 import os
 from datetime import timedelta
 
@@ -195,6 +196,30 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Caching
+# Compiled indexes (shipping zones and rates, coupons, promotions), their
+# invalidation versions and usage counters live in this cache. Without
+# REDIS_URL every process has its own LocMemCache, so a change made in one
+# process only reaches the others when their copy expires
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Compiled indexes are rebuilt at least this often even if no change reached
+# the process through the cache
+COMPILED_INDEX_MAX_AGE_SECONDS = 60
+
 # CORS Configuration
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -209,6 +234,84 @@ EMAIL_HOST = 'localhost'
 EMAIL_PORT = 1025
 EMAIL_USE_TLS = False
 
+# Notification Dispatch
+# Queued notifications are delivered by `manage.py dispatch_notifications`;
+# use Notifications.transports.FakeTransport to capture messages in tests
+NOTIFICATION_TRANSPORTS = {
+    'email': 'Notifications.transports.EmailTransport',
+    'sms': 'Notifications.transports.LogTransport',
+    'push': 'Notifications.transports.LogTransport',
+    'in_app': 'Notifications.transports.InAppTransport',
+}
+# Notifications.smtp.PooledSMTPTransport sends over persistent SMTP sessions
+NOTIFICATION_SMTP_POOL_SIZE = 4
+NOTIFICATION_SMTP_MAX_MESSAGES_PER_CONNECTION = 100
+NOTIFICATION_SMTP_IDLE_TIMEOUT_SECONDS = 30
+NOTIFICATION_DISPATCH_WORKERS = 4
+NOTIFICATION_DISPATCH_POOL = 'thread'  # or 'process'
+NOTIFICATION_DISPATCH_BATCH_SIZE = 100
+NOTIFICATION_RETRY_BACKOFF_SECONDS = 60
+NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS = 6 * 60 * 60
+NOTIFICATION_CLAIM_TIMEOUT_SECONDS = 5 * 60
+# Users per bulk-notification transaction, and rows per INSERT within it
+NOTIFICATION_BULK_CHUNK_SIZE = 5000
+NOTIFICATION_BULK_INSERT_BATCH_SIZE = 1000
+# Seconds a cached unread count lives without being recounted. Counts adjusted
+# by the dispatcher process only reach web processes through a shared cache,
+# so without REDIS_URL they are recounted often
+NOTIFICATION_UNREAD_COUNT_TIMEOUT = 24 * 60 * 60 if REDIS_URL else 30
+# Email digests (NotificationPreference.email_frequency), sent by
+# `manage.py send_email_digests` at this local hour; weekly ones on this weekday (0 = Monday)
+NOTIFICATION_DIGEST_HOUR = 8
+NOTIFICATION_DIGEST_WEEKDAY = 0
+NOTIFICATION_DIGEST_USERS_PER_BATCH = 500
+NOTIFICATION_DIGEST_SMTP_BATCH_SIZE = 100
+# Server-Sent Events stream (`notifications/stream/`, ASGI only). The
+# in-process backend only reaches streams served by the publishing process;
+# it polls for in-app notifications created by the dispatcher this often.
+# Redis pub/sub is used whenever Redis is configured
+NOTIFICATION_STREAM_REDIS_URL = os.environ.get('NOTIFICATION_STREAM_REDIS_URL', REDIS_URL)
+NOTIFICATION_STREAM_BACKEND = (
+    'Notifications.realtime.RedisBackend' if NOTIFICATION_STREAM_REDIS_URL
+    else 'Notifications.realtime.InProcessBackend'
+)
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = 15
+NOTIFICATION_STREAM_POLL_SECONDS = 2
+NOTIFICATION_STREAM_QUEUE_SIZE = 100
+
+# Order Pricing
+# Used by Orders.pricing until shipping rates are quoted per seller
+ORDER_TAX_RATE = Decimal('0.10')
+ORDER_FLAT_SHIPPING = Decimal('5.00')
+
+# Shipping Statistics
+# Serve shipping_statistics from Shipping.ShippingRollup (run
+# `manage.py rebuild_statistics_rollups` once before enabling)
+SHIPPING_STATISTICS_USE_ROLLUPS = False
+# Seconds between refreshes of the rollup days whose shipments changed
+SHIPPING_ROLLUP_REFRESH_INTERVAL = 30
+
+# Coupons
+# Seconds cached coupon usage counters (Promotions.coupons) live before being recounted
+COUPON_USAGE_COUNT_TIMEOUT = 60 * 60
+# Rows each coupon's use counter is split over (Promotions.redemption); more
+# stripes let more checkouts redeem the same coupon concurrently
+COUPON_COUNTER_STRIPES = 16
+
+# Celery Configuration
+# Without CELERY_BROKER_URL tasks run eagerly in-process (after the
+# surrounding transaction commits), so no broker is needed for development.
+# Bulk notification jobs and coupon batches are the exception: without a
+# broker they stay pending until `manage.py run_bulk_notifications` or
+# `manage.py generate_coupon_batches` runs them
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'memory://')
+CELERY_TASK_ALWAYS_EAGER = 'CELERY_BROKER_URL' not in os.environ
+CELERY_TASK_EAGER_PROPAGATES = False
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TIMEZONE = TIME_ZONE
+
 # File Upload Configuration
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
@@ -268,3 +371,57 @@ SWAGGER_SETTINGS = {
     'USE_SESSION_AUTH': False,
     'JSON_EDITOR': True,
 }
+
+# Order Archival
+# Delivered/cancelled/refunded/returned orders older than this are moved to
+# Orders.ArchivedOrder by `manage.py archive_orders`
+ORDER_ARCHIVE_AFTER_DAYS = 365
+ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# Log Retention
+# EmailLog/SMSLog/AuditLog rows older than this many days are folded into
+# daily summaries and deleted by `manage.py purge_logs` (None keeps them)
+LOG_RETENTION_DAYS = {
+    'email': 90,
+    'sms': 90,
+    'audit': 365,
+}
+LOG_RETENTION_BATCH_SIZE = 5000
+
+# Campaigns
+# Users are matched against a campaign's targeting spec this many at a time
+# when its audience is streamed (Promotions.segments)
+CAMPAIGN_SEGMENT_CHUNK_SIZE = 5000
+# Opens, clicks and conversions are buffered in each process and written to
+# Campaign/CampaignEngagement this often, or once this many are buffered
+CAMPAIGN_ENGAGEMENT_FLUSH_INTERVAL = 10
+CAMPAIGN_ENGAGEMENT_FLUSH_SIZE = 1000
+# An order converts the last campaign sent to its customer this many days before
+CAMPAIGN_ATTRIBUTION_DAYS = 7
+
+# Coupon Batches
+# Generated codes default to this alphabet (no 0/O or 1/I) and length, and
+# are inserted this many coupons per transaction (Promotions.codes)
+COUPON_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+COUPON_CODE_LENGTH = 10
+COUPON_BATCH_INSERT_SIZE = 2000
+COUPON_BATCH_MAX_QUANTITY = 500000
+# Batch coupons stay out of the in-memory coupon index; each process keeps
+# this many recently looked-up codes instead
+COUPON_BATCH_CACHE_SIZE = 10000
+
+# Admin Dashboard
+# Seconds dashboard_statistics are cached per date range; serve the user and
+# order numbers from the daily rollups (run `manage.py rebuild_statistics_rollups`
+# once before enabling)
+ADMIN_DASHBOARD_CACHE_SECONDS = 60
+ADMIN_DASHBOARD_USE_ROLLUPS = False
+
+# Audit Log
+# AdminConsole.audit buffers entries per process and bulk-inserts them this
+# often, or once this many are waiting; False writes each entry at commit
+AUDIT_LOG_ASYNC = True
+AUDIT_LOG_FLUSH_INTERVAL = 2
+AUDIT_LOG_FLUSH_SIZE = 500
+# Entries kept while the database is unreachable before the oldest are dropped
+AUDIT_LOG_MAX_BUFFERED = 50000
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NotificationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Notifications'
+
+    def ready(self):
+        from . import counters
+        counters.connect()
@@ -0,0 +1,150 @@
+"""Background fan-out of bulk notifications.
+
+A BulkNotificationJob walks its audience in user id order, ``chunk_size``
+users at a time. Each chunk is one transaction that ``bulk_create``s the
+Notification rows, queues them in the outbox and advances the job's
+``last_user_id`` cursor, so a job interrupted by a crash or deploy resumes
+after the last committed chunk without duplicating anyone. A job's sorted
+``user_ids`` list is loaded once per run and the cursor found in it by
+bisection, so each chunk is a slice of the list. Campaign jobs
+narrow the audience with a targeting spec compiled by ``Promotions.segments``
+and count each chunk towards the campaign's sends.
+"""
+import logging
+from bisect import bisect_right
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from Promotions.engagement import count_sent
+from Promotions.segments import segment_queryset
+from Users.models import User
+from .dispatch import enqueue
+from .models import BulkNotificationJob, Notification, new_notification_id
+from .templating import RECIPIENT_VARIABLES, compile_template
+
+logger = logging.getLogger(__name__)
+
+
+def audience(job):
+    """Active users the job targets, before its ``user_ids`` list is applied"""
+    users = User.objects.filter(is_active=True)
+    if job.audience:
+        users = segment_queryset(job.audience, users)
+    return users
+
+
+def audience_chunk(job, after_id, chunk_size, user_ids=None):
+    """``(id, name, email, phone)`` of the next ``chunk_size`` targeted users with id > ``after_id``
+
+    ``user_ids`` is the job's listed ids, passed in so the list is not
+    reloaded for every chunk; ``job.user_ids`` is used when it is None.
+    """
+    users = audience(job).filter(id__gt=after_id)
+    if user_ids is None:
+        user_ids = job.user_ids
+    if user_ids:
+        # Listed ids are sorted when the job is created, so the cursor also walks them in order
+        start = bisect_right(user_ids, after_id)
+        upcoming = user_ids[start:start + chunk_size]
+        if not upcoming:
+            return [], None
+        users = users.filter(id__in=upcoming)
+        return list(users.order_by('id').values_list('id', 'name', 'email', 'phone')), upcoming[-1]
+    rows = list(users.order_by('id').values_list('id', 'name', 'email', 'phone')[:chunk_size])
+    return rows, rows[-1][0] if rows else None
+
+
+def count_audience(job):
+    users = audience(job)
+    if job.user_ids:
+        users = users.filter(id__in=job.user_ids)
+    return users.count()
+
+
+def run_chunk(job_id, chunk_size, user_ids=None):
+    """Fan out one chunk; returns False once the job has nothing left to do"""
+    with transaction.atomic():
+        # The row lock serializes runners of the same job; the cursor is read under it
+        jobs = BulkNotificationJob.objects.select_for_update().select_related('template')
+        if user_ids is not None:
+            jobs = jobs.defer('user_ids')
+        job = jobs.get(pk=job_id)
+        if job.status != 'running':
+            return False
+        rows, cursor = audience_chunk(job, job.last_user_id, chunk_size, user_ids)
+        if cursor is None:
+            job.status = 'completed'
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'finished_at', 'updated_at'])
+            return False
+
+        template = job.template
+        compiled = compile_template(template)
+        if compiled.variables & RECIPIENT_VARIABLES:
+            contents = compiled.render_many([
+                {**job.context_data, 'name': name, 'email': email} for user_id, name, email, phone in rows
+            ])
+        else:
+            contents = [compiled.render(job.context_data)] * len(rows)
+        metadata = {'bulk_job': job.id}
+        if job.campaign_id:
+            metadata['campaign'] = job.campaign_id
+        notifications = [
+            Notification(
+                notification_id=new_notification_id(), template=template,
+                user_id=user_id, email=email, phone=phone[:20],
+                subject=subject, message=message, html_content=html_content,
+                priority=job.priority, scheduled_at=job.scheduled_at,
+                metadata=metadata,
+            )
+            for (user_id, name, email, phone), (subject, message, html_content) in zip(rows, contents)
+        ]
+        Notification.objects.bulk_create(notifications, batch_size=settings.NOTIFICATION_BULK_INSERT_BATCH_SIZE)
+        if notifications and notifications[0].pk is None:
+            # Backends that cannot return inserted keys
+            ids = dict(Notification.objects.filter(
+                notification_id__in=[notification.notification_id for notification in notifications]
+            ).values_list('notification_id', 'id'))
+            for notification in notifications:
+                notification.pk = ids[notification.notification_id]
+        enqueue(notifications)
+        if job.campaign_id:
+            count_sent(job.campaign_id, len(notifications))
+
+        job.last_user_id = cursor
+        job.processed_users += len(rows)
+        job.save(update_fields=['last_user_id', 'processed_users', 'updated_at'])
+    return True
+
+
+def start_job(job):
+    """Mark a pending (or interrupted) job as running; returns False if it already finished"""
+    if job.status in ('completed', 'cancelled'):
+        return False
+    if job.status == 'pending' or not job.total_users:
+        job.total_users = count_audience(job)
+    job.status = 'running'
+    job.error_message = ''
+    job.started_at = job.started_at or timezone.now()
+    job.save(update_fields=['status', 'total_users', 'error_message', 'started_at', 'updated_at'])
+    return True
+
+
+def run_job(job_id, chunk_size=None):
+    """Run (or resume) a bulk job to completion"""
+    chunk_size = chunk_size or settings.NOTIFICATION_BULK_CHUNK_SIZE
+    job = BulkNotificationJob.objects.get(pk=job_id)
+    if not start_job(job):
+        return job
+    # The listed ids do not change once the job exists
+    user_ids = job.user_ids
+    try:
+        while run_chunk(job_id, chunk_size, user_ids):
+            pass
+    except Exception as e:
+        logger.exception('Bulk notification job %s failed', job_id)
+        BulkNotificationJob.objects.filter(pk=job_id).update(
+            status='failed', error_message=str(e), updated_at=timezone.now()
+        )
+        raise
+    return BulkNotificationJob.objects.get(pk=job_id)
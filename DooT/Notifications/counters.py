@@ -0,0 +1,97 @@
+"""Per-user unread notification counters.
+
+The unread count is polled constantly, so it is kept in the cache and
+adjusted as UserNotification rows are created, read and deleted; only a
+cache miss counts rows (through the partial index on unread rows).
+Adjustments are applied when the surrounding transaction commits, so a
+rollback never skews the counter. Bulk changes (``mark_all_read``,
+``bulk_create`` from elsewhere) simply drop the cached value. Every change
+is also pushed to the user's notification stream (``Notifications.realtime``).
+
+Adjustments made by the notification dispatcher only reach web processes
+through a shared cache (``REDIS_URL``); without one the counts are recounted
+every ``NOTIFICATION_UNREAD_COUNT_TIMEOUT`` seconds, which settings keep short.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from . import realtime
+
+
+# Seconds an adjustment that found no cached count keeps later recounts from being trusted
+DIRTY_TIMEOUT = 60
+
+
+def _key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def _dirty_key(user_id):
+    return f'notifications:unread:{user_id}:dirty'
+
+
+def unread_count(user_id):
+    """Cached unread count, counted from the database on a miss"""
+    count = cache.get(_key(user_id))
+    if count is None:
+        from .models import UserNotification
+        cache.delete(_dirty_key(user_id))
+        count = UserNotification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.add(_key(user_id), count, timeout=settings.NOTIFICATION_UNREAD_COUNT_TIMEOUT)
+        if cache.get(_dirty_key(user_id)):
+            # A change committed while counting may be missing from the count
+            cache.delete(_key(user_id))
+    return count
+
+
+def _apply(deltas):
+    events = []
+    for user_id, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            value = cache.incr(_key(user_id), delta)
+        except ValueError:
+            # Not cached: the next read counts from the database. A read that
+            # is counting right now may miss this change, so keep it from
+            # caching its count
+            cache.set(_dirty_key(user_id), 1, timeout=DIRTY_TIMEOUT)
+            cache.delete(_key(user_id))
+            value = None
+        if value is not None and value < 0:
+            cache.delete(_key(user_id))
+            value = None
+        events.append((user_id, realtime.unread_count_event(value)))
+    realtime.publish(events)
+
+
+def _reset(user_id):
+    cache.delete(_key(user_id))
+    realtime.publish([(user_id, realtime.unread_count_event(unread_count(user_id)))])
+
+
+def adjust(user_id, delta):
+    """Change the user's unread count by ``delta`` once the transaction commits"""
+    adjust_many({user_id: delta})
+
+
+def adjust_many(deltas):
+    """Apply ``{user_id: delta}`` once the transaction commits"""
+    deltas = dict(deltas)
+    transaction.on_commit(lambda: _apply(deltas))
+
+
+def reset(user_id):
+    """Forget the cached count (after bulk changes); recounted on the next read"""
+    transaction.on_commit(lambda: _reset(user_id))
+
+
+def _user_notification_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        adjust(instance.user_id, -1)
+
+
+def connect():
+    from django.db.models.signals import post_delete
+    from .models import UserNotification
+    post_delete.connect(_user_notification_deleted, sender=UserNotification, dispatch_uid='notification-unread-delete')
@@ -0,0 +1,122 @@
+"""Daily and weekly email digests.
+
+Users whose ``NotificationPreference.email_frequency`` is 'daily' or
+'weekly' do not get low/normal priority emails one by one: ``enqueue`` holds
+their outbox rows (status 'held') until the next digest boundary.
+``send_digests`` then claims due held rows for a chunk of users at a time,
+renders one digest email per user and sends the chunk over a single SMTP
+connection per transport batch, recording every included notification as
+delivered (or retrying the whole digest on failure).
+"""
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .dispatch import claim, record
+from .models import NotificationOutbox, NotificationPreference
+from .transports import failed, get_transport
+
+DIGEST_TITLES = {'daily': 'Your daily digest', 'weekly': 'Your weekly digest'}
+
+
+def digest_frequencies(user_ids):
+    """``{user_id: 'daily'|'weekly'}`` for the given users who chose a digest"""
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if not user_ids:
+        return {}
+    return dict(
+        NotificationPreference.objects.filter(user_id__in=user_ids, email_frequency__in=DIGEST_TITLES)
+        .values_list('user_id', 'email_frequency')
+    )
+
+
+def next_digest_at(frequency, now=None):
+    """The next digest boundary after ``now``: NOTIFICATION_DIGEST_HOUR, on NOTIFICATION_DIGEST_WEEKDAY for weekly"""
+    now = timezone.localtime(now or timezone.now())
+    boundary = datetime.combine(now.date(), time(settings.NOTIFICATION_DIGEST_HOUR))
+    if settings.USE_TZ:
+        boundary = timezone.make_aware(boundary)
+    if frequency == 'weekly':
+        boundary += timedelta(days=(settings.NOTIFICATION_DIGEST_WEEKDAY - boundary.weekday()) % 7)
+        if boundary <= now:
+            boundary += timedelta(days=7)
+    elif boundary <= now:
+        boundary += timedelta(days=1)
+    return boundary
+
+
+def render_digest(frequency, deliveries):
+    """Subject and text body of one user's digest"""
+    title = DIGEST_TITLES.get(frequency, DIGEST_TITLES['daily'])
+    subject = f'{title}: {len(deliveries)} notification{"s" if len(deliveries) != 1 else ""}'
+    sections = []
+    for delivery in deliveries:
+        notification = delivery.notification
+        heading = notification.subject or notification.template.name
+        sections.append(f'{heading}\n{"-" * len(heading)}\n{notification.message}')
+    return subject, '\n\n'.join(sections)
+
+
+def send_digest_batch(deliveries):
+    """Send one digest per user for claimed rows; returns ``(sent, retried, failed)`` per notification"""
+    by_user = {}
+    for delivery in deliveries:
+        by_user.setdefault(delivery.notification.user_id, []).append(delivery)
+
+    messages, groups = [], []
+    for user_id, user_deliveries in by_user.items():
+        user_deliveries.sort(key=lambda delivery: delivery.notification.created_at)
+        subject, body = render_digest(user_deliveries[0].digest, user_deliveries)
+        first = user_deliveries[0].notification
+        messages.append({
+            'delivery_id': user_deliveries[0].id,
+            'notification_id': first.notification_id,
+            'user_id': user_id,
+            'to': first.email or (first.user.email if first.user else ''),
+            'subject': subject,
+            'body': body,
+            'html': '',
+        })
+        groups.append(user_deliveries)
+
+    transport = get_transport('email')
+    results = [None if message['to'] else failed('No email recipient') for message in messages]
+    sendable = [index for index, message in enumerate(messages) if message['to']]
+    size = settings.NOTIFICATION_DIGEST_SMTP_BATCH_SIZE
+    for start in range(0, len(sendable), size):
+        chunk = sendable[start:start + size]
+        try:
+            chunk_results = transport.send_batch([messages[index] for index in chunk])
+        except Exception as e:
+            chunk_results = [failed(e)] * len(chunk)
+        for index, result in zip(chunk, chunk_results):
+            results[index] = result
+
+    # Every notification in a digest shares the digest's outcome
+    ordered, outcomes = [], []
+    for user_deliveries, result in zip(groups, results):
+        ordered.extend(user_deliveries)
+        outcomes.extend([result] * len(user_deliveries))
+    return record(ordered, outcomes, retry_status='held')
+
+
+def send_digests(frequency=None, users_per_batch=None, now=None):
+    """Send every due digest; returns totals of ``(sent, retried, failed)`` notifications"""
+    users_per_batch = users_per_batch or settings.NOTIFICATION_DIGEST_USERS_PER_BATCH
+    now = now or timezone.now()
+    totals = [0, 0, 0]
+    while True:
+        due = NotificationOutbox.objects.filter(status='held', channel='email', available_at__lte=now)
+        if frequency:
+            due = due.filter(digest=frequency)
+        user_ids = list(
+            due.order_by('notification__user_id').values_list('notification__user_id', flat=True)
+            .distinct()[:users_per_batch]
+        )
+        if not user_ids:
+            return tuple(totals)
+        # Claim each user's due rows together so their digest is complete
+        deliveries = claim(None, 'digest', now=now, due=due.filter(notification__user_id__in=user_ids))
+        if not deliveries:
+            return tuple(totals)
+        counts = send_digest_batch(deliveries)
+        totals = [total + count for total, count in zip(totals, counts)]
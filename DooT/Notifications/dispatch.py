@@ -0,0 +1,273 @@
+"""Notification outbox and dispatcher.
+
+``enqueue`` writes one NotificationOutbox row per notification in the
+caller's transaction, so a notification is delivered if and only if it was
+committed. ``Dispatcher`` workers claim due rows in batches (highest
+priority first, ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+supports it), hand them to the channel transports on a thread or process
+pool, then record the outcome with a handful of bulk writes: delivery logs,
+outbox status and the notifications' own status. Failed deliveries are
+retried with exponential backoff up to the template's ``max_retries``.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+from .models import Notification, NotificationOutbox, EmailLog, SMSLog
+from .transports import failed, get_transport, send_chunk
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_RANK = {'low': 0, 'normal': 1, 'high': 2, 'urgent': 3}
+# Emails of these priorities wait for the digest of users who chose one
+DIGEST_PRIORITIES = {'low', 'normal'}
+
+
+def _digestible(notification):
+    return notification.template.notification_type == 'email' and notification.priority in DIGEST_PRIORITIES
+
+
+def enqueue(notifications):
+    """Queue delivery of saved notifications; call inside the transaction that created them"""
+    from .digests import digest_frequencies, next_digest_at
+    now = timezone.now()
+    notifications = list(notifications)
+    frequencies = digest_frequencies(
+        notification.user_id for notification in notifications if _digestible(notification)
+    )
+    rows = []
+    for notification in notifications:
+        template = notification.template
+        available_at = max(notification.scheduled_at or now, now)
+        if template.delay_minutes:
+            available_at += timedelta(minutes=template.delay_minutes)
+        rows.append(NotificationOutbox(
+            notification=notification,
+            channel=template.notification_type,
+            priority=PRIORITY_RANK.get(notification.priority, 1),
+            available_at=available_at,
+            max_attempts=template.max_retries + 1,
+        ))
+        frequency = frequencies.get(notification.user_id)
+        if frequency and _digestible(notification):
+            # Held until the recipient's next digest is sent
+            rows[-1].status = 'held'
+            rows[-1].digest = frequency
+            rows[-1].available_at = max(available_at, next_digest_at(frequency, now))
+    return NotificationOutbox.objects.bulk_create(rows, batch_size=settings.NOTIFICATION_DISPATCH_BATCH_SIZE)
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts``: doubling from the base, capped, with jitter"""
+    delay = settings.NOTIFICATION_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    delay = min(delay, settings.NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def release_expired_claims(now=None):
+    """Return deliveries claimed by workers that died mid-batch to the queue"""
+    now = now or timezone.now()
+    expired = now - timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT_SECONDS)
+    return NotificationOutbox.objects.filter(status='processing', claimed_at__lt=expired).update(
+        status=Case(When(digest='', then=Value('pending')), default=Value('held')),
+        claimed_by='', claimed_at=None, updated_at=now,
+    )
+
+
+def claim(batch_size, worker='dispatcher', now=None, due=None):
+    """Claim up to ``batch_size`` due deliveries (or rows of ``due``) for this worker"""
+    now = now or timezone.now()
+    token = f'{worker}:{uuid.uuid4().hex[:12]}'
+    if due is None:
+        due = NotificationOutbox.objects.filter(status='pending', available_at__lte=now)
+    with transaction.atomic():
+        due = due.order_by('-priority', 'available_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # The status condition keeps two workers apart where SKIP LOCKED is unavailable
+        NotificationOutbox.objects.filter(id__in=ids, status__in=['pending', 'held']).update(
+            status='processing', claimed_by=token, claimed_at=now, updated_at=now
+        )
+    return list(
+        NotificationOutbox.objects.filter(claimed_by=token, status='processing')
+        .select_related('notification__user', 'notification__template').order_by('-priority', 'available_at', 'id')
+    )
+
+
+def recipient(delivery):
+    notification = delivery.notification
+    user = notification.user
+    if delivery.channel == 'email':
+        return notification.email or (user.email if user else '')
+    if delivery.channel == 'sms':
+        return notification.phone or (user.phone if user else '')
+    return str(notification.user_id or '')
+
+
+def build_message(delivery):
+    notification = delivery.notification
+    return {
+        'delivery_id': delivery.id,
+        'notification_id': notification.notification_id,
+        'user_id': notification.user_id,
+        'to': recipient(delivery),
+        'subject': notification.subject,
+        'body': notification.message,
+        'html': notification.html_content,
+    }
+
+
+def record(deliveries, results, now=None, retry_status='pending'):
+    """Persist the outcome of one dispatched batch with bulk writes"""
+    now = now or timezone.now()
+    email_logs, sms_logs = [], []
+    sent, retry, dead = [], [], []
+    for delivery, result in zip(deliveries, results):
+        notification = delivery.notification
+        delivery.attempts += 1
+        delivery.claimed_by = ''
+        delivery.claimed_at = None
+        delivery.updated_at = now
+        status = 'sent' if result.ok else 'failed'
+        if delivery.channel == 'email':
+            email_logs.append(EmailLog(
+                notification=notification, recipient_email=recipient(delivery), subject=notification.subject[:255],
+                status=status, message_id=result.message_id[:100], error_message=result.error,
+            ))
+        elif delivery.channel == 'sms':
+            sms_logs.append(SMSLog(
+                notification=notification, recipient_phone=recipient(delivery)[:20], message=notification.message,
+                status=status, message_id=result.message_id[:100], error_message=result.error,
+            ))
+
+        if result.ok:
+            delivery.status = 'sent'
+            delivery.last_error = ''
+            notification.status = 'sent'
+            notification.sent_at = now
+            sent.append(delivery)
+        else:
+            delivery.last_error = result.error
+            notification.error_message = result.error
+            if delivery.attempts < delivery.max_attempts:
+                delivery.status = retry_status
+                delivery.available_at = now + backoff(delivery.attempts)
+                notification.status = 'pending'
+                retry.append(delivery)
+            else:
+                delivery.status = 'failed'
+                notification.status = 'failed'
+                dead.append(delivery)
+        notification.retry_count = delivery.attempts - 1
+        notification.updated_at = now
+
+    with transaction.atomic():
+        EmailLog.objects.bulk_create(email_logs)
+        SMSLog.objects.bulk_create(sms_logs)
+        NotificationOutbox.objects.bulk_update(
+            deliveries, ['status', 'attempts', 'available_at', 'last_error', 'claimed_by', 'claimed_at', 'updated_at']
+        )
+        Notification.objects.bulk_update(
+            [delivery.notification for delivery in deliveries],
+            ['status', 'sent_at', 'retry_count', 'error_message', 'updated_at'],
+        )
+    return len(sent), len(retry), len(dead)
+
+
+class Dispatcher:
+    """Claims due deliveries and sends them on a pool of ``workers`` threads or processes"""
+
+    def __init__(self, workers=None, batch_size=None, pool=None, chunk_size=None):
+        self.workers = workers or settings.NOTIFICATION_DISPATCH_WORKERS
+        self.batch_size = batch_size or settings.NOTIFICATION_DISPATCH_BATCH_SIZE
+        self.pool = pool or settings.NOTIFICATION_DISPATCH_POOL
+        # Messages handed to one transport call
+        self.chunk_size = chunk_size or max(1, self.batch_size // self.workers)
+        self.name = f'{socket.gethostname()}:{os.getpid()}'[:40]
+        self.stopped = threading.Event()
+        self._executor = None
+
+    def __enter__(self):
+        if self.pool == 'process':
+            # Forked workers must not share the parent's database connections
+            connections.close_all()
+            self._executor = ProcessPoolExecutor(self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='notify')
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def send(self, deliveries):
+        """Deliver claimed rows; returns one DeliveryResult per delivery, in order"""
+        messages = [build_message(delivery) for delivery in deliveries]
+        results = [None] * len(deliveries)
+        pending = []
+        by_channel = {}
+        for index, (delivery, message) in enumerate(zip(deliveries, messages)):
+            if not message['to']:
+                results[index] = failed(f'No {delivery.channel} recipient')
+            else:
+                by_channel.setdefault(delivery.channel, []).append(index)
+
+        for channel, indexes in by_channel.items():
+            for start in range(0, len(indexes), self.chunk_size):
+                chunk = indexes[start:start + self.chunk_size]
+                chunk_messages = [messages[index] for index in chunk]
+                if get_transport(channel).in_process:
+                    pending.append((chunk, None, self._call(channel, chunk_messages)))
+                else:
+                    pending.append((chunk, self._executor.submit(send_chunk, channel, chunk_messages), None))
+
+        for chunk, future, chunk_results in pending:
+            if future is not None:
+                try:
+                    chunk_results = future.result()
+                except Exception as e:
+                    chunk_results = [failed(e)] * len(chunk)
+            for index, result in zip(chunk, chunk_results):
+                results[index] = result
+        return results
+
+    @staticmethod
+    def _call(channel, messages):
+        try:
+            return send_chunk(channel, messages)
+        except Exception as e:
+            return [failed(e)] * len(messages)
+
+    def run_once(self):
+        """Dispatch one batch; returns ``(sent, retried, failed)``"""
+        release_expired_claims()
+        deliveries = claim(self.batch_size, self.name)
+        if not deliveries:
+            return 0, 0, 0
+        return record(deliveries, self.send(deliveries))
+
+    def run(self, poll_interval=5, once=False):
+        """Dispatch until stopped (or until the queue is empty with ``once``)"""
+        totals = [0, 0, 0]
+        while not self.stopped.is_set():
+            counts = self.run_once()
+            totals = [total + count for total, count in zip(totals, counts)]
+            if not any(counts):
+                if once:
+                    break
+                self.stopped.wait(poll_interval)
+        return tuple(totals)
+
+    def stop(self):
+        self.stopped.set()
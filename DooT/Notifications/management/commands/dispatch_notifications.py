@@ -0,0 +1,24 @@
+import signal
+from django.core.management.base import BaseCommand
+from Notifications.dispatch import Dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued notifications from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Defaults to NOTIFICATION_DISPATCH_WORKERS')
+        parser.add_argument('--batch-size', type=int, help='Defaults to NOTIFICATION_DISPATCH_BATCH_SIZE')
+        parser.add_argument('--pool', choices=['thread', 'process'], help='Defaults to NOTIFICATION_DISPATCH_POOL')
+        parser.add_argument('--poll-interval', type=float, default=5)
+        parser.add_argument('--once', action='store_true', help='Exit once no deliveries are due')
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher(workers=options['workers'], batch_size=options['batch_size'], pool=options['pool'])
+        signal.signal(signal.SIGTERM, lambda *args: dispatcher.stop())
+        with dispatcher:
+            try:
+                sent, retried, failed = dispatcher.run(poll_interval=options['poll_interval'], once=options['once'])
+            except KeyboardInterrupt:
+                return
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent}, scheduled {retried} retries, {failed} failed'))
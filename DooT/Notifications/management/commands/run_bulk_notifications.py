@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from Notifications.bulk import run_job
+from Notifications.models import BulkNotificationJob
+
+
+class Command(BaseCommand):
+    help = 'Run pending bulk notification jobs and resume interrupted ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Defaults to every pending, running or failed job')
+        parser.add_argument('--chunk-size', type=int, help='Defaults to NOTIFICATION_BULK_CHUNK_SIZE')
+
+    def handle(self, *args, **options):
+        job_ids = options['job_ids'] or list(
+            BulkNotificationJob.objects.filter(status__in=['pending', 'running', 'failed'])
+            .order_by('id').values_list('id', flat=True)
+        )
+        for job_id in job_ids:
+            job = run_job(job_id, chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Job {job.id}: {job.status}, {job.processed_users}/{job.total_users} users'
+            ))
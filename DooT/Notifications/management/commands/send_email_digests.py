@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from Notifications.digests import send_digests
+
+
+class Command(BaseCommand):
+    help = 'Send the daily/weekly email digests that are due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frequency', choices=['daily', 'weekly'], help='Defaults to both')
+        parser.add_argument('--users-per-batch', type=int, help='Defaults to NOTIFICATION_DIGEST_USERS_PER_BATCH')
+
+    def handle(self, *args, **options):
+        sent, retried, failed = send_digests(frequency=options['frequency'], users_per_batch=options['users_per_batch'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Delivered {sent} notifications in digests, {retried} to retry, {failed} failed'
+        ))
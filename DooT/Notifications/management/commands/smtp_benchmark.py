@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from Notifications.smtp import SMTPConnectionPool, PooledSMTPTransport
+
+
+class Command(BaseCommand):
+    help = 'Send test messages through the pooled SMTP transport (point EMAIL_HOST/EMAIL_PORT at a local sink)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--to', default='sink@example.com')
+
+    def handle(self, *args, **options):
+        pool = SMTPConnectionPool(size=options['workers'])
+        transport = PooledSMTPTransport(pool)
+        messages = [
+            {'to': options['to'], 'subject': f'Benchmark {index}', 'body': 'Pooled SMTP benchmark message', 'html': ''}
+            for index in range(options['count'])
+        ]
+        size = options['batch_size']
+        batches = [messages[start:start + size] for start in range(0, len(messages), size)]
+        with ThreadPoolExecutor(options['workers']) as executor:
+            results = [result for batch in executor.map(transport.send_batch, batches) for result in batch]
+        pool.close()
+
+        failures = sum(1 for result in results if not result.ok)
+        self.stdout.write(self.style.SUCCESS(f'Sent {len(results) - failures} of {len(results)} messages'))
+        for name, value in pool.metrics().items():
+            self.stdout.write(f'{name}: {value}')
@@ -5,6 +5,10 @@ from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 import uuid
 
+def new_notification_id():
+    # 16 hex digits keep collisions negligible for million-user broadcasts
+    return f"NOTIF-{uuid.uuid4().hex[:16].upper()}"
+
 class NotificationTemplate(models.Model):
     NOTIFICATION_TYPE_CHOICES = [
         ('email', 'Email'),
@@ -55,6 +59,15 @@ class NotificationTemplate(models.Model):
     def __str__(self):
         return f"{self.name} - {self.get_trigger_display()}"
 
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        from .templating import CompiledTemplate, TemplateError
+        if self.available_variables:
+            try:
+                CompiledTemplate(self).validate(self.available_variables)
+            except TemplateError as e:
+                raise ValidationError(str(e))
+
 class Notification(models.Model):
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -109,7 +122,7 @@ class Notification(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.notification_id:
-            self.notification_id = f"NOTIF-{uuid.uuid4().hex[:8].upper()}"
+            self.notification_id = new_notification_id()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -124,6 +137,97 @@ class Notification(models.Model):
     def can_retry(self):
         return self.status == 'failed' and self.retry_count < self.template.max_retries
 
+class NotificationOutbox(models.Model):
+    """A pending delivery of a notification over one channel.
+
+    Rows are written in the same transaction as their notification and
+    claimed in batches by ``Notifications.dispatch``.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('held', 'Held for digest'),
+        ('processing', 'Processing'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='deliveries')
+    channel = models.CharField(max_length=20, choices=NotificationTemplate.NOTIFICATION_TYPE_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Higher is more urgent (see Notifications.dispatch.PRIORITY_RANK)
+    priority = models.PositiveSmallIntegerField(default=1)
+    available_at = models.DateTimeField(default=timezone.now)
+    # 'daily'/'weekly' for emails held for the recipient's digest (see Notifications.digests)
+    digest = models.CharField(max_length=10, blank=True)
+
+    # Retries
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=1)
+    last_error = models.TextField(blank=True)
+
+    # Claim held by a dispatcher worker
+    claimed_by = models.CharField(max_length=64, blank=True, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-priority', 'available_at', 'id']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'available_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} delivery of {self.notification_id} - {self.status}"
+
+class BulkNotificationJob(models.Model):
+    """A notification broadcast, fanned out in the background by ``Notifications.bulk``"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    template = models.ForeignKey(NotificationTemplate, on_delete=models.CASCADE, related_name='bulk_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='bulk_notification_jobs')
+
+    # Audience: the listed users, or every active user when empty, narrowed by
+    # the ``audience`` targeting spec (``Promotions.segments``) if one is set
+    user_ids = models.JSONField(default=list, blank=True)
+    audience = models.JSONField(default=dict, blank=True)
+    campaign = models.ForeignKey(
+        'Promotions.Campaign', on_delete=models.SET_NULL, null=True, blank=True, related_name='notification_jobs'
+    )
+    context_data = models.JSONField(default=dict, blank=True)
+    priority = models.CharField(max_length=20, choices=Notification.PRIORITY_CHOICES, default='normal')
+    scheduled_at = models.DateTimeField(null=True, blank=True)
+
+    # Progress; users are processed in id order and last_user_id is committed with each chunk
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_users = models.PositiveIntegerField(default=0)
+    processed_users = models.PositiveIntegerField(default=0)
+    last_user_id = models.BigIntegerField(default=0)
+    error_message = models.TextField(blank=True)
+
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Bulk {self.template.name} - {self.status} ({self.processed_users}/{self.total_users})"
+
+    @property
+    def progress(self):
+        return round(self.processed_users * 100 / self.total_users, 2) if self.total_users else 0
+
 class UserNotification(models.Model):
     """In-app notifications for users"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_notifications')
@@ -152,10 +256,36 @@ class UserNotification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves the unread count when it is not cached
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='usernotification_unread_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.user.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored read state so save() can keep the unread counter in step
+        instance._stored_is_read = instance.__dict__.get('is_read')
+        return instance
+
+    def save(self, *args, **kwargs):
+        from . import counters, realtime
+        adding = self._state.adding
+        stored_is_read = None if adding else getattr(self, '_stored_is_read', None)
+        super().save(*args, **kwargs)
+        if adding:
+            realtime.publish_on_commit([(self.user_id, realtime.notification_event(self))])
+            if not self.is_read:
+                counters.adjust(self.user_id, 1)
+        elif stored_is_read is None:
+            counters.reset(self.user_id)
+        elif stored_is_read != self.is_read:
+            counters.adjust(self.user_id, -1 if self.is_read else 1)
+        self._stored_is_read = self.is_read
+
     def mark_as_read(self):
         if not self.is_read:
             self.is_read = True
@@ -182,6 +312,9 @@ class EmailLog(models.Model):
 
     class Meta:
         ordering = ['-sent_at']
+        indexes = [
+            models.Index(fields=['sent_at'], name='emaillog_sent_at_idx'),
+        ]
 
     def __str__(self):
         return f"Email to {self.recipient_email} - {self.status}"
@@ -206,10 +339,38 @@ class SMSLog(models.Model):
 
     class Meta:
         ordering = ['-sent_at']
+        indexes = [
+            models.Index(fields=['sent_at'], name='smslog_sent_at_idx'),
+        ]
 
     def __str__(self):
         return f"SMS to {self.recipient_phone} - {self.status}"
 
+class DeliveryLogSummary(models.Model):
+    """Daily email/SMS delivery counts of log rows removed by the retention purge.
+
+    Statistics add these to the counts of the live EmailLog/SMSLog rows, so
+    they stay correct after old rows are gone.
+    """
+    CHANNEL_CHOICES = [
+        ('email', 'Email'),
+        ('sms', 'SMS'),
+    ]
+
+    day = models.DateField()
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    status = models.CharField(max_length=20, choices=Notification.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+    cost = models.DecimalField(max_digits=12, decimal_places=4, default=0, help_text="Summed SMS cost")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'channel', 'status'], name='unique_delivery_log_summary'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.channel} - {self.status}: {self.count}"
+
 class NotificationPreference(models.Model):
     """User preferences for different types of notifications"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_preferences')
@@ -0,0 +1,220 @@
+"""Server push of in-app notifications.
+
+Connected clients hold a Server-Sent Events stream (``stream/``, served by
+the ASGI application) instead of polling ``count/`` and the notification
+list. New UserNotification rows and unread-count changes are published to
+the recipient's channel once the writing transaction commits.
+
+The pub/sub backend is configured by ``NOTIFICATION_STREAM_BACKEND``:
+``InProcessBackend`` delivers to streams served by the same process (single
+node), ``RedisBackend`` fans out through Redis pub/sub so a publish on any
+node reaches streams on every node.
+
+In-app notifications are mostly created by the dispatcher, a separate
+process whose publishes never reach an ``InProcessBackend``. That backend
+therefore also polls for new unread rows of its connected users every
+``NOTIFICATION_STREAM_POLL_SECONDS`` and pushes the ones it has not
+delivered yet.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessBackend:
+    """Per-process subscriber registry; publishers may run in any thread"""
+
+    # Rows are looked for this far back, so rows committed late are not missed
+    POLL_LOOKBACK = timedelta(seconds=60)
+    # Delivered notification ids remembered so polling does not repeat them
+    SEEN_SIZE = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        # user id -> when its first open stream subscribed
+        self._since = {}
+        self._seen = OrderedDict()
+        self._poller = None
+
+    def _mark_seen(self, notification_id):
+        """Remember a delivered notification; False if it was delivered before"""
+        with self._lock:
+            if notification_id in self._seen:
+                return False
+            self._seen[notification_id] = True
+            if len(self._seen) > self.SEEN_SIZE:
+                self._seen.popitem(last=False)
+            return True
+
+    def publish_many(self, events):
+        for user_id, event in events:
+            if event['type'] == 'notification':
+                self._mark_seen(event['notification']['id'])
+            with self._lock:
+                subscribers = list(self._subscribers.get(user_id, ()))
+            for loop, queue in subscribers:
+                try:
+                    loop.call_soon_threadsafe(self._offer, queue, event)
+                except RuntimeError:
+                    # The subscriber's event loop has closed
+                    pass
+
+    @staticmethod
+    def _offer(queue, event):
+        if queue.full():
+            # A stalled client loses its oldest events rather than growing the queue
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    async def subscribe(self, user_id, timeout=None):
+        """Async iterator of the user's events, yielding None after ``timeout`` seconds without one"""
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=settings.NOTIFICATION_STREAM_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(entry)
+            self._since.setdefault(user_id, timezone.now())
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll, name='notification-stream-poller', daemon=True)
+                self._poller.start()
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(entry[1].get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(user_id, set())
+                subscribers.discard(entry)
+                if not subscribers:
+                    self._subscribers.pop(user_id, None)
+                    self._since.pop(user_id, None)
+
+    def _poll(self):
+        while True:
+            time.sleep(settings.NOTIFICATION_STREAM_POLL_SECONDS)
+            with self._lock:
+                since = dict(self._since)
+            if not since:
+                continue
+            close_old_connections()
+            try:
+                self.publish_many(self._new_notification_events(since))
+            except Exception:
+                logger.exception('Could not poll for new in-app notifications')
+
+    def _new_notification_events(self, since):
+        """Events for unread rows of ``since``'s users created since they subscribed and not delivered yet"""
+        from .models import UserNotification
+        oldest = max(min(since.values()), timezone.now() - self.POLL_LOOKBACK)
+        rows = UserNotification.objects.filter(
+            user_id__in=list(since), is_read=False, created_at__gte=oldest
+        ).order_by('id')
+        events, users = [], set()
+        for row in rows:
+            if row.created_at >= since[row.user_id] and self._mark_seen(row.id):
+                events.append((row.user_id, notification_event(row)))
+                users.add(row.user_id)
+        for user_id in users:
+            count = UserNotification.objects.filter(user_id=user_id, is_read=False).count()
+            events.append((user_id, unread_count_event(count)))
+        return events
+
+
+class RedisBackend:
+    """Redis pub/sub on one channel per user, for streams spread over several nodes"""
+
+    def __init__(self):
+        import redis
+        self.url = settings.NOTIFICATION_STREAM_REDIS_URL
+        self._client = redis.Redis.from_url(self.url)
+
+    @staticmethod
+    def channel(user_id):
+        return f'notifications:stream:{user_id}'
+
+    def publish_many(self, events):
+        pipeline = self._client.pipeline(transaction=False)
+        for user_id, event in events:
+            pipeline.publish(self.channel(user_id), json.dumps(event, default=str))
+        pipeline.execute()
+
+    async def subscribe(self, user_id, timeout=None):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(self.channel(user_id))
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+                yield json.loads(message['data']) if message else None
+        finally:
+            await pubsub.unsubscribe(self.channel(user_id))
+            await pubsub.close()
+            await client.close()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.NOTIFICATION_STREAM_BACKEND)()
+    return _backend
+
+
+def publish(events):
+    """Publish ``(user_id, event)`` pairs now"""
+    if not events:
+        return
+    try:
+        get_backend().publish_many(events)
+    except Exception:
+        # Streams are best effort; clients resync from the REST endpoints
+        logger.exception('Could not publish %d notification stream events', len(events))
+
+
+def publish_on_commit(events):
+    """Publish ``(user_id, event)`` pairs once the current transaction commits"""
+    events = list(events)
+    if events:
+        transaction.on_commit(lambda: publish(events))
+
+
+def notification_event(notification):
+    return {
+        'type': 'notification',
+        'notification': {
+            'id': notification.id,
+            'title': notification.title,
+            'message': notification.message,
+            'notification_type': notification.notification_type,
+            'icon': notification.icon,
+            'action_url': notification.action_url,
+            'action_text': notification.action_text,
+            'created_at': notification.created_at.isoformat() if notification.created_at else None,
+        },
+    }
+
+
+def unread_count_event(count):
+    """``count`` is None when the new value is not known; clients then refetch ``count/``"""
+    return {'type': 'unread_count', 'count': count}
+
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
@@ -1,5 +1,11 @@
 from rest_framework import serializers
-from .models import NotificationTemplate, Notification, UserNotification, EmailLog, SMSLog, NotificationPreference
+from django.db import transaction
+from .models import (
+    NotificationTemplate, Notification, UserNotification, EmailLog, SMSLog, NotificationPreference,
+    BulkNotificationJob,
+)
+from .dispatch import enqueue
+from .templating import TemplateError, compile_template, render_notification
 
 class NotificationTemplateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,38 +24,28 @@ class NotificationSerializer(serializers.ModelSerializer):
 class NotificationCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = ['template', 'recipient', 'related_object_type', 'related_object_id', 'context_data', 'scheduled_at']
-    
+        fields = ['template', 'user', 'email', 'phone', 'subject', 'message', 'html_content',
+                 'priority', 'scheduled_at', 'metadata']
+        extra_kwargs = {'message': {'required': False, 'allow_blank': True}}
+
+    def validate(self, attrs):
+        if not attrs.get('user') and not attrs.get('email') and not attrs.get('phone'):
+            raise serializers.ValidationError("A user, email or phone recipient is required")
+        return attrs
+
     def create(self, validated_data):
-        # Get template
-        template = validated_data['template']
-        
-        # Create notification
-        notification = Notification.objects.create(
-            template=template,
-            recipient=validated_data['recipient'],
-            related_object_type=validated_data.get('related_object_type'),
-            related_object_id=validated_data.get('related_object_id'),
-            context_data=validated_data.get('context_data', {}),
-            scheduled_at=validated_data.get('scheduled_at')
-        )
-        
-        # Create user notification
-        UserNotification.objects.create(
-            user=validated_data['recipient'],
-            notification=notification,
-            is_read=False
-        )
-        
+        # Rendered content and the outbox row are committed together
+        with transaction.atomic():
+            notification = render_notification(Notification(**validated_data))
+            notification.save()
+            enqueue([notification])
         return notification
 
 class UserNotificationSerializer(serializers.ModelSerializer):
-    notification = NotificationSerializer(read_only=True)
-    notification_id = serializers.IntegerField(write_only=True)
-    
     class Meta:
         model = UserNotification
-        fields = ['id', 'notification', 'notification_id', 'is_read', 'read_at', 'created_at']
+        fields = ['id', 'title', 'message', 'notification_type', 'icon', 'is_read', 'is_archived',
+                 'action_url', 'action_text', 'created_at', 'read_at']
         read_only_fields = ['id', 'created_at']
 
 class UserNotificationUpdateSerializer(serializers.ModelSerializer):
@@ -82,17 +78,31 @@ class NotificationPreferenceUpdateSerializer(serializers.ModelSerializer):
 
 class BulkNotificationSerializer(serializers.Serializer):
     template_id = serializers.IntegerField()
-    user_ids = serializers.ListField(child=serializers.IntegerField())
+    # Omit to notify every active user
+    user_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
     context_data = serializers.JSONField(required=False)
+    priority = serializers.ChoiceField(choices=Notification.PRIORITY_CHOICES, required=False)
     scheduled_at = serializers.DateTimeField(required=False)
     
     def validate_template_id(self, value):
         try:
-            NotificationTemplate.objects.get(id=value)
+            template = NotificationTemplate.objects.get(id=value)
         except NotificationTemplate.DoesNotExist:
             raise serializers.ValidationError("Invalid notification template")
+        try:
+            compile_template(template, validate=True)
+        except TemplateError as e:
+            raise serializers.ValidationError(str(e))
         return value
 
+class BulkNotificationJobSerializer(serializers.ModelSerializer):
+    template_name = serializers.CharField(source='template.name', read_only=True)
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = BulkNotificationJob
+        exclude = ['user_ids']
+
 class NotificationFilterSerializer(serializers.Serializer):
     notification_type = serializers.CharField(required=False)
     is_read = serializers.BooleanField(required=False)
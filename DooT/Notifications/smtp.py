@@ -0,0 +1,253 @@
+"""Pooled SMTP delivery.
+
+Opening an SMTP session (TCP, EHLO, STARTTLS, AUTH) costs far more than
+sending one message over it, so ``SMTPConnectionPool`` keeps up to
+``NOTIFICATION_SMTP_POOL_SIZE`` authenticated sessions open and lends one
+to each batch. A message the server rejects (bad recipient, content
+refused) fails on its own and the session carries on; a dropped session is
+reopened and the message retried once. ``metrics()`` reports throughput.
+
+``PooledSMTPTransport`` plugs the pool into the notification dispatcher
+(``NOTIFICATION_TRANSPORTS['email']``) and ``PooledEmailBackend`` into
+Django's ``send_mail`` (``EMAIL_BACKEND``). Point ``EMAIL_HOST``/``EMAIL_PORT``
+at a local sink (``python -m aiosmtpd -n -l localhost:1025``) to try it out.
+"""
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import make_msgid
+from .transports import BaseTransport, delivered, failed
+
+# Errors that concern one message; the session stays usable (smtplib has already sent RSET)
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+# Errors that mean the session is gone. Every SMTPException is an OSError, so
+# MESSAGE_ERRORS must be caught before these
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+class PooledConnection:
+    __slots__ = ('smtp', 'opened_at', 'last_used', 'messages')
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.opened_at = self.last_used = time.monotonic()
+        self.messages = 0
+
+
+class SMTPConnectionPool:
+    def __init__(self, host=None, port=None, username=None, password=None, use_tls=None, use_ssl=None,
+                 timeout=None, size=None, max_messages=None, idle_timeout=None):
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.use_tls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.use_ssl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.timeout = timeout or settings.EMAIL_TIMEOUT or 30
+        self.size = size or settings.NOTIFICATION_SMTP_POOL_SIZE
+        # Servers limit messages per session; recycle before hitting the limit
+        self.max_messages = max_messages or settings.NOTIFICATION_SMTP_MAX_MESSAGES_PER_CONNECTION
+        # Idle sessions are checked with NOOP before reuse, servers drop them eventually
+        self.idle_timeout = idle_timeout or settings.NOTIFICATION_SMTP_IDLE_TIMEOUT_SECONDS
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._metrics = {
+            'messages_sent': 0, 'messages_failed': 0, 'bytes_sent': 0,
+            'connections_opened': 0, 'reconnects': 0, 'send_seconds': 0.0,
+        }
+        self._started = time.monotonic()
+
+    # Connections
+    def _open(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        self._count('connections_opened')
+        return PooledConnection(smtp)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.smtp.close()
+
+    def _usable(self, connection):
+        if connection.messages >= self.max_messages:
+            return False
+        if time.monotonic() - connection.last_used > self.idle_timeout:
+            try:
+                return connection.smtp.noop()[0] == 250
+            except CONNECTION_ERRORS:
+                return False
+        return True
+
+    def acquire(self):
+        """Borrow a session, opening one if none is idle (blocks while ``size`` are lent out)"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._open()
+                if self._usable(connection):
+                    return connection
+                self._close(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, broken=False):
+        if broken or connection.messages >= self.max_messages:
+            self._close(connection)
+        else:
+            connection.last_used = time.monotonic()
+            self._idle.put(connection)
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    # Sending
+    def _send_one(self, connection, from_email, recipients, data):
+        connection.smtp.sendmail(from_email, recipients, data)
+        connection.messages += 1
+        connection.last_used = time.monotonic()
+
+    def send_many(self, envelopes):
+        """Send ``(from_email, recipients, message bytes)`` over one session; returns an error (or None) per message"""
+        errors = []
+        connection = self.acquire()
+        started = time.monotonic()
+        try:
+            for from_email, recipients, data in envelopes:
+                try:
+                    if connection.messages >= self.max_messages:
+                        self._close(connection)
+                        connection = self._open()
+                    try:
+                        self._send_one(connection, from_email, recipients, data)
+                    except MESSAGE_ERRORS:
+                        raise
+                    except CONNECTION_ERRORS:
+                        # The server dropped the session: reconnect and retry this message once
+                        self._close(connection)
+                        connection = self._open()
+                        self._count('reconnects')
+                        self._send_one(connection, from_email, recipients, data)
+                except MESSAGE_ERRORS as e:
+                    errors.append(e)
+                    self._count('messages_failed')
+                except CONNECTION_ERRORS as e:
+                    # Still unreachable: fail the rest of the batch, the dispatcher retries it later
+                    remaining = len(envelopes) - len(errors)
+                    errors.extend([e] * remaining)
+                    self._count('messages_failed', remaining)
+                    connection = None
+                    break
+                else:
+                    errors.append(None)
+                    self._count('messages_sent')
+                    self._count('bytes_sent', len(data))
+        finally:
+            self._count('send_seconds', time.monotonic() - started)
+            if connection is None:
+                self._slots.release()
+            else:
+                self.release(connection)
+        return errors
+
+    # Metrics
+    def _count(self, name, value=1):
+        with self._lock:
+            self._metrics[name] += value
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        elapsed = time.monotonic() - self._started
+        metrics['idle_connections'] = self._idle.qsize()
+        metrics['messages_per_second'] = round(metrics['messages_sent'] / elapsed, 2) if elapsed else 0.0
+        metrics['messages_per_connection'] = (
+            round(metrics['messages_sent'] / metrics['connections_opened'], 2) if metrics['connections_opened'] else 0.0
+        )
+        return metrics
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide pool built from the EMAIL_* settings"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SMTPConnectionPool()
+    return _pool
+
+
+def _envelope(email):
+    return email.from_email, email.recipients(), email.message().as_bytes(linesep='\r\n')
+
+
+class PooledSMTPTransport(BaseTransport):
+    """Notification transport sending each batch over one pooled SMTP session"""
+
+    def __init__(self, pool=None):
+        self.pool = pool
+
+    def send_batch(self, messages):
+        pool = self.pool or get_pool()
+        emails, message_ids = [], []
+        for message in messages:
+            message_id = make_msgid()
+            email = EmailMultiAlternatives(
+                message['subject'], message['body'], settings.DEFAULT_FROM_EMAIL, [message['to']],
+                headers={'Message-ID': message_id},
+            )
+            if message.get('html'):
+                email.attach_alternative(message['html'], 'text/html')
+            emails.append(email)
+            message_ids.append(message_id)
+        errors = pool.send_many([_envelope(email) for email in emails])
+        return [
+            delivered(message_id) if error is None else failed(error)
+            for message_id, error in zip(message_ids, errors)
+        ]
+
+
+class PooledEmailBackend(BaseEmailBackend):
+    """Django email backend on top of the shared SMTP pool"""
+
+    def send_messages(self, email_messages):
+        email_messages = [email for email in email_messages if email.recipients()]
+        if not email_messages:
+            return 0
+        try:
+            errors = get_pool().send_many([_envelope(email) for email in email_messages])
+        except Exception:
+            if not self.fail_silently:
+                raise
+            return 0
+        failures = [error for error in errors if error is not None]
+        if failures and not self.fail_silently:
+            raise failures[0]
+        return len(errors) - len(failures)
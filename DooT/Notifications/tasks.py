@@ -0,0 +1,44 @@
+"""Background notification work (see DooT.celery)."""
+import logging
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from .bulk import run_job
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(acks_late=True)
+def run_bulk_notification_job(job_id):
+    """Fan out a BulkNotificationJob; safe to re-run, it resumes from the last committed chunk"""
+    job = run_job(job_id)
+    return {'job_id': job.id, 'status': job.status, 'processed_users': job.processed_users}
+
+
+def enqueue_bulk_job(job_id):
+    """Start the job once the transaction that created it commits.
+
+    Fanning out a large audience takes minutes, so it needs a Celery broker
+    (``CELERY_BROKER_URL``). Without one tasks run eagerly inside the
+    request; the job is left pending for ``manage.py run_bulk_notifications``
+    instead.
+    """
+    def dispatch():
+        if settings.CELERY_TASK_ALWAYS_EAGER:
+            logger.info('No Celery broker: bulk notification job %s waits for run_bulk_notifications', job_id)
+            return
+        try:
+            run_bulk_notification_job.delay(job_id)
+        except Exception:
+            # The job stays pending and can be started with `manage.py run_bulk_notifications`
+            logger.exception('Could not queue bulk notification job %s', job_id)
+
+    transaction.on_commit(dispatch)
+
+
+@shared_task
+def send_email_digests(frequency=None):
+    """Periodic entry point for the email digests (schedule hourly or at NOTIFICATION_DIGEST_HOUR)"""
+    from .digests import send_digests
+    sent, retried, failed = send_digests(frequency=frequency)
+    return {'sent': sent, 'retried': retried, 'failed': failed}
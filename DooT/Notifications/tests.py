@@ -1,3 +1,85 @@
-from django.test import TestCase
+import socketserver
+import threading
+from django.test import SimpleTestCase
+from .smtp import SMTPConnectionPool
 
-# Create your tests here.
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept messages, refusing ``rejected@example.com``"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 sink ready')
+        for raw in self.rfile:
+            command = raw.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif verb == 'RCPT':
+                if 'rejected@example.com' in command:
+                    self.reply('550 no such user')
+                else:
+                    self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 go ahead')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                self.server.delivered += 1
+                self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                # MAIL, RSET, NOOP
+                self.reply('250 ok')
+
+
+class _Sink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SinkHandler)
+        self.delivered = 0
+
+
+class SMTPConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.sink = _Sink()
+        threading.Thread(target=self.sink.serve_forever, daemon=True).start()
+        self.pool = SMTPConnectionPool(
+            host='127.0.0.1', port=self.sink.server_address[1], username='', password='',
+            use_tls=False, use_ssl=False, timeout=5, size=1, max_messages=100, idle_timeout=60,
+        )
+
+    def tearDown(self):
+        self.pool.close()
+        self.sink.shutdown()
+        self.sink.server_close()
+
+    def test_rejected_recipient_keeps_the_session(self):
+        recipients = [f'user{i}@example.com' for i in range(7)]
+        recipients[3] = 'rejected@example.com'
+        envelopes = [('from@example.com', [to], b'Subject: hi\r\n\r\nhello\r\n') for to in recipients]
+
+        sent = []
+        send_one = self.pool._send_one
+
+        def record(connection, from_email, to, data):
+            sent.append(to[0])
+            send_one(connection, from_email, to, data)
+
+        self.pool._send_one = record
+        errors = self.pool.send_many(envelopes)
+
+        self.assertEqual([error is None for error in errors], [True, True, True, False, True, True, True])
+        self.assertEqual(sent, recipients)
+        metrics = self.pool.metrics()
+        self.assertEqual(metrics['reconnects'], 0)
+        self.assertEqual(metrics['connections_opened'], 1)
+        self.assertEqual(metrics['messages_sent'], 6)
+        self.assertEqual(metrics['messages_failed'], 1)
+        self.assertEqual(self.sink.delivered, 6)
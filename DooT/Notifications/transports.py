@@ -0,0 +1,138 @@
+"""Delivery transports used by the notification dispatcher.
+
+A transport delivers a batch of messages over one channel and reports a
+``DeliveryResult`` per message, so one bad address does not fail the rest
+of the batch. Messages are plain dicts (picklable, for process pools):
+``delivery_id``, ``notification_id``, ``user_id``, ``to``, ``subject``,
+``body`` and ``html``. The transport for each channel is configured in
+``settings.NOTIFICATION_TRANSPORTS``.
+"""
+import logging
+import threading
+import uuid
+from collections import namedtuple
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.message import make_msgid
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DeliveryResult = namedtuple('DeliveryResult', ['ok', 'message_id', 'error'])
+
+
+def delivered(message_id=''):
+    return DeliveryResult(True, message_id, '')
+
+
+def failed(error):
+    return DeliveryResult(False, '', str(error))
+
+
+class BaseTransport:
+    # Transports that write to the database run in the dispatcher's thread, not in the pool
+    in_process = False
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            try:
+                results.append(self.send(message))
+            except Exception as e:
+                results.append(failed(e))
+        return results
+
+
+class EmailTransport(BaseTransport):
+    """Send through Django's configured EMAIL_BACKEND, one connection per batch"""
+
+    def send_batch(self, messages):
+        results = []
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            for message in messages:
+                message_id = make_msgid()
+                email = EmailMultiAlternatives(
+                    message['subject'], message['body'], settings.DEFAULT_FROM_EMAIL, [message['to']],
+                    connection=connection, headers={'Message-ID': message_id},
+                )
+                if message.get('html'):
+                    email.attach_alternative(message['html'], 'text/html')
+                try:
+                    email.send()
+                    results.append(delivered(message_id))
+                except Exception as e:
+                    results.append(failed(e))
+        finally:
+            connection.close()
+        return results
+
+
+class LogTransport(BaseTransport):
+    """Log the message instead of sending it; used for channels without a provider (SMS, push)"""
+
+    def send(self, message):
+        logger.info('Notification %s to %s: %s', message['notification_id'], message['to'], message['body'])
+        return delivered(uuid.uuid4().hex)
+
+
+class InAppTransport(BaseTransport):
+    """Deliver as UserNotification rows"""
+    in_process = True
+
+    def send_batch(self, messages):
+        from .counters import adjust_many
+        from .models import UserNotification
+        from .realtime import notification_event, publish_on_commit
+        rows = [
+            UserNotification(user_id=message['user_id'], title=message['subject'] or 'Notification', message=message['body'])
+            for message in messages if message['user_id']
+        ]
+        UserNotification.objects.bulk_create(rows)
+        publish_on_commit((row.user_id, notification_event(row)) for row in rows)
+        # bulk_create bypasses save(), which maintains the unread counters
+        unread = {}
+        for row in rows:
+            unread[row.user_id] = unread.get(row.user_id, 0) + 1
+        adjust_many(unread)
+        return [delivered() if message['user_id'] else failed('Notification has no user') for message in messages]
+
+
+class FakeTransport(BaseTransport):
+    """In-memory transport for tests: records messages, fails recipients listed in ``fail_for``"""
+    sent = []
+    fail_for = set()
+    _lock = threading.Lock()
+
+    def send(self, message):
+        if message['to'] in self.fail_for:
+            return failed(f"Delivery to {message['to']} refused")
+        with self._lock:
+            self.sent.append(message)
+        return delivered(f'fake-{len(self.sent)}')
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.sent.clear()
+            cls.fail_for.clear()
+
+
+_transports = {}
+
+
+def get_transport(channel):
+    """The configured transport for ``channel`` (one instance per process)"""
+    if channel not in _transports:
+        path = settings.NOTIFICATION_TRANSPORTS.get(channel, 'Notifications.transports.LogTransport')
+        _transports[channel] = import_string(path)()
+    return _transports[channel]
+
+
+def send_chunk(channel, messages):
+    """Pool entry point: deliver ``messages`` with the channel's transport"""
+    return get_transport(channel).send_batch(messages)
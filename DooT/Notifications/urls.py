@@ -20,10 +20,12 @@ urlpatterns = [
     path('mark-all-read/', views.mark_all_read, name='mark-all-read'),
     path('mark-read/<int:notification_id>/', views.mark_notification_read, name='mark-read'),
     path('count/', views.notification_count, name='notification-count'),
+    path('stream/', views.notification_stream, name='notification-stream'),
     
     # Admin Functions
     path('admin/create/', views.NotificationCreateView.as_view(), name='create'),
     path('admin/bulk/', views.BulkNotificationView.as_view(), name='bulk-create'),
+    path('admin/bulk/<int:pk>/', views.BulkNotificationJobDetailView.as_view(), name='bulk-job-detail'),
     path('admin/statistics/', views.notification_statistics, name='statistics'),
     
     # Delivery Logs (Admin)
@@ -4,16 +4,25 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Sum
 from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
-from .models import NotificationTemplate, Notification, UserNotification, EmailLog, SMSLog, NotificationPreference
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from .models import NotificationTemplate, Notification, UserNotification, EmailLog, SMSLog, NotificationPreference, BulkNotificationJob, DeliveryLogSummary
 from .serializers import (
     NotificationTemplateSerializer, NotificationSerializer, NotificationCreateSerializer,
     UserNotificationSerializer, UserNotificationUpdateSerializer, EmailLogSerializer,
     SMSLogSerializer, NotificationPreferenceSerializer, NotificationPreferenceUpdateSerializer,
-    BulkNotificationSerializer, NotificationFilterSerializer
+    BulkNotificationSerializer, BulkNotificationJobSerializer, NotificationFilterSerializer
 )
+from .tasks import enqueue_bulk_job
+from . import counters, realtime
 
 # Keep generics for simple listing and retrieval
 class NotificationTemplateListView(generics.ListAPIView):
@@ -27,19 +36,21 @@ class NotificationTemplateDetailView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAdminUser]
 
 class EmailLogListView(generics.ListAPIView):
+    queryset = EmailLog.objects.all()
     serializer_class = EmailLogSerializer
     permission_classes = [permissions.IsAdminUser]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['status', 'recipient']
-    ordering_fields = ['sent_at', 'created_at']
+    filterset_fields = ['status', 'recipient_email']
+    ordering_fields = ['sent_at']
     ordering = ['-sent_at']
 
 class SMSLogListView(generics.ListAPIView):
+    queryset = SMSLog.objects.all()
     serializer_class = SMSLogSerializer
     permission_classes = [permissions.IsAdminUser]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['status', 'recipient']
-    ordering_fields = ['sent_at', 'created_at']
+    filterset_fields = ['status', 'recipient_phone']
+    ordering_fields = ['sent_at']
     ordering = ['-sent_at']
 
 # Convert to APIView for custom operations
@@ -62,7 +73,7 @@ class UserNotificationListView(APIView):
             
             # Apply filters
             if notification_type:
-                queryset = queryset.filter(notification__template__notification_type=notification_type)
+                queryset = queryset.filter(notification_type=notification_type)
             
             if is_read is not None:
                 queryset = queryset.filter(is_read=is_read.lower() == 'true')
@@ -91,7 +102,7 @@ class UserNotificationListView(APIView):
                 'page': page,
                 'page_size': page_size,
                 'total_pages': (total_count + page_size - 1) // page_size,
-                'unread_count': UserNotification.objects.filter(user=request.user, is_read=False).count()
+                'unread_count': counters.unread_count(request.user.id)
             })
             
         except Exception as e:
@@ -154,14 +165,11 @@ class NotificationCreateView(APIView):
         serializer = NotificationCreateSerializer(data=request.data)
         if serializer.is_valid():
             try:
-                # Create notification
+                # Create notification; delivery is queued for the dispatcher
                 notification = serializer.save()
                 
-                # Send notification based on template type
-                self._send_notification(notification)
-                
                 return Response({
-                    'message': 'Notification created and sent successfully',
+                    'message': 'Notification created and queued for delivery',
                     'notification': NotificationSerializer(notification).data
                 }, status=status.HTTP_201_CREATED)
                 
@@ -171,165 +179,30 @@ class NotificationCreateView(APIView):
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
-    def _send_notification(self, notification):
-        """Send notification based on template type and user preferences"""
-        template = notification.template
-        user = notification.recipient
-        
-        # Get user preferences
-        preferences, created = NotificationPreference.objects.get_or_create(user=user)
-        
-        # Send email notification
-        if template.email_enabled and preferences.email_enabled:
-            self._send_email_notification(notification)
-        
-        # Send SMS notification
-        if template.sms_enabled and preferences.sms_enabled:
-            self._send_sms_notification(notification)
-        
-        # Send push notification (placeholder for future implementation)
-        if template.push_enabled and preferences.push_enabled:
-            self._send_push_notification(notification)
-    
-    def _send_email_notification(self, notification):
-        """Send email notification and log it"""
-        try:
-            template = notification.template
-            user = notification.recipient
-            
-            # Render email content
-            subject = self._render_template(template.email_subject, notification.context_data)
-            body = self._render_template(template.email_body, notification.context_data)
-            
-            # In a real application, send email here
-            # For now, just log it
-            EmailLog.objects.create(
-                notification=notification,
-                recipient=user.email,
-                subject=subject,
-                body=body,
-                status='sent',
-                sent_at=timezone.now()
-            )
-            
-        except Exception as e:
-            # Log failure
-            EmailLog.objects.create(
-                notification=notification,
-                recipient=user.email,
-                subject='',
-                body='',
-                status='failed',
-                error_message=str(e),
-                sent_at=timezone.now()
-            )
-    
-    def _send_sms_notification(self, notification):
-        """Send SMS notification and log it"""
-        try:
-            template = notification.template
-            user = notification.recipient
-            
-            # Render SMS content
-            message = self._render_template(template.sms_body, notification.context_data)
-            
-            # In a real application, send SMS here
-            # For now, just log it
-            SMSLog.objects.create(
-                notification=notification,
-                recipient=user.phone,
-                message=message,
-                status='sent',
-                sent_at=timezone.now()
-            )
-            
-        except Exception as e:
-            # Log failure
-            SMSLog.objects.create(
-                notification=notification,
-                recipient=user.phone,
-                message='',
-                status='failed',
-                error_message=str(e),
-                sent_at=timezone.now()
-            )
-    
-    def _send_push_notification(self, notification):
-        """Send push notification (placeholder)"""
-        # This would integrate with Firebase, OneSignal, or similar service
-        pass
-    
-    def _render_template(self, template_text, context_data):
-        """Simple template rendering (in production, use a proper template engine)"""
-        if not template_text:
-            return ''
-        
-        # Replace placeholders with context data
-        rendered = template_text
-        for key, value in context_data.items():
-            placeholder = f'{{{{{key}}}}}'
-            rendered = rendered.replace(placeholder, str(value))
-        
-        return rendered
 
 class BulkNotificationView(APIView):
     permission_classes = [permissions.IsAdminUser]
     
     def post(self, request):
-        """Send bulk notifications to multiple users"""
+        """Queue a bulk notification job; users are notified in the background"""
         serializer = BulkNotificationSerializer(data=request.data)
         if serializer.is_valid():
             try:
-                template_id = serializer.validated_data['template_id']
-                user_ids = serializer.validated_data['user_ids']
-                context_data = serializer.validated_data.get('context_data', {})
-                scheduled_at = serializer.validated_data.get('scheduled_at')
-                
-                # Get template
-                template = NotificationTemplate.objects.get(id=template_id)
-                
-                # Get users
-                from Users.models import User
-                users = User.objects.filter(id__in=user_ids, is_active=True)
-                
-                notifications_created = 0
-                notifications_failed = 0
-                
-                for user in users:
-                    try:
-                        # Create notification
-                        notification = Notification.objects.create(
-                            template=template,
-                            recipient=user,
-                            context_data=context_data,
-                            scheduled_at=scheduled_at
-                        )
-                        
-                        # Create user notification
-                        UserNotification.objects.create(
-                            user=user,
-                            notification=notification,
-                            is_read=False
-                        )
-                        
-                        notifications_created += 1
-                        
-                    except Exception as e:
-                        notifications_failed += 1
-                        continue
+                job = BulkNotificationJob.objects.create(
+                    template_id=serializer.validated_data['template_id'],
+                    created_by=request.user,
+                    user_ids=sorted(set(serializer.validated_data.get('user_ids', []))),
+                    context_data=serializer.validated_data.get('context_data', {}),
+                    priority=serializer.validated_data.get('priority', 'normal'),
+                    scheduled_at=serializer.validated_data.get('scheduled_at'),
+                )
+                enqueue_bulk_job(job.id)
                 
                 return Response({
-                    'message': f'Bulk notification created successfully',
-                    'notifications_created': notifications_created,
-                    'notifications_failed': notifications_failed,
-                    'total_users': len(users)
-                }, status=status.HTTP_201_CREATED)
+                    'message': 'Bulk notification job queued',
+                    'job': BulkNotificationJobSerializer(job).data
+                }, status=status.HTTP_202_ACCEPTED)
                 
-            except NotificationTemplate.DoesNotExist:
-                return Response({
-                    'error': 'Notification template not found'
-                }, status=status.HTTP_404_NOT_FOUND)
             except Exception as e:
                 return Response({
                     'error': f'Error creating bulk notifications: {str(e)}'
@@ -337,6 +210,12 @@ class BulkNotificationView(APIView):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class BulkNotificationJobDetailView(generics.RetrieveAPIView):
+    """Progress of a bulk notification job"""
+    queryset = BulkNotificationJob.objects.select_related('template')
+    serializer_class = BulkNotificationJobSerializer
+    permission_classes = [permissions.IsAdminUser]
+
 class NotificationPreferenceView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
@@ -379,13 +258,11 @@ class NotificationPreferenceView(APIView):
 def mark_all_read(request):
     """Mark all user notifications as read"""
     try:
-        unread_notifications = UserNotification.objects.filter(
+        count = UserNotification.objects.filter(
             user=request.user,
             is_read=False
-        )
-        
-        count = unread_notifications.count()
-        unread_notifications.update(is_read=True, read_at=timezone.now())
+        ).update(is_read=True, read_at=timezone.now())
+        counters.reset(request.user.id)
         
         return Response({
             'message': f'{count} notifications marked as read'
@@ -428,10 +305,7 @@ def mark_notification_read(request, notification_id):
 def notification_count(request):
     """Get unread notification count"""
     try:
-        unread_count = UserNotification.objects.filter(
-            user=request.user,
-            is_read=False
-        ).count()
+        unread_count = counters.unread_count(request.user.id)
         
         return Response({
             'unread_count': unread_count
@@ -451,14 +325,30 @@ def notification_statistics(request):
         total_user_notifications = UserNotification.objects.count()
         unread_notifications = UserNotification.objects.filter(is_read=False).count()
         
+        # Live log rows plus the daily summaries of rows removed by the retention purge
+        delivery = {'email': {'sent': 0, 'failed': 0}, 'sms': {'sent': 0, 'failed': 0}}
+        for channel, model in (('email', EmailLog), ('sms', SMSLog)):
+            live = model.objects.aggregate(
+                sent=Count('id', filter=Q(status='sent')),
+                failed=Count('id', filter=Q(status='failed')),
+            )
+            for key, value in live.items():
+                delivery[channel][key] += value
+        purged = (
+            DeliveryLogSummary.objects.filter(status__in=['sent', 'failed'])
+            .values('channel', 'status').annotate(total=Sum('count'))
+        )
+        for row in purged:
+            delivery[row['channel']][row['status']] += row['total']
+        
         # Email delivery statistics
-        email_sent = EmailLog.objects.filter(status='sent').count()
-        email_failed = EmailLog.objects.filter(status='failed').count()
+        email_sent = delivery['email']['sent']
+        email_failed = delivery['email']['failed']
         email_success_rate = (email_sent / (email_sent + email_failed)) * 100 if (email_sent + email_failed) > 0 else 0
         
         # SMS delivery statistics
-        sms_sent = SMSLog.objects.filter(status='sent').count()
-        sms_failed = SMSLog.objects.filter(status='failed').count()
+        sms_sent = delivery['sms']['sent']
+        sms_failed = delivery['sms']['failed']
         sms_success_rate = (sms_sent / (sms_sent + sms_failed)) * 100 if (sms_sent + sms_failed) > 0 else 0
         
         return Response({
@@ -481,3 +371,37 @@ def notification_statistics(request):
         return Response({
             'error': f'Error retrieving statistics: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Server push (ASGI only)
+def _stream_user(request):
+    """User of a stream request; EventSource cannot set headers, so the JWT may come as ?token="""
+    authentication = JWTAuthentication()
+    try:
+        token = request.GET.get('token')
+        if token:
+            return authentication.get_user(authentication.get_validated_token(token))
+        result = authentication.authenticate(request)
+        return result[0] if result else None
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+async def notification_stream(request):
+    """Server-Sent Events stream of the user's new notifications and unread count"""
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'The notification stream is only served by the ASGI application'}, status=501)
+    user = await sync_to_async(_stream_user)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({'error': 'Authentication credentials were not provided or are invalid'}, status=401)
+
+    async def events():
+        count = await sync_to_async(counters.unread_count)(user.id)
+        yield realtime.format_sse(realtime.unread_count_event(count))
+        async for event in realtime.get_backend().subscribe(user.id, settings.NOTIFICATION_STREAM_HEARTBEAT_SECONDS):
+            # Comment lines keep proxies from closing an idle stream
+            yield ': keep-alive\n\n' if event is None else realtime.format_sse(event)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cart, CartItem, Order, OrderItem, OrderStatus, ReturnRequest
+from .models import Cart, CartItem, Order, OrderItem, OrderStatus, ReturnRequest, OrderRollup, ArchivedOrder
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
@@ -44,3 +44,14 @@ class ReturnRequestAdmin(admin.ModelAdmin):
     list_display = ("id", "order", "user", "status", "refund_amount", "created_at")
     list_filter = ("status",)
     search_fields = ("order__order_number", "user__email")
+
+@admin.register(OrderRollup)
+class OrderRollupAdmin(admin.ModelAdmin):
+    list_display = ("id", "seller", "user", "day", "status", "payment_status", "order_count", "total_amount")
+    list_filter = ("status", "payment_status", "day")
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ("id", "order_number", "user", "seller", "status", "payment_status", "total_amount", "created_at", "archived_at")
+    list_filter = ("status", "payment_status")
+    search_fields = ("order_number", "user__email", "seller__business_name")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class OrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Orders'
+
+    def ready(self):
+        from .rollups import get_order_tracker
+        get_order_tracker().connect()
@@ -0,0 +1,156 @@
+"""Cold-order archival.
+
+Orders in a final state that are older than ``ORDER_ARCHIVE_AFTER_DAYS`` are
+copied, together with everything that hangs off them, into one
+``ArchivedOrder`` document each and then deleted from the live tables. This
+keeps Order, OrderItem, OrderStatus, Shipment and ShipmentTracking (and their
+indexes) proportional to recent activity instead of all history.
+"""
+import gzip
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Order, ArchivedOrder
+from .rollups import rollups_suspended
+
+ARCHIVABLE_STATUSES = ['delivered', 'cancelled', 'refunded', 'returned']
+
+
+def _row(instance):
+    """Plain dict of an instance's concrete fields (foreign keys as ids)"""
+    data = {field.name: getattr(instance, field.attname) for field in instance._meta.concrete_fields}
+    # Round-trip through the JSON encoder so Decimals/datetimes become strings
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def serialize_order(order):
+    """Build the archive document for an order with its children prefetched"""
+    return {
+        'order': _row(order),
+        'seller_name': order.seller.business_name,
+        'items': [_row(item) for item in order.items.all()],
+        'status_history': [_row(status) for status in order.status_history.all()],
+        'shipments': [
+            {**_row(shipment), 'tracking_events': [_row(event) for event in shipment.tracking_events.all()]}
+            for shipment in order.shipments.all()
+        ],
+        'payments': [
+            {**_row(payment), 'refunds': [_row(refund) for refund in payment.refunds.all()]}
+            for payment in order.payments.all()
+        ],
+        'returns': [_row(return_request) for return_request in order.returns.all()],
+    }
+
+
+def archivable_orders(before):
+    """Orders created before ``before`` that are finished and safe to move.
+
+    Orders still referenced by disputes, open return requests or coupon
+    usages (which enforce per-user coupon limits) stay live.
+    """
+    return (
+        Order.objects.filter(created_at__lt=before, status__in=ARCHIVABLE_STATUSES)
+        .exclude(disputes__isnull=False)
+        .exclude(coupon_usages__isnull=False)
+        .exclude(returns__status__in=['pending', 'approved'])
+        .order_by('id')
+    )
+
+
+def archive_batch(orders, export_file=None):
+    """Archive one batch of orders atomically; returns the number archived"""
+    orders = list(
+        orders.select_related('seller').prefetch_related(
+            'items', 'status_history', 'shipments__tracking_events', 'payments__refunds', 'returns'
+        )
+    )
+    if not orders:
+        return 0
+
+    archived = []
+    for order in orders:
+        payload = serialize_order(order)
+        archived.append(ArchivedOrder(
+            order_id=order.id,
+            order_number=order.order_number,
+            user_id=order.user_id,
+            seller_id=order.seller_id,
+            status=order.status,
+            payment_status=order.payment_status,
+            total_amount=order.total_amount,
+            created_at=order.created_at,
+            payload=payload,
+        ))
+
+    with transaction.atomic():
+        ArchivedOrder.objects.bulk_create(archived)
+        # Archived orders still count towards the statistics rollups
+        with rollups_suspended():
+            Order.objects.filter(id__in=[order.id for order in orders]).delete()
+
+    if export_file is not None:
+        for archived_order in archived:
+            export_file.write(json.dumps(archived_order.payload, cls=DjangoJSONEncoder) + '\n')
+    return len(orders)
+
+
+def archive_orders(older_than_days=None, batch_size=None, export_path=None, limit=None):
+    """Move cold orders into the archive in batches; returns the number archived.
+
+    With ``export_path`` each archived document is also appended to a gzip
+    compressed NDJSON file.
+    """
+    older_than_days = older_than_days or settings.ORDER_ARCHIVE_AFTER_DAYS
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    before = timezone.now() - timedelta(days=older_than_days)
+
+    export_file = gzip.open(export_path, 'at', encoding='utf-8') if export_path else None
+    total = 0
+    try:
+        while limit is None or total < limit:
+            size = batch_size if limit is None else min(batch_size, limit - total)
+            ids = list(archivable_orders(before).values_list('id', flat=True)[:size])
+            if not ids:
+                break
+            total += archive_batch(Order.objects.filter(id__in=ids).order_by('id'), export_file)
+    finally:
+        if export_file is not None:
+            export_file.close()
+    return total
+
+
+def find_archived_order(pk, **owner):
+    """Look up an archived order by the primary key it had while live"""
+    return ArchivedOrder.objects.filter(order_id=pk, **owner).first()
+
+
+def archived_order_data(archived):
+    """Render an archived order in the same shape as ``OrderSerializer``"""
+    payload = archived.payload
+    return {
+        **payload['order'],
+        'items': payload['items'],
+        'status_history': payload['status_history'],
+        'seller_name': payload['seller_name'],
+        'is_archived': True,
+        'archived_at': archived.archived_at,
+    }
+
+
+def relation_sizes(models):
+    """Row counts and, where the backend can tell, table and index sizes in bytes"""
+    sizes = {}
+    for model in models:
+        table = model._meta.db_table
+        entry = {'rows': model._base_manager.count(), 'table_bytes': None, 'index_bytes': None}
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_relation_size(%s), pg_indexes_size(%s)', [table, table]
+                )
+                entry['table_bytes'], entry['index_bytes'] = cursor.fetchone()
+        sizes[table] = entry
+    return sizes
@@ -0,0 +1,38 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Orders.archive import archive_orders, relation_sizes
+
+
+class Command(BaseCommand):
+    help = 'Move finished orders older than the archive horizon into Orders.ArchivedOrder'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.ORDER_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--limit', type=int, help='Stop after archiving this many orders')
+        parser.add_argument('--export', dest='export_path', help='Also append archived orders to this .ndjson.gz file')
+
+    def handle(self, *args, **options):
+        models = [
+            apps.get_model('Orders', name) for name in ('Order', 'OrderItem', 'OrderStatus', 'ArchivedOrder')
+        ] + [apps.get_model('Shipping', name) for name in ('Shipment', 'ShipmentTracking')]
+
+        before = relation_sizes(models)
+        archived = archive_orders(
+            older_than_days=options['older_than_days'],
+            batch_size=options['batch_size'],
+            export_path=options['export_path'],
+            limit=options['limit'],
+        )
+        after = relation_sizes(models)
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders'))
+        for table, size in after.items():
+            line = f"{table}: {before[table]['rows']} -> {size['rows']} rows"
+            if size['table_bytes'] is not None:
+                line += (
+                    f", table {before[table]['table_bytes']} -> {size['table_bytes']} bytes"
+                    f", indexes {before[table]['index_bytes']} -> {size['index_bytes']} bytes"
+                )
+            self.stdout.write(line)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from AdminConsole.rollups import rebuild_user_rollups
+from Orders.rollups import rebuild_order_rollups
+from Payments.rollups import rebuild_payment_rollups
+from Shipping.rollups import rebuild_shipping_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the order, payment, shipping and user statistics rollups from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        orders = rebuild_order_rollups(batch_size=batch_size)
+        payments = rebuild_payment_rollups(batch_size=batch_size)
+        shipping = rebuild_shipping_rollups(batch_size=batch_size)
+        users = rebuild_user_rollups(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {orders} order rollup rows, {payments} payment rollup rows, '
+            f'{shipping} shipping rollup rows and {users} user rollup rows'
+        ))
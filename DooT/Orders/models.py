@@ -3,6 +3,7 @@ from django.core.validators import MinValueValidator
 from Users.models import User, SellerProfile
 from Products.models import Product, ProductVariant
 from django.utils import timezone
+from django.utils.functional import cached_property
 import uuid
 
 class Cart(models.Model):
@@ -14,13 +15,20 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.name}"
 
+    @cached_property
+    def pricing(self):
+        """Priced view of the cart (discounts, tax, shipping); see Orders.pricing"""
+        from .pricing import price_cart
+        return price_cart(self)
+
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return sum(line.quantity for line in self.pricing.lines)
 
     @property
     def total_amount(self):
-        return sum(item.total_price for item in self.items.all())
+        """Merchandise total after discounts, before tax and shipping"""
+        return self.pricing.merchandise_total
 
     @property
     def seller_groups(self):
@@ -206,3 +214,61 @@ class ReturnRequest(models.Model):
 
     def __str__(self):
         return f"Return {self.id} - Order {self.order.order_number}"
+
+class ArchivedOrder(models.Model):
+    """Cold order moved out of the live tables by ``manage.py archive_orders``.
+
+    ``payload`` holds the order together with its items, status history,
+    shipments (with tracking events), payments, refunds and return requests.
+    The columns next to it are the ones lookups and statistics need.
+    """
+    order_id = models.BigIntegerField(unique=True)  # Primary key the order had while live
+    order_number = models.CharField(max_length=20, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    seller = models.ForeignKey(SellerProfile, on_delete=models.CASCADE, related_name='archived_orders')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS_CHOICES)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    payload = models.JSONField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Archived order {self.order_number}"
+
+class OrderRollup(models.Model):
+    """Pre-aggregated daily order counters per seller or per customer.
+
+    Exactly one of ``seller``/``user`` is set on each row. Rows are kept in
+    step with Order saves by ``Orders.rollups`` and can be recomputed from
+    scratch with ``manage.py rebuild_statistics_rollups``.
+    """
+    seller = models.ForeignKey(SellerProfile, on_delete=models.CASCADE, related_name='order_rollups', null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='order_rollups', null=True, blank=True)
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    payment_status = models.CharField(max_length=20, choices=Order.PAYMENT_STATUS_CHOICES)
+
+    order_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['seller', 'day', 'status', 'payment_status'],
+                condition=models.Q(user__isnull=True),
+                name='unique_seller_order_rollup',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'day', 'status', 'payment_status'],
+                condition=models.Q(seller__isnull=True),
+                name='unique_customer_order_rollup',
+            ),
+        ]
+
+    def __str__(self):
+        owner = f"seller {self.seller_id}" if self.seller_id else f"user {self.user_id}"
+        return f"{owner} - {self.day} - {self.status}/{self.payment_status}: {self.order_count}"
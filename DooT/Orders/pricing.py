@@ -0,0 +1,340 @@
+"""Cart pricing engine.
+
+``price_cart`` prices a whole cart in one pass: it loads every active
+``Discount`` and ``Promotion`` that can touch the cart's products in a couple
+of queries, then computes line prices, line discounts, an optional coupon,
+tax and shipping per seller with ``Decimal`` arithmetic. Cart display, coupon
+validation and order creation all use it so they always agree on the numbers.
+
+Discounts do not stack: each line gets the single best discount it qualifies
+for. Promotions carry no discount value of their own and are reported per
+line for display.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db.models import Value, CharField
+from django.utils import timezone
+from Promotions.models import Discount
+from Promotions.windows import promotions_for_products
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+
+def money(value):
+    """Round to cents the way order totals are stored"""
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def flat_shipping(seller, lines):
+    """Default shipping: a flat ``ORDER_FLAT_SHIPPING`` per seller order"""
+    return settings.ORDER_FLAT_SHIPPING
+
+
+class PricedLine:
+    """One cart line with its list price and the discount applied to it"""
+
+    def __init__(self, item):
+        self.item = item
+        self.product = item.product
+        self.variant = item.variant
+        self.quantity = item.quantity
+        self.unit_price = money(
+            self.product.current_price + (self.variant.price_adjustment if self.variant else 0)
+        )
+        self.subtotal = self.unit_price * self.quantity
+        self.discount = None
+        self.discount_amount = ZERO
+        self.coupon_amount = ZERO
+        self.promotions = []
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount_amount - self.coupon_amount
+
+    def as_dict(self):
+        return {
+            'product_id': self.product.id,
+            'variant_id': self.variant.id if self.variant else None,
+            'quantity': self.quantity,
+            'unit_price': self.unit_price,
+            'subtotal': self.subtotal,
+            'discount_amount': self.discount_amount,
+            'discount': self.discount.name if self.discount else None,
+            'coupon_amount': self.coupon_amount,
+            'total': self.total,
+            'promotions': [promotion.name for promotion in self.promotions],
+        }
+
+
+class SellerQuote:
+    """Totals for the lines one seller will fulfil (one future order)"""
+
+    def __init__(self, seller, lines):
+        self.seller = seller
+        self.lines = lines
+        self.shipping_amount = ZERO
+        self.tax_amount = ZERO
+
+    @property
+    def subtotal(self):
+        return sum((line.subtotal for line in self.lines), ZERO)
+
+    @property
+    def discount_amount(self):
+        return sum((line.discount_amount + line.coupon_amount for line in self.lines), ZERO)
+
+    @property
+    def total_amount(self):
+        return self.subtotal - self.discount_amount + self.tax_amount + self.shipping_amount
+
+    def as_dict(self):
+        return {
+            'seller_id': self.seller.id,
+            'seller_name': self.seller.business_name,
+            'subtotal': self.subtotal,
+            'discount_amount': self.discount_amount,
+            'tax_amount': self.tax_amount,
+            'shipping_amount': self.shipping_amount,
+            'total_amount': self.total_amount,
+            'items': [line.as_dict() for line in self.lines],
+        }
+
+
+class CartQuote:
+    """Result of ``price_cart``; sums the per-seller quotes"""
+
+    def __init__(self, sellers, coupon=None):
+        self.sellers = sellers
+        self.coupon = coupon
+
+    @property
+    def lines(self):
+        return [line for seller in self.sellers for line in seller.lines]
+
+    def _sum(self, attr):
+        return sum((getattr(seller, attr) for seller in self.sellers), ZERO)
+
+    @property
+    def subtotal(self):
+        return self._sum('subtotal')
+
+    @property
+    def discount_amount(self):
+        return self._sum('discount_amount')
+
+    @property
+    def coupon_amount(self):
+        return sum((line.coupon_amount for line in self.lines), ZERO)
+
+    @property
+    def tax_amount(self):
+        return self._sum('tax_amount')
+
+    @property
+    def shipping_amount(self):
+        return self._sum('shipping_amount')
+
+    @property
+    def merchandise_total(self):
+        """Line totals after discounts, before tax and shipping"""
+        return self.subtotal - self.discount_amount
+
+    @property
+    def total_amount(self):
+        return self._sum('total_amount')
+
+    def as_dict(self):
+        return {
+            'subtotal': self.subtotal,
+            'discount_amount': self.discount_amount,
+            'coupon_code': self.coupon.code if self.coupon else None,
+            'coupon_amount': self.coupon_amount,
+            'tax_amount': self.tax_amount,
+            'shipping_amount': self.shipping_amount,
+            'total_amount': self.total_amount,
+            'sellers': [seller.as_dict() for seller in self.sellers],
+        }
+
+
+def _active_links(model, relations, active, targets):
+    """``(owner_id, relation, target_id)`` for active rows of ``model`` linked to ``targets``.
+
+    All M2M tables are read with a single UNION query.
+    """
+    queries = []
+    for relation in relations:
+        ids = targets.get(relation)
+        if not ids:
+            continue
+        field = getattr(model, relation).field
+        owner, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        queries.append(
+            field.remote_field.through.objects
+            .filter(**{f'{target}_id__in': ids}, **{f'{owner}__{lookup}': value for lookup, value in active.items()})
+            .annotate(relation=Value(relation, output_field=CharField()))
+            .values_list(f'{owner}_id', 'relation', f'{target}_id')
+        )
+    if not queries:
+        return []
+    return list(queries[0].union(*queries[1:], all=True))
+
+
+def load_rules(products, now=None):
+    """Active discounts and promotions per product id, in one or two queries"""
+    now = now or timezone.now()
+    targets = {
+        'products': {product.id for product in products},
+        'categories': {product.category_id for product in products},
+        'sellers': {product.seller_id for product in products},
+    }
+
+    discount_links = _active_links(
+        Discount, ['products', 'categories'],
+        {'is_active': True, 'valid_from__lte': now, 'valid_until__gte': now}, targets,
+    )
+    discounts = Discount.objects.in_bulk({link[0] for link in discount_links}) if discount_links else {}
+
+    attribute = {'products': 'id', 'categories': 'category_id', 'sellers': 'seller_id'}
+
+    def per_product(links, objects):
+        index = {}
+        for owner_id, relation, target_id in links:
+            index.setdefault((relation, target_id), set()).add(owner_id)
+        result = {}
+        for product in products:
+            owner_ids = set()
+            for relation, attr in attribute.items():
+                owner_ids |= index.get((relation, getattr(product, attr)), set())
+            result[product.id] = [objects[owner_id] for owner_id in sorted(owner_ids)]
+        return result
+
+    # Promotions come from the per-process window index (Promotions.windows)
+    return per_product(discount_links, discounts), promotions_for_products(products, when=now)
+
+
+def _capped(discount, amount):
+    if discount.max_discount is not None:
+        amount = min(amount, discount.max_discount)
+    return money(max(amount, ZERO))
+
+
+def discount_for_line(discount, line, quantities, cart_subtotal):
+    """Amount ``discount`` takes off ``line``, or ZERO if the line does not qualify.
+
+    ``quantities`` maps product id to the quantity of it in the cart (bundle
+    discounts need every bundled product present).
+    """
+    if cart_subtotal < discount.min_order_value or line.quantity < discount.min_quantity:
+        return ZERO
+    if discount.discount_type == 'percentage':
+        return _capped(discount, line.subtotal * discount.discount_value / 100)
+    if discount.discount_type == 'fixed':
+        # Fixed amount off each unit, never below zero
+        return _capped(discount, min(discount.discount_value, line.unit_price) * line.quantity)
+    if discount.discount_type == 'buy_x_get_y':
+        # Buy ``min_quantity``, get ``discount_value`` more of the same for free
+        free = int(discount.discount_value)
+        if free <= 0:
+            return ZERO
+        free_units = line.quantity // (discount.min_quantity + free) * free
+        return _capped(discount, line.unit_price * free_units)
+    if discount.discount_type == 'bundle':
+        # Percentage off the bundled products when all of them are in the cart
+        bundle = discount.bundle_product_ids
+        if not bundle or any(quantities.get(product_id, 0) < discount.min_quantity for product_id in bundle):
+            return ZERO
+        return _capped(discount, line.subtotal * discount.discount_value / 100)
+    return ZERO
+
+
+def _load_bundles(discounts):
+    bundles = [discount for discount in discounts if discount.discount_type == 'bundle']
+    for discount in bundles:
+        discount.bundle_product_ids = set()
+    if bundles:
+        through = Discount.products.through.objects.filter(discount_id__in=[d.id for d in bundles])
+        by_id = {discount.id: discount for discount in bundles}
+        for discount_id, product_id in through.values_list('discount_id', 'product_id'):
+            by_id[discount_id].bundle_product_ids.add(product_id)
+
+
+def coupon_applies_to(coupon, line):
+    if coupon.applicable_to == 'categories':
+        return line.product.category_id in coupon.target_ids
+    if coupon.applicable_to == 'products':
+        return line.product.id in coupon.target_ids
+    if coupon.applicable_to == 'sellers':
+        return line.product.seller_id in coupon.target_ids
+    return True
+
+
+def _apply_coupon(coupon, lines):
+    """Spread the coupon discount over its eligible lines in proportion to their totals"""
+    if coupon.applicable_to != 'all' and getattr(coupon, 'target_ids', None) is None:
+        # Compiled coupons (Promotions.coupons) carry their targets already
+        relation = getattr(coupon, coupon.applicable_to)
+        coupon.target_ids = set(relation.values_list('id', flat=True))
+    eligible = [line for line in lines if coupon_applies_to(coupon, line)]
+    base = sum((line.total for line in eligible), ZERO)
+    if not eligible or base <= 0:
+        return eligible
+    amount = money(min(Decimal(coupon.calculate_discount(base)), base))
+    remaining = amount
+    for index, line in enumerate(eligible):
+        share = remaining if index == len(eligible) - 1 else money(amount * line.total / base)
+        share = min(share, line.total, remaining)
+        line.coupon_amount = share
+        remaining -= share
+    return eligible
+
+
+def price_items(items, coupon=None, shipping=flat_shipping, now=None):
+    """Price any iterable of cart-like items (``product``, ``variant``, ``quantity``).
+
+    ``items`` should have ``product__seller`` and ``variant`` selected; the
+    pricing itself issues only the rule-loading queries plus, with a coupon
+    restricted to categories/products/sellers and not taken from the coupon
+    index, one query for its targets.
+    """
+    lines = [PricedLine(item) for item in items]
+    products = list({line.product.id: line.product for line in lines}.values())
+    discounts, promotions = load_rules(products, now=now)
+    _load_bundles({discount for rules in discounts.values() for discount in rules})
+
+    cart_subtotal = sum((line.subtotal for line in lines), ZERO)
+    quantities = {}
+    for line in lines:
+        quantities[line.product.id] = quantities.get(line.product.id, 0) + line.quantity
+
+    for line in lines:
+        line.promotions = promotions.get(line.product.id, [])
+        for discount in discounts.get(line.product.id, []):
+            amount = min(discount_for_line(discount, line, quantities, cart_subtotal), line.subtotal)
+            if amount > line.discount_amount:
+                line.discount, line.discount_amount = discount, amount
+
+    free_shipping = set()
+    if coupon is not None:
+        eligible = _apply_coupon(coupon, lines)
+        if coupon.discount_type == 'free_shipping':
+            free_shipping = {line.product.seller_id for line in eligible}
+
+    groups = {}
+    for line in lines:
+        groups.setdefault(line.product.seller, []).append(line)
+
+    tax_rate = settings.ORDER_TAX_RATE
+    sellers = []
+    for seller, seller_lines in groups.items():
+        quote = SellerQuote(seller, seller_lines)
+        quote.tax_amount = money((quote.subtotal - quote.discount_amount) * tax_rate)
+        quote.shipping_amount = ZERO if seller.id in free_shipping else money(shipping(seller, seller_lines))
+        sellers.append(quote)
+    return CartQuote(sellers, coupon=coupon)
+
+
+def price_cart(cart, coupon=None, shipping=flat_shipping):
+    """Price an Orders.Cart"""
+    items = cart.items.select_related('product__seller', 'variant').order_by('id')
+    return price_items(items, coupon=coupon, shipping=shipping)
@@ -0,0 +1,229 @@
+"""Incrementally maintained statistics rollups for orders.
+
+Dashboards read a handful of pre-aggregated ``OrderRollup`` rows instead of
+running COUNT/SUM queries over the whole Order table. ``RollupTracker`` keeps
+a rollup model in step with saves and deletes of its source model; rows
+changed through ``QuerySet.update()`` bypass the signals, so any bulk update
+path must be followed by ``manage.py rebuild_statistics_rollups``.
+"""
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import islice
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+from django.utils import timezone
+
+
+_suspended = threading.local()
+
+
+@contextmanager
+def rollups_suspended():
+    """Stop trackers in this thread from reacting to saves and deletes.
+
+    Used when rows leave the live tables without leaving the statistics,
+    e.g. when cold orders are moved into the archive.
+    """
+    previous = getattr(_suspended, 'active', False)
+    _suspended.active = True
+    try:
+        yield
+    finally:
+        _suspended.active = previous
+
+
+def rollup_day(value):
+    """Bucket a timestamp into the calendar day used by the rollups"""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def to_decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value or 0))
+
+
+def bump_rollup(model, key, deltas, create=True):
+    """Add ``deltas`` to the rollup row matching ``key`` with a single UPDATE.
+
+    The row is created on first use unless ``create`` is False (subtractions
+    never need a new row).
+    """
+    if not any(deltas.values()):
+        return
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**key).update(**updates) or not create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        # A concurrent request created the row first
+        model.objects.filter(**key).update(**updates)
+
+
+class RollupTracker:
+    """Keep a rollup model in step with saves and deletes of a source model.
+
+    ``contributions(state)`` returns the ``(key, deltas)`` pairs a source row
+    with the given field values adds to the rollup table. The values of
+    ``fields`` are remembered when an instance is loaded, so a save only
+    touches the rollup rows whose key or measures actually changed.
+    """
+
+    def __init__(self, source, rollup, fields, contributions):
+        self.source = source
+        self.rollup = rollup
+        self.fields = fields
+        self.contributions = contributions
+        self.state_attr = f'_{rollup._meta.model_name}_state'
+
+    def connect(self):
+        # weak=False: the tracker itself is not referenced anywhere else
+        options = {'sender': self.source, 'weak': False, 'dispatch_uid': f'{self.rollup._meta.label}-tracker'}
+        post_init.connect(self._remember, **options)
+        pre_save.connect(self._load_previous, **options)
+        post_save.connect(self._saved, **options)
+        post_delete.connect(self._deleted, **options)
+
+    def _snapshot(self, instance):
+        values = instance.__dict__
+        if any(field not in values for field in self.fields):
+            # Deferred fields; loading them here would cost a query per row
+            return None
+        return {field: values[field] for field in self.fields}
+
+    def _fetch(self, pk):
+        return self.source._base_manager.filter(pk=pk).values(*self.fields).first()
+
+    def _remember(self, sender, instance, **kwargs):
+        setattr(instance, self.state_attr, self._snapshot(instance) if instance.pk else None)
+
+    def _load_previous(self, sender, instance, raw=False, **kwargs):
+        if raw or instance._state.adding or getattr(instance, self.state_attr, None):
+            return
+        setattr(instance, self.state_attr, self._fetch(instance.pk))
+
+    def _saved(self, sender, instance, created=False, raw=False, **kwargs):
+        if raw or getattr(_suspended, 'active', False):
+            return
+        previous = None if created else getattr(instance, self.state_attr, None)
+        current = self._snapshot(instance) or self._fetch(instance.pk)
+        if previous != current:
+            self.apply(previous, current)
+        setattr(instance, self.state_attr, current)
+
+    def _deleted(self, sender, instance, **kwargs):
+        if getattr(_suspended, 'active', False):
+            return
+        previous = getattr(instance, self.state_attr, None) or self._snapshot(instance)
+        self.apply(previous, None)
+
+    def apply(self, previous, current):
+        """Move a source row's contribution from ``previous`` to ``current`` state"""
+        net = {}
+        for state, sign in ((previous, -1), (current, 1)):
+            if state is None:
+                continue
+            for key, deltas in self.contributions(state):
+                bucket = net.setdefault(tuple(sorted(key.items())), {})
+                for field, delta in deltas.items():
+                    bucket[field] = bucket.get(field, 0) + sign * delta
+        for key, deltas in net.items():
+            bump_rollup(self.rollup, dict(key), deltas, create=any(delta > 0 for delta in deltas.values()))
+
+
+def order_contributions(state):
+    """An order counts once towards its seller's rollup and once towards its customer's"""
+    dimensions = {
+        'day': rollup_day(state['created_at']),
+        'status': state['status'],
+        'payment_status': state['payment_status'],
+    }
+    measures = {'order_count': 1, 'total_amount': to_decimal(state['total_amount'])}
+    return [
+        ({'seller_id': state['seller_id'], 'user_id': None, **dimensions}, measures),
+        ({'seller_id': None, 'user_id': state['user_id'], **dimensions}, measures),
+    ]
+
+
+def get_order_tracker():
+    from .models import Order, OrderRollup
+    return RollupTracker(
+        Order, OrderRollup,
+        fields=['seller_id', 'user_id', 'created_at', 'status', 'payment_status', 'total_amount'],
+        contributions=order_contributions,
+    )
+
+
+def order_rollup_rows(**owner):
+    """Order counts and amounts per (status, payment_status) for one seller or customer.
+
+    Pass either ``seller=`` or ``user=``; the result is a short list of dicts
+    with ``status``, ``payment_status``, ``orders`` and ``amount``.
+    """
+    from .models import OrderRollup
+    return list(
+        OrderRollup.objects.filter(**owner)
+        .values('status', 'payment_status')
+        .annotate(orders=Sum('order_count'), amount=Sum('total_amount'))
+        .order_by()
+    )
+
+
+def sum_rows(rows, measure, **match):
+    """Sum ``measure`` over rollup rows whose dimensions match ``match``.
+
+    A list or tuple value matches any of its members.
+    """
+    total = 0
+    for row in rows:
+        if all(row[field] in value if isinstance(value, (list, tuple)) else row[field] == value
+               for field, value in match.items()):
+            total += row[measure] or 0
+    return total
+
+
+def bulk_create_chunked(model, objs, batch_size=1000):
+    """``bulk_create`` a (possibly huge) iterable without materialising it"""
+    objs = iter(objs)
+    created = 0
+    while True:
+        chunk = list(islice(objs, batch_size))
+        if not chunk:
+            return created
+        model.objects.bulk_create(chunk, batch_size=batch_size)
+        created += len(chunk)
+
+
+def rebuild_order_rollups(batch_size=1000):
+    """Recompute every OrderRollup row from the live and archived orders"""
+    from .models import Order, ArchivedOrder, OrderRollup
+
+    totals = {}
+    for model in (Order, ArchivedOrder):
+        for owner_field in ('seller_id', 'user_id'):
+            grouped = (
+                model.objects.annotate(day=TruncDate('created_at'))
+                .values(owner_field, 'day', 'status', 'payment_status')
+                .annotate(order_count=Count('id'), amount=Sum('total_amount'))
+                .order_by()
+            )
+            for row in grouped.iterator():
+                key = (owner_field, row[owner_field], row['day'], row['status'], row['payment_status'])
+                count, amount = totals.get(key, (0, 0))
+                totals[key] = (count + row['order_count'], amount + (row['amount'] or 0))
+
+    rows = (
+        OrderRollup(
+            day=day, status=status, payment_status=payment_status,
+            order_count=count, total_amount=amount, **{owner_field: owner}
+        )
+        for (owner_field, owner, day, status, payment_status), (count, amount) in totals.items()
+    )
+    with transaction.atomic():
+        OrderRollup.objects.all().delete()
+        return bulk_create_chunked(OrderRollup, rows, batch_size)
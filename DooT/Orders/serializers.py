@@ -1,6 +1,13 @@
+from django.db import transaction
+from django.db.models import F
 from rest_framework import serializers
 from .models import Cart, CartItem, Order, OrderItem, OrderStatus, ReturnRequest
 from Products.serializers import ProductListSerializer
+from Promotions.coupons import get_coupon
+from Promotions.redemption import CouponLimitReached, redeem
+from Shipping.rates import rate_shipping
+from .pricing import price_items
+from .tasks import enqueue_order_placed
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductListSerializer(read_only=True)
@@ -44,11 +51,15 @@ class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
     total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    pricing = serializers.SerializerMethodField()
     
     class Meta:
         model = Cart
-        fields = ['id', 'items', 'total_items', 'total_amount', 'created_at', 'updated_at']
+        fields = ['id', 'items', 'total_items', 'total_amount', 'pricing', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
+    
+    def get_pricing(self, obj):
+        return obj.pricing.as_dict()
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductListSerializer(read_only=True)
@@ -81,65 +92,102 @@ class OrderCreateSerializer(serializers.ModelSerializer):
     shipping_country = serializers.CharField(required=True)
     shipping_zip_code = serializers.CharField(required=True)
     shipping_phone = serializers.CharField(required=True)
+    coupon_code = serializers.CharField(write_only=True, required=False, allow_blank=True)
     
     class Meta:
         model = Order
         fields = ['cart_id', 'shipping_address', 'shipping_city', 'shipping_state',
-                 'shipping_country', 'shipping_zip_code', 'shipping_phone', 'notes']
+                 'shipping_country', 'shipping_zip_code', 'shipping_phone', 'notes', 'coupon_code']
+    
+    def validate_coupon_code(self, value):
+        if not value:
+            return None
+        coupon = get_coupon(value)
+        if coupon is None:
+            raise serializers.ValidationError("Invalid coupon code")
+        return coupon
     
     def create(self, validated_data):
+        """Accept the cart: reserve stock and write the orders in one transaction.
+
+        Confirmations, notifications and counters are queued as tasks once the
+        transaction commits (see ``Orders.tasks``).
+        """
         cart_id = validated_data.pop('cart_id')
-        cart = Cart.objects.get(id=cart_id, user=self.context['request'].user, is_active=True)
-        
-        # Group cart items by seller
-        seller_items = cart.seller_groups
+        coupon = validated_data.pop('coupon_code', None)
+        user = self.context['request'].user
         
-        orders = []
-        for seller, items in seller_items.items():
-            # Calculate totals for this seller's items
-            subtotal = sum(item.total_price for item in items)
-            tax_amount = subtotal * 0.1  # 10% tax (simplified)
-            shipping_amount = 5.00  # Fixed shipping (simplified)
-            total_amount = subtotal + tax_amount + shipping_amount
+        with transaction.atomic():
+            cart = Cart.objects.select_for_update().get(id=cart_id, user=user, is_active=True)
+            items = list(cart.items.select_related('product__seller', 'variant').order_by('id'))
+            if not items:
+                raise serializers.ValidationError('Cannot create order from empty cart')
             
-            # Create order for this seller
-            order_data = {
-                'user': self.context['request'].user,
-                'seller': seller,
-                'subtotal': subtotal,
-                'tax_amount': tax_amount,
-                'shipping_amount': shipping_amount,
-                'total_amount': total_amount,
-                **validated_data
-            }
+            # Reserve stock with conditional updates so concurrent checkouts cannot oversell
+            for item in items:
+                stock_owner = item.variant or item.product
+                reserved = type(stock_owner).objects.filter(
+                    pk=stock_owner.pk, stock_quantity__gte=item.quantity
+                ).update(stock_quantity=F('stock_quantity') - item.quantity)
+                if not reserved:
+                    raise serializers.ValidationError(f'Insufficient stock for {item.product.name}')
             
-            order = Order.objects.create(**order_data)
+            # Price the whole cart at once; one order per seller, shipping quoted per seller
+            destination = {
+                'country': validated_data['shipping_country'],
+                'state': validated_data['shipping_state'],
+                'city': validated_data['shipping_city'],
+                'zip_code': validated_data['shipping_zip_code'],
+            }
+            quote = price_items(items, coupon=coupon, shipping=rate_shipping(destination))
+            if coupon is not None:
+                can_use, message = coupon.check(user, quote.merchandise_total + quote.coupon_amount, fresh=True)
+                if not can_use:
+                    raise serializers.ValidationError(message)
             
-            # Create order items
-            for item in items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    variant=item.variant,
-                    product_name=item.product.name,
-                    variant_name=str(item.variant) if item.variant else '',
-                    quantity=item.quantity,
-                    unit_price=item.unit_price,
-                    total_price=item.total_price
+            orders = []
+            order_items = []
+            statuses = []
+            for seller_quote in quote.sellers:
+                order = Order.objects.create(
+                    user=user,
+                    seller=seller_quote.seller,
+                    subtotal=seller_quote.subtotal,
+                    discount_amount=seller_quote.discount_amount,
+                    tax_amount=seller_quote.tax_amount,
+                    shipping_amount=seller_quote.shipping_amount,
+                    total_amount=seller_quote.total_amount,
+                    **validated_data
                 )
+                
+                for line in seller_quote.lines:
+                    order_items.append(OrderItem(
+                        order=order,
+                        product=line.product,
+                        variant=line.variant,
+                        product_name=line.product.name,
+                        variant_name=str(line.variant) if line.variant else '',
+                        quantity=line.quantity,
+                        unit_price=line.unit_price,
+                        total_price=line.subtotal
+                    ))
+                statuses.append(OrderStatus(order=order, status='pending', notes='Order created'))
+                orders.append(order)
             
-            # Create initial status
-            OrderStatus.objects.create(
-                order=order,
-                status='pending',
-                notes='Order created'
-            )
+            OrderItem.objects.bulk_create(order_items)
+            OrderStatus.objects.bulk_create(statuses)
+            if coupon is not None:
+                # One checkout is one use of the coupon, recorded against the first order
+                try:
+                    redeem(coupon, user, orders[0], quote.coupon_amount)
+                except CouponLimitReached as e:
+                    raise serializers.ValidationError(str(e))
             
-            orders.append(order)
-        
-        # Clear cart
-        cart.is_active = False
-        cart.save()
+            # Clear cart
+            cart.is_active = False
+            cart.save(update_fields=['is_active', 'updated_at'])
+            
+            enqueue_order_placed([order.id for order in orders])
         
         return orders[0] if len(orders) == 1 else orders
 
@@ -187,6 +235,7 @@ class CartCheckoutSerializer(serializers.Serializer):
     shipping_phone = serializers.CharField()
     payment_method = serializers.CharField()
     notes = serializers.CharField(required=False)
+    coupon_code = serializers.CharField(required=False, allow_blank=True)
     
     def validate_cart_id(self, value):
         user = self.context['request'].user
@@ -0,0 +1,111 @@
+"""Post-processing that runs after checkout has accepted an order.
+
+Checkout only validates the cart, reserves stock and writes the orders; the
+work below is queued once the checkout transaction commits. With no broker
+configured Celery runs these tasks eagerly in-process (see
+``CELERY_TASK_ALWAYS_EAGER`` in settings).
+"""
+import logging
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from Notifications.models import UserNotification
+from Products.models import Product
+from Users.models import SellerProfile
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def send_order_confirmation(order_id):
+    """Confirm the order to the customer in-app and by email"""
+    order = Order.objects.select_related('user').filter(pk=order_id).first()
+    if order is None:
+        return
+    UserNotification.objects.create(
+        user=order.user,
+        title='Order placed',
+        message=f'Your order {order.order_number} for {order.total_amount} has been placed.',
+        notification_type='order',
+    )
+    send_mail(
+        f'Order {order.order_number} confirmed',
+        f'Thank you for your order. Order total: {order.total_amount}.',
+        getattr(settings, 'DEFAULT_FROM_EMAIL', None),
+        [order.user.email],
+        fail_silently=True,
+    )
+
+
+@shared_task
+def notify_seller_of_order(order_id):
+    """Let the seller know a new order is waiting"""
+    order = Order.objects.select_related('seller__user').filter(pk=order_id).first()
+    if order is None:
+        return
+    UserNotification.objects.create(
+        user=order.seller.user,
+        title='New order received',
+        message=f'Order {order.order_number} ({order.total_amount}) is waiting to be confirmed.',
+        notification_type='order',
+    )
+
+
+@shared_task
+def record_order_analytics(order_id):
+    """Add the ordered quantities to the products' purchase counters"""
+    quantities = {}
+    for product_id, quantity in OrderItem.objects.filter(order_id=order_id).values_list('product_id', 'quantity'):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    for product_id, quantity in quantities.items():
+        Product.objects.filter(pk=product_id).update(purchase_count=F('purchase_count') + quantity)
+
+
+@shared_task
+def update_seller_counters(order_id):
+    """Bump the seller's total order counter"""
+    seller_id = Order.objects.filter(pk=order_id).values_list('seller_id', flat=True).first()
+    if seller_id:
+        SellerProfile.objects.filter(pk=seller_id).update(total_orders=F('total_orders') + 1)
+
+
+@shared_task
+def record_campaign_conversion(order_id):
+    """Count the order as a conversion of the last campaign sent to its customer"""
+    from Promotions.engagement import attribute_conversion
+    order = Order.objects.filter(pk=order_id).values('user_id', 'created_at').first()
+    if order is not None:
+        attribute_conversion(order['user_id'], at=order['created_at'])
+
+
+ORDER_PLACED_TASKS = [
+    send_order_confirmation,
+    notify_seller_of_order,
+    record_order_analytics,
+    update_seller_counters,
+]
+
+# Queued once per checkout, with its first order
+CHECKOUT_PLACED_TASKS = [
+    record_campaign_conversion,
+]
+
+
+def enqueue_order_placed(order_ids):
+    """Queue post-processing for the orders of one checkout once the transaction commits"""
+    def dispatch():
+        queued = [(task, order_id) for order_id in order_ids for task in ORDER_PLACED_TASKS]
+        if order_ids:
+            # One checkout is one conversion, however many sellers it was split over
+            queued += [(task, order_ids[0]) for task in CHECKOUT_PLACED_TASKS]
+        for task, order_id in queued:
+            try:
+                task.delay(order_id)
+            except Exception:
+                # The order is already accepted; a broker outage must not fail checkout
+                logger.exception('Could not queue %s for order %s', task.name, order_id)
+
+    transaction.on_commit(dispatch)
@@ -1,16 +1,19 @@
-from rest_framework import status, generics, permissions, filters
+from rest_framework import status, generics, permissions, filters, serializers
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Sum, Count
+from django.http import Http404
+from django.db.models import Q, Count
 from .models import Cart, CartItem, Order, OrderItem, OrderStatus, ReturnRequest
 from .serializers import (
     CartSerializer, CartItemSerializer, OrderSerializer, OrderCreateSerializer,
     OrderUpdateSerializer, ReturnRequestSerializer, ReturnRequestUpdateSerializer,
     CartItemUpdateSerializer, CartCheckoutSerializer
 )
+from .rollups import order_rollup_rows, sum_rows
+from .archive import find_archived_order, archived_order_data
 
 # Keep generics for simple listing and retrieval
 class OrderListView(generics.ListAPIView):
@@ -38,6 +41,19 @@ class OrderDetailView(generics.RetrieveAPIView):
             return Order.objects.filter(seller=self.request.user.seller_profile)
         else:
             return Order.objects.filter(user=self.request.user)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Fall back to the archive for orders moved out of the live tables"""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if hasattr(request.user, 'seller_profile'):
+                archived = find_archived_order(kwargs['pk'], seller=request.user.seller_profile)
+            else:
+                archived = find_archived_order(kwargs['pk'], user=request.user)
+            if archived is None:
+                raise
+            return Response(archived_order_data(archived))
 
 class ReturnRequestListView(generics.ListAPIView):
     serializer_class = ReturnRequestSerializer
@@ -79,14 +95,7 @@ class CartView(APIView):
         try:
             cart = Cart.objects.get(user=request.user, is_active=True)
             
-            # Calculate totals
-            total_items = cart.items.count()
-            total_amount = sum(item.total_price for item in cart.items.all())
-            
-            # Update cart totals
-            cart.total_amount = total_amount
-            cart.save()
-            
+            # Totals, discounts, tax and shipping come from the pricing engine
             serializer = CartSerializer(cart)
             return Response(serializer.data)
         except Cart.DoesNotExist:
@@ -235,14 +244,7 @@ class OrderCreateView(APIView):
                         'error': 'Cannot create order from empty cart'
                     }, status=status.HTTP_400_BAD_REQUEST)
                 
-                # Check stock availability
-                for item in cart.items.all():
-                    if item.product.stock_quantity < item.quantity:
-                        return Response({
-                            'error': f'Insufficient stock for {item.product.name}. Available: {item.product.stock_quantity}'
-                        }, status=status.HTTP_400_BAD_REQUEST)
-                
-                # Create orders
+                # Create orders; stock is reserved atomically inside the serializer
                 orders = serializer.save()
                 
                 if isinstance(orders, list):
@@ -263,6 +265,10 @@ class OrderCreateView(APIView):
                 return Response({
                     'error': 'Invalid cart'
                 }, status=status.HTTP_400_BAD_REQUEST)
+            except serializers.ValidationError as e:
+                return Response({
+                    'error': e.detail[0]
+                }, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 return Response({
                     'error': f'Error creating order: {str(e)}'
@@ -506,14 +512,8 @@ def checkout(request):
                     'error': 'Cannot checkout empty cart'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Check stock availability
-            for item in cart.items.all():
-                if item.product.stock_quantity < item.quantity:
-                    return Response({
-                        'error': f'Insufficient stock for {item.product.name}'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Create orders
+            # Create orders; stock is reserved atomically inside the serializer and
+            # confirmations/notifications run as tasks after commit
             order_serializer = OrderCreateSerializer(data=serializer.validated_data, context={'request': request})
             if order_serializer.is_valid():
                 orders = order_serializer.save()
@@ -535,6 +535,10 @@ def checkout(request):
             return Response({
                 'error': 'Invalid cart'
             }, status=status.HTTP_400_BAD_REQUEST)
+        except serializers.ValidationError as e:
+            return Response({
+                'error': e.detail[0]
+            }, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({
                 'error': f'Checkout error: {str(e)}'
@@ -548,14 +552,12 @@ def order_statistics(request):
     """Get order statistics for dashboard with custom calculations"""
     try:
         if hasattr(request.user, 'seller_profile'):
-            # Seller statistics
-            total_orders = Order.objects.filter(seller=request.user.seller_profile).count()
-            pending_orders = Order.objects.filter(seller=request.user.seller_profile, status='pending').count()
-            completed_orders = Order.objects.filter(seller=request.user.seller_profile, status='delivered').count()
-            total_revenue = Order.objects.filter(
-                seller=request.user.seller_profile,
-                payment_status='paid'
-            ).aggregate(total=Sum('total_amount'))['total'] or 0
+            # Seller statistics from the pre-aggregated rollup rows
+            rows = order_rollup_rows(seller=request.user.seller_profile)
+            total_orders = sum_rows(rows, 'orders')
+            pending_orders = sum_rows(rows, 'orders', status='pending')
+            completed_orders = sum_rows(rows, 'orders', status='delivered')
+            total_revenue = sum_rows(rows, 'amount', payment_status='paid')
             
             # Calculate average order value
             avg_order_value = 0
@@ -570,18 +572,16 @@ def order_statistics(request):
                 'average_order_value': round(avg_order_value, 2)
             })
         else:
-            # Customer statistics
-            total_orders = Order.objects.filter(user=request.user).count()
-            active_orders = Order.objects.filter(
-                user=request.user,
-                status__in=['pending', 'confirmed', 'processing', 'shipped']
-            ).count()
+            # Customer statistics from the pre-aggregated rollup rows
+            rows = order_rollup_rows(user=request.user)
+            total_orders = sum_rows(rows, 'orders')
+            active_orders = sum_rows(
+                rows, 'orders',
+                status=['pending', 'confirmed', 'processing', 'shipped']
+            )
             
             # Calculate total spent
-            total_spent = Order.objects.filter(
-                user=request.user,
-                payment_status='paid'
-            ).aggregate(total=Sum('total_amount'))['total'] or 0
+            total_spent = sum_rows(rows, 'amount', payment_status='paid')
             
             return Response({
                 'total_orders': total_orders,
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PaymentMethod, Payment, Refund, PayoutRequest, Commission
+from .models import PaymentMethod, Payment, Refund, PayoutRequest, Commission, PaymentRollup
 
 @admin.register(PaymentMethod)
 class PaymentMethodAdmin(admin.ModelAdmin):
@@ -30,3 +30,8 @@ class CommissionAdmin(admin.ModelAdmin):
   list_display = ("id", "seller", "category", "commission_type", "commission_value", "is_active")
   list_filter = ("commission_type", "is_active")
   search_fields = ("seller__business_name", "category__name")
+
+@admin.register(PaymentRollup)
+class PaymentRollupAdmin(admin.ModelAdmin):
+  list_display = ("id", "seller", "user", "day", "status", "payment_count", "amount", "processing_fee")
+  list_filter = ("status", "day")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Payments'
+
+    def ready(self):
+        from .rollups import get_payment_tracker
+        get_payment_tracker().connect()
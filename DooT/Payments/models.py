@@ -230,3 +230,36 @@ class Commission(models.Model):
             commission = min(commission, self.max_commission)
         
         return commission
+
+class PaymentRollup(models.Model):
+    """Pre-aggregated daily payment counters per seller or per customer.
+
+    Maintained by ``Payments.rollups`` and rebuilt together with the order
+    rollups by ``manage.py rebuild_statistics_rollups``.
+    """
+    seller = models.ForeignKey(SellerProfile, on_delete=models.CASCADE, related_name='payment_rollups', null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payment_rollups', null=True, blank=True)
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Payment.STATUS_CHOICES)
+
+    payment_count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    processing_fee = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['seller', 'day', 'status'],
+                condition=models.Q(user__isnull=True),
+                name='unique_seller_payment_rollup',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'day', 'status'],
+                condition=models.Q(seller__isnull=True),
+                name='unique_customer_payment_rollup',
+            ),
+        ]
+
+    def __str__(self):
+        owner = f"seller {self.seller_id}" if self.seller_id else f"user {self.user_id}"
+        return f"{owner} - {self.day} - {self.status}: {self.payment_count}"
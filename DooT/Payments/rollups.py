@@ -0,0 +1,95 @@
+"""Incrementally maintained statistics rollups for payments.
+
+Uses the same ``RollupTracker`` machinery as ``Orders.rollups``.
+"""
+from functools import lru_cache
+from django.db import transaction
+from django.db.models import Sum, Count, F
+from django.db.models.functions import TruncDate
+from django.utils.dateparse import parse_datetime
+from Orders.rollups import RollupTracker, rollup_day, to_decimal, bulk_create_chunked
+
+
+@lru_cache(maxsize=4096)
+def order_seller_id(order_id):
+    """Seller of an order; an order never changes seller, so this is safe to cache"""
+    from Orders.models import Order
+    return Order.objects.filter(pk=order_id).values_list('seller_id', flat=True).first()
+
+
+def payment_contributions(state):
+    """A payment counts once towards its order's seller and once towards its payer"""
+    dimensions = {'day': rollup_day(state['created_at']), 'status': state['status']}
+    measures = {
+        'payment_count': 1,
+        'amount': to_decimal(state['amount']),
+        'processing_fee': to_decimal(state['processing_fee']),
+    }
+    contributions = [({'seller_id': None, 'user_id': state['user_id'], **dimensions}, measures)]
+    seller_id = order_seller_id(state['order_id'])
+    if seller_id:
+        contributions.append(({'seller_id': seller_id, 'user_id': None, **dimensions}, measures))
+    return contributions
+
+
+def get_payment_tracker():
+    from .models import Payment, PaymentRollup
+    return RollupTracker(
+        Payment, PaymentRollup,
+        fields=['order_id', 'user_id', 'created_at', 'status', 'amount', 'processing_fee'],
+        contributions=payment_contributions,
+    )
+
+
+def payment_rollup_rows(**owner):
+    """Payment counts, amounts and fees per status for one seller or customer"""
+    from .models import PaymentRollup
+    return list(
+        PaymentRollup.objects.filter(**owner)
+        .values('status')
+        .annotate(payments=Sum('payment_count'), total=Sum('amount'), fees=Sum('processing_fee'))
+        .order_by()
+    )
+
+
+def rebuild_payment_rollups(batch_size=1000):
+    """Recompute every PaymentRollup row from live payments and the order archive"""
+    from Orders.models import ArchivedOrder
+    from .models import Payment, PaymentRollup
+
+    totals = {}
+
+    def add(owner_field, owner, day, status, count, amount, fees):
+        key = (owner_field, owner, day, status)
+        previous = totals.get(key, (0, 0, 0))
+        totals[key] = (previous[0] + count, previous[1] + amount, previous[2] + fees)
+
+    for owner_field, rollup_field in (('order__seller_id', 'seller_id'), ('user_id', 'user_id')):
+        grouped = (
+            Payment.objects.annotate(day=TruncDate('created_at'), owner=F(owner_field))
+            .values('owner', 'day', 'status')
+            .annotate(payment_count=Count('id'), total=Sum('amount'), fees=Sum('processing_fee'))
+            .order_by()
+        )
+        for row in grouped.iterator():
+            add(rollup_field, row['owner'], row['day'], row['status'],
+                row['payment_count'], row['total'] or 0, row['fees'] or 0)
+
+    # Archived payments only exist inside the archived order documents
+    for seller_id, payload in ArchivedOrder.objects.values_list('seller_id', 'payload').iterator():
+        for payment in payload.get('payments', []):
+            day = rollup_day(parse_datetime(payment['created_at']))
+            amount, fee = to_decimal(payment['amount']), to_decimal(payment['processing_fee'])
+            add('seller_id', seller_id, day, payment['status'], 1, amount, fee)
+            add('user_id', payment['user'], day, payment['status'], 1, amount, fee)
+
+    rows = (
+        PaymentRollup(
+            day=day, status=status, payment_count=count, amount=amount, processing_fee=fees,
+            **{owner_field: owner}
+        )
+        for (owner_field, owner, day, status), (count, amount, fees) in totals.items()
+    )
+    with transaction.atomic():
+        PaymentRollup.objects.all().delete()
+        return bulk_create_chunked(PaymentRollup, rows, batch_size)
@@ -14,6 +14,8 @@ from .serializers import (
     PayoutRequestUpdateSerializer, CommissionSerializer, PaymentProcessSerializer,
     PaymentWebhookSerializer
 )
+from .rollups import payment_rollup_rows
+from Orders.rollups import sum_rows
 
 # Keep generics for simple listing and retrieval
 class PaymentMethodListView(generics.ListAPIView):
@@ -472,16 +474,10 @@ def payment_statistics(request):
     """Get payment statistics for dashboard with custom calculations"""
     try:
         if hasattr(request.user, 'seller_profile'):
-            # Seller statistics
-            total_payments = Payment.objects.filter(
-                order__seller=request.user.seller_profile,
-                status='completed'
-            ).count()
-            
-            total_revenue = Payment.objects.filter(
-                order__seller=request.user.seller_profile,
-                status='completed'
-            ).aggregate(total=Sum('amount'))['total'] or 0
+            # Seller statistics from the pre-aggregated rollup rows
+            rows = payment_rollup_rows(seller=request.user.seller_profile)
+            total_payments = sum_rows(rows, 'payments', status='completed')
+            total_revenue = sum_rows(rows, 'total', status='completed')
             
             pending_payouts = PayoutRequest.objects.filter(
                 seller=request.user.seller_profile,
@@ -489,10 +485,7 @@ def payment_statistics(request):
             ).aggregate(total=Sum('requested_amount'))['total'] or 0
             
             # Calculate processing fees
-            total_fees = Payment.objects.filter(
-                order__seller=request.user.seller_profile,
-                status='completed'
-            ).aggregate(total=Sum('processing_fee'))['total'] or 0
+            total_fees = sum_rows(rows, 'fees', status='completed')
             
             return Response({
                 'total_payments': total_payments,
@@ -502,16 +495,10 @@ def payment_statistics(request):
                 'net_revenue': total_revenue - total_fees
             })
         else:
-            # Customer statistics
-            total_payments = Payment.objects.filter(
-                user=request.user,
-                status='completed'
-            ).count()
-            
-            total_spent = Payment.objects.filter(
-                user=request.user,
-                status='completed'
-            ).aggregate(total=Sum('amount'))['total'] or 0
+            # Customer statistics from the pre-aggregated rollup rows
+            rows = payment_rollup_rows(user=request.user)
+            total_payments = sum_rows(rows, 'payments', status='completed')
+            total_spent = sum_rows(rows, 'total', status='completed')
             
             # Calculate average payment amount
             avg_payment = 0
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from Promotions.windows import badge, promotion_index
 from .models import Category, Brand, Product, ProductImage, ProductVariant, ProductReview
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -98,19 +99,27 @@ class ProductListSerializer(serializers.ModelSerializer):
     brand = BrandSerializer(read_only=True)
     primary_image = serializers.SerializerMethodField()
     seller_name = serializers.CharField(source='seller.business_name', read_only=True)
+    promotions = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = ['id', 'name', 'slug', 'short_description', 'category', 'brand',
                  'base_price', 'sale_price', 'current_price', 'discount_percentage',
                  'stock_quantity', 'average_rating', 'total_reviews', 'primary_image',
-                 'seller_name', 'is_featured', 'created_at']
+                 'seller_name', 'is_featured', 'promotions', 'created_at']
     
     def get_primary_image(self, obj):
         primary_image = obj.images.filter(is_primary=True).first()
         if primary_image:
             return ProductImageSerializer(primary_image).data
         return None
+    
+    def get_promotions(self, obj):
+        # Fetch the index once per listing; every row shares the root serializer's context
+        index = self.context.get('promotion_index')
+        if index is None:
+            index = self.context['promotion_index'] = promotion_index.get()
+        return [badge(promotion) for promotion in index.for_product(obj)]
 
 class ProductDetailSerializer(ProductSerializer):
     related_products = serializers.SerializerMethodField()
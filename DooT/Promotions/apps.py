@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PromotionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Promotions'
+
+    def ready(self):
+        from . import coupons, redemption, windows
+        coupons.connect()
+        redemption.connect()
+        windows.connect()
@@ -0,0 +1,181 @@
+"""Bulk generation of unique coupon codes.
+
+A CouponBatch asks for up to hundreds of thousands of single-use coupons
+with the same rules. Codes are drawn at random from the batch's alphabet and
+checked against an in-memory set seeded with the existing codes of the same
+shape, so almost every code is new on the first draw. Each batch of
+``COUPON_BATCH_INSERT_SIZE`` coupons is one transaction: a ``bulk_create``
+of the coupons, one ``bulk_create`` per targeted through table and the
+batch's ``generated`` counter. The unique index on ``Coupon.code`` is the
+final guard; a code created elsewhere in the meantime rolls the batch back
+and is replaced.
+
+``bulk_create`` sends no ``post_save``: counter stripes are allocated on
+first redemption (``Promotions.redemption``). The codes become redeemable
+when the run completes, which drops every process's cache of batch coupons
+(``Promotions.coupons``) so codes looked up before are found.
+"""
+import csv
+import logging
+import random
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+from django.utils import timezone
+from .coupons import batch_coupons
+from .models import Coupon, CouponBatch
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ('categories', 'products', 'sellers')
+
+# Copied from the batch onto every coupon
+RULE_FIELDS = (
+    'discount_type', 'discount_value', 'max_discount', 'max_uses', 'max_uses_per_user', 'applicable_to',
+    'min_order_value', 'max_order_value', 'valid_from', 'valid_until', 'first_time_users_only',
+)
+
+# Keep draws cheap: the code space must be this many times the codes asked for
+MIN_CODE_SPACE_RATIO = 100
+
+
+class CodeSpaceError(ValueError):
+    """The alphabet and length cannot produce enough distinct codes"""
+
+
+def check_code_space(alphabet, length, quantity, prefix=''):
+    alphabet = ''.join(dict.fromkeys(alphabet))
+    if len(alphabet) < 2:
+        raise CodeSpaceError('The alphabet needs at least two distinct characters')
+    if len(prefix) + length > Coupon._meta.get_field('code').max_length:
+        raise CodeSpaceError('Prefix and code length exceed the coupon code length')
+    if len(alphabet) ** length < quantity * MIN_CODE_SPACE_RATIO:
+        raise CodeSpaceError(
+            f'{len(alphabet)} characters of length {length} give too few codes for {quantity} coupons'
+        )
+    return alphabet
+
+
+class CodeGenerator:
+    """Random codes that are not in ``taken`` nor handed out before"""
+
+    def __init__(self, prefix, alphabet, length, taken=()):
+        self.prefix = prefix
+        self.alphabet = alphabet
+        self.length = length
+        self.seen = set(taken)
+        self._random = random.SystemRandom()
+
+    def take(self, count):
+        codes = []
+        while len(codes) < count:
+            code = self.prefix + ''.join(self._random.choices(self.alphabet, k=self.length))
+            if code not in self.seen:
+                self.seen.add(code)
+                codes.append(code)
+        return codes
+
+
+def existing_codes(prefix, length):
+    """Codes already in use that a generator with this prefix and length could draw"""
+    return (
+        Coupon.objects.filter(code__startswith=prefix).annotate(code_length=Length('code'))
+        .filter(code_length=len(prefix) + length).values_list('code', flat=True).iterator(chunk_size=10000)
+    )
+
+
+def _insert(batch, codes, rules, targets, generator):
+    """Create coupons for ``codes`` and their target links in one transaction"""
+    while True:
+        try:
+            with transaction.atomic():
+                coupons = [Coupon(code=code, name=batch.name, batch=batch, **rules) for code in codes]
+                Coupon.objects.bulk_create(coupons)
+                if coupons and coupons[0].pk is None:
+                    # Backends that cannot return inserted keys
+                    ids = dict(Coupon.objects.filter(code__in=codes).values_list('code', 'id'))
+                    for coupon in coupons:
+                        coupon.pk = ids[coupon.code]
+                for relation, target_ids in targets.items():
+                    field = getattr(Coupon, relation).field
+                    through = field.remote_field.through
+                    owner, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+                    through.objects.bulk_create(
+                        [through(**{owner: coupon.pk, target: target_id})
+                         for coupon in coupons for target_id in target_ids],
+                        batch_size=settings.COUPON_BATCH_INSERT_SIZE,
+                    )
+                CouponBatch.objects.filter(pk=batch.pk).update(
+                    generated=F('generated') + len(coupons), updated_at=timezone.now()
+                )
+            return len(coupons)
+        except IntegrityError:
+            # Codes created since the set was loaded: draw replacements
+            clashes = set(Coupon.objects.filter(code__in=codes).values_list('code', flat=True))
+            if not clashes:
+                raise
+            logger.info('Coupon batch %s: replacing %d clashing codes', batch.pk, len(clashes))
+            codes = [code for code in codes if code not in clashes] + generator.take(len(clashes))
+
+
+def generate_batch(batch_id, batch_size=None):
+    """Generate (or finish generating) a batch's coupons"""
+    batch_size = batch_size or settings.COUPON_BATCH_INSERT_SIZE
+    batch = CouponBatch.objects.get(pk=batch_id)
+    if batch.status == 'completed':
+        return batch
+    batch.status = 'running'
+    batch.error_message = ''
+    batch.started_at = batch.started_at or timezone.now()
+    batch.save(update_fields=['status', 'error_message', 'started_at', 'updated_at'])
+
+    try:
+        alphabet = check_code_space(batch.alphabet, batch.code_length, batch.quantity, batch.prefix)
+        generator = CodeGenerator(batch.prefix, alphabet, batch.code_length,
+                                  taken=existing_codes(batch.prefix, batch.code_length))
+        rules = {field: getattr(batch, field) for field in RULE_FIELDS}
+        targets = {}
+        for relation in TARGETS:
+            target_ids = list(getattr(batch, relation).values_list('pk', flat=True))
+            if target_ids:
+                targets[relation] = target_ids
+
+        # Generated coupons of an interrupted run are already in the database
+        generated = batch.coupons.count()
+        CouponBatch.objects.filter(pk=batch.pk).update(generated=generated)
+        while generated < batch.quantity:
+            codes = generator.take(min(batch_size, batch.quantity - generated))
+            generated += _insert(batch, codes, rules, targets, generator)
+    except Exception as e:
+        logger.exception('Coupon batch %s failed', batch_id)
+        CouponBatch.objects.filter(pk=batch_id).update(status='failed', error_message=str(e), updated_at=timezone.now())
+        raise
+
+    CouponBatch.objects.filter(pk=batch_id).update(
+        status='completed', finished_at=timezone.now(), updated_at=timezone.now()
+    )
+    batch_coupons.invalidate()
+    return CouponBatch.objects.get(pk=batch_id)
+
+
+class _Echo:
+    """File-like object whose ``write`` hands back the CSV line"""
+
+    def write(self, value):
+        return value
+
+
+CSV_FIELDS = ('code', 'discount_type', 'discount_value', 'max_uses', 'valid_from', 'valid_until')
+
+
+def batch_csv_rows(batch):
+    """CSV lines of a batch's coupons, read from the database in chunks"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_FIELDS)
+    rows = batch.coupons.order_by('id').values_list(*CSV_FIELDS).iterator(chunk_size=5000)
+    for code, discount_type, discount_value, max_uses, valid_from, valid_until in rows:
+        yield writer.writerow([
+            code, discount_type, discount_value, '' if max_uses is None else max_uses,
+            valid_from.isoformat(), valid_until.isoformat(),
+        ])
@@ -0,0 +1,234 @@
+"""In-memory coupon index and usage counters.
+
+Checkout and ``coupons/validate/`` look coupons up by code on every attempt,
+and code-guessing bots mostly ask for codes that do not exist. Active,
+unexpired coupons are compiled once per process into ``CompiledCoupon``
+objects keyed by code, with their category/product/seller targets as
+frozensets, so an unknown code costs one dict lookup and a known one never
+touches the Coupon or through tables. The index is rebuilt through the
+``CompiledCache`` version whenever a coupon or its targets change.
+
+Coupons generated by a CouponBatch (``Promotions.codes``) can run to
+hundreds of thousands of single-use codes and stay out of that index. They
+are looked up through the unique ``code`` index when first asked for and
+kept in a per-process cache of at most ``COUPON_BATCH_CACHE_SIZE`` codes
+(unknown codes included), which is dropped whenever a batch coupon changes
+or a batch completes.
+
+Usage limits are checked against cached counters (total uses and uses per
+user) read in one round trip; they are counted from the database on a miss
+and incremented when a redemption commits. Checkout does not rely on them:
+it checks against the database (``check(fresh=True)``).
+"""
+import copy
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.utils import timezone
+from Shipping.zones import CompiledCache
+from .models import Coupon, CouponCounterStripe, CouponUsage
+
+
+class CompiledCoupon:
+    """The rule part of a Coupon; quacks like one for ``Orders.pricing``"""
+
+    FIELDS = (
+        'id', 'code', 'discount_type', 'discount_value', 'max_discount', 'max_uses', 'max_uses_per_user',
+        'applicable_to', 'min_order_value', 'max_order_value', 'valid_from', 'valid_until',
+        'first_time_users_only',
+    )
+    __slots__ = FIELDS + ('target_ids', 'instance')
+
+    def __init__(self, coupon):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(coupon, name))
+        self.instance = coupon
+        if coupon.applicable_to == 'all':
+            self.target_ids = frozenset()
+        else:
+            # Targets are prefetched as ids only
+            self.target_ids = frozenset(target.id for target in getattr(coupon, coupon.applicable_to).all())
+
+    # Same arithmetic as the model
+    calculate_discount = Coupon.calculate_discount
+
+    def check(self, user=None, order_value=0, now=None, fresh=False):
+        """``(can_use, message)`` for ``user`` (None for anonymous) and an order value
+
+        ``fresh`` re-reads whether the coupon is active and its use counts
+        from the database rather than trusting this process's copies; checkout
+        passes it, validation does not.
+        """
+        now = now or timezone.now()
+        if now < self.valid_from:
+            return False, "Coupon is not yet valid"
+        if now > self.valid_until:
+            return False, "Coupon has expired"
+        if order_value < self.min_order_value:
+            return False, f"Minimum order value is {self.min_order_value}"
+        if self.max_order_value and order_value > self.max_order_value:
+            return False, f"Maximum order value is {self.max_order_value}"
+
+        if fresh and not Coupon.objects.filter(pk=self.id, is_active=True).exists():
+            return False, "Coupon is no longer active"
+
+        user_id = user.id if user is not None and user.is_authenticated else None
+        uses, user_uses = usage_counts(self.id, user_id, fresh=fresh)
+        if self.max_uses is not None and uses >= self.max_uses:
+            return False, "Coupon usage limit reached"
+        if user_id is None:
+            return True, "Valid"
+        if user_uses >= self.max_uses_per_user:
+            return False, "Maximum usage limit reached for this user"
+        if self.first_time_users_only and (user.orders.exists() or user.archived_orders.exists()):
+            return False, "Coupon is for first-time users only"
+        return True, "Valid"
+
+    def as_instance(self):
+        """A copy of the indexed Coupon with the current use count, for serializing"""
+        coupon = copy.copy(self.instance)
+        coupon.current_uses = usage_counts(self.id)[0]
+        return coupon
+
+
+class CouponIndex:
+    def __init__(self, coupons):
+        self.by_code = {coupon.code: CompiledCoupon(coupon) for coupon in coupons}
+
+    def get(self, code):
+        return self.by_code.get(code)
+
+
+def _active_coupons():
+    targets = [
+        Prefetch(name, queryset=getattr(Coupon, name).field.related_model.objects.only('id'))
+        for name in ('categories', 'products', 'sellers')
+    ]
+    return Coupon.objects.filter(is_active=True, valid_until__gte=timezone.now()).prefetch_related(*targets)
+
+
+def build_coupon_index():
+    return CouponIndex(list(_active_coupons().filter(batch__isnull=True)))
+
+
+class BatchCouponCache:
+    """Batch coupons compiled on first lookup; the least recently used are dropped past ``size`` codes"""
+
+    def __init__(self, size):
+        self.size = size
+        self._codes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        with self._lock:
+            if code in self._codes:
+                self._codes.move_to_end(code)
+                return self._codes[code]
+        # Codes of a batch that is still generating are not redeemable yet
+        coupon = _active_coupons().filter(code=code, batch__status='completed').first()
+        compiled = CompiledCoupon(coupon) if coupon is not None else None
+        with self._lock:
+            self._codes[code] = compiled
+            if len(self._codes) > self.size:
+                self._codes.popitem(last=False)
+        return compiled
+
+
+coupon_index = CompiledCache('coupon-index', build_coupon_index, namespace='promotions')
+batch_coupons = CompiledCache(
+    'batch-coupons', lambda: BatchCouponCache(settings.COUPON_BATCH_CACHE_SIZE), namespace='promotions'
+)
+
+
+def get_coupon(code):
+    """The compiled active coupon for ``code``, or None"""
+    if not code:
+        return None
+    return coupon_index.get().get(code) or batch_coupons.get().get(code)
+
+
+# Usage counters
+def _uses_key(coupon_id):
+    return f'promotions:coupon:{coupon_id}:uses'
+
+
+def _user_uses_key(coupon_id, user_id):
+    return f'promotions:coupon:{coupon_id}:user:{user_id}:uses'
+
+
+def total_uses(coupon_id):
+    """Uses of a coupon from its counter stripes (``Promotions.redemption``), or the Coupon row if not striped"""
+    total = CouponCounterStripe.objects.filter(coupon_id=coupon_id).aggregate(total=Sum('used'))['total']
+    if total is None:
+        total = Coupon.objects.filter(pk=coupon_id).values_list('current_uses', flat=True).first() or 0
+    return total
+
+
+def usage_counts(coupon_id, user_id=None, fresh=False):
+    """``(total uses, uses by user_id)`` from the cache, counted from the database on a miss or when ``fresh``"""
+    if fresh:
+        user_uses = 0
+        if user_id is not None:
+            user_uses = CouponUsage.objects.filter(coupon_id=coupon_id, user_id=user_id).count()
+        return total_uses(coupon_id), user_uses
+    keys = [_uses_key(coupon_id)]
+    if user_id is not None:
+        keys.append(_user_uses_key(coupon_id, user_id))
+    cached = cache.get_many(keys)
+    timeout = settings.COUPON_USAGE_COUNT_TIMEOUT
+
+    uses = cached.get(keys[0])
+    if uses is None:
+        uses = total_uses(coupon_id)
+        cache.add(keys[0], uses, timeout=timeout)
+    user_uses = 0
+    if user_id is not None:
+        user_uses = cached.get(keys[1])
+        if user_uses is None:
+            user_uses = CouponUsage.objects.filter(coupon_id=coupon_id, user_id=user_id).count()
+            cache.add(keys[1], user_uses, timeout=timeout)
+    return uses, user_uses
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not cached: the next read counts from the database
+        pass
+
+
+def record_redemption(coupon_id, user_id):
+    """Count one use once the redeeming transaction commits"""
+    def apply():
+        _incr(_uses_key(coupon_id))
+        _incr(_user_uses_key(coupon_id, user_id))
+
+    transaction.on_commit(apply)
+
+
+def _usage_deleted(sender, instance, **kwargs):
+    keys = [_uses_key(instance.coupon_id), _user_uses_key(instance.coupon_id, instance.user_id)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _coupon_changed(sender, instance, reverse=False, **kwargs):
+    # Targets changed from the category/product/seller side may concern either kind
+    if reverse or instance.batch_id is None:
+        coupon_index.invalidate()
+    if reverse or instance.batch_id is not None:
+        batch_coupons.invalidate()
+
+
+def connect():
+    from django.db.models.signals import post_save, post_delete, m2m_changed
+    post_save.connect(_coupon_changed, sender=Coupon, dispatch_uid='coupon-index-save')
+    post_delete.connect(_coupon_changed, sender=Coupon, dispatch_uid='coupon-index-delete')
+    for name in ('categories', 'products', 'sellers'):
+        through = getattr(Coupon, name).through
+        m2m_changed.connect(_coupon_changed, sender=through, dispatch_uid=f'coupon-index-{name}')
+    # Usages removed along with their orders: recount on the next read
+    post_delete.connect(_usage_deleted, sender=CouponUsage, dispatch_uid='coupon-usage-delete')
@@ -0,0 +1,164 @@
+"""Buffered campaign engagement counters.
+
+Tracking pixels and links hit a campaign once per open or click; adding to
+``Campaign.total_*`` on every hit would queue them all on that row's lock.
+``track`` only adds to an in-process buffer keyed by campaign, day and event.
+The buffer is written out every ``CAMPAIGN_ENGAGEMENT_FLUSH_INTERVAL``
+seconds by a background thread, as soon as it holds
+``CAMPAIGN_ENGAGEMENT_FLUSH_SIZE`` events, and when the process exits: one
+F() UPDATE per campaign and one per CampaignEngagement day row, however many
+hits were buffered. Hits buffered by a process that is killed are lost,
+which engagement statistics tolerate.
+
+Sends are not buffered: the bulk fan-out counts each chunk with
+``count_sent`` inside the chunk's transaction. Conversions are not reported
+by clients but attributed on the server when an order is placed: the order
+converts the last campaign sent to its customer within
+``CAMPAIGN_ATTRIBUTION_DAYS`` (``attribute_conversion``).
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from Orders.rollups import bump_rollup, rollup_day
+from .models import Campaign, CampaignEngagement
+
+logger = logging.getLogger(__name__)
+
+# Event -> Campaign total it adds to (CampaignEngagement uses the event name)
+EVENTS = {
+    'sent': 'total_sent',
+    'opened': 'total_opened',
+    'clicked': 'total_clicked',
+    'converted': 'total_converted',
+}
+
+
+def write(counts):
+    """Add ``{(campaign_id, day, event): count}`` to the campaigns and their day rows"""
+    totals, days = {}, {}
+    for (campaign_id, day, event), count in counts.items():
+        field = EVENTS[event]
+        totals.setdefault(campaign_id, Counter())[field] += count
+        days.setdefault((campaign_id, day), Counter())[event] += count
+    # Hits for campaigns that do not exist (any more) are dropped
+    existing = set(Campaign.objects.filter(pk__in=totals).values_list('pk', flat=True))
+    with transaction.atomic():
+        # Rows are updated in key order so concurrent flushes cannot deadlock
+        for campaign_id in sorted(existing):
+            Campaign.objects.filter(pk=campaign_id).update(
+                **{field: F(field) + count for field, count in totals[campaign_id].items()}
+            )
+        for (campaign_id, day), deltas in sorted(days.items()):
+            if campaign_id in existing:
+                bump_rollup(CampaignEngagement, {'campaign_id': campaign_id, 'day': day}, dict(deltas))
+
+
+def count_sent(campaign_id, count):
+    """Count ``count`` notifications sent for a campaign, in the current transaction"""
+    if count:
+        write({(campaign_id, rollup_day(timezone.now()), 'sent'): count})
+
+
+class EngagementBuffer:
+    def __init__(self):
+        self._counts = Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, campaign_id, event, count=1):
+        """Buffer ``count`` events; True when the buffer is due to be flushed"""
+        key = (campaign_id, rollup_day(timezone.now()), event)
+        with self._lock:
+            self._counts[key] += count
+            self._pending += count
+            due = self._pending >= settings.CAMPAIGN_ENGAGEMENT_FLUSH_SIZE
+            if self._flusher is None or not self._flusher.is_alive():
+                # Started lazily, so forked workers get their own
+                self._flusher = threading.Thread(target=self._run, name='campaign-engagement-flusher', daemon=True)
+                self._flusher.start()
+        return due
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts, self._pending = self._counts, Counter(), 0
+        return counts
+
+    def restore(self, counts):
+        with self._lock:
+            self._counts.update(counts)
+            self._pending += sum(counts.values())
+
+    def flush(self):
+        """Write out the buffered events; returns how many were written"""
+        counts = self.drain()
+        if not counts:
+            return 0
+        try:
+            write(counts)
+        except Exception:
+            logger.exception('Could not flush campaign engagement counters')
+            self.restore(counts)
+            return 0
+        return sum(counts.values())
+
+    def _run(self):
+        while True:
+            time.sleep(settings.CAMPAIGN_ENGAGEMENT_FLUSH_INTERVAL)
+            close_old_connections()
+            self.flush()
+
+
+buffer = EngagementBuffer()
+atexit.register(buffer.flush)
+
+
+def track(campaign_id, event, count=1):
+    """Count ``count`` opens, clicks or conversions of a campaign"""
+    if event not in EVENTS:
+        raise ValueError(f'Unknown campaign event: {event}')
+    if buffer.add(campaign_id, event, count):
+        buffer.flush()
+
+
+def attribute_conversion(user_id, at=None):
+    """Count a conversion for the last campaign sent to ``user_id`` in the attribution window; returns its id"""
+    from Notifications.models import Notification
+    at = at or timezone.now()
+    campaign_id = (
+        Notification.objects.filter(
+            user_id=user_id, metadata__campaign__isnull=False,
+            created_at__gte=at - timedelta(days=settings.CAMPAIGN_ATTRIBUTION_DAYS), created_at__lte=at,
+        )
+        .order_by('-created_at').values_list('metadata__campaign', flat=True).first()
+    )
+    if campaign_id is not None:
+        track(int(campaign_id), 'converted')
+    return campaign_id
+
+
+def engagement_by_day(campaign, since=None):
+    """The campaign's CampaignEngagement rows with their rates, oldest first"""
+    rows = campaign.engagement.all()
+    if since:
+        rows = rows.filter(day__gte=since)
+    return [
+        {
+            'day': row.day,
+            'sent': row.sent,
+            'opened': row.opened,
+            'clicked': row.clicked,
+            'converted': row.converted,
+            'open_rate': round(row.open_rate, 2),
+            'click_rate': round(row.click_rate, 2),
+            'conversion_rate': round(row.conversion_rate, 2),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,101 @@
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from Orders.models import Order
+from Promotions.models import Coupon, CouponCounterStripe, CouponUsage
+from Promotions.redemption import CouponLimitReached, allocate_stripes, redeem
+from Users.models import User, SellerProfile
+
+
+class Command(BaseCommand):
+    help = 'Redeem one coupon from many parallel checkouts and check the limits held (use PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--redeemers', type=int, default=32, help='Parallel checkouts')
+        parser.add_argument('--attempts', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--max-uses', type=int, default=1000)
+        parser.add_argument('--max-uses-per-user', type=int, default=3)
+        parser.add_argument('--stripes', type=int, help='Counter stripes (default COUPON_COUNTER_STRIPES; 1 = one hot row)')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark coupon, users and orders')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        now = timezone.now()
+        seller_user = User.objects.create(email=f'bench-seller-{tag}@example.com', name='bench seller', is_seller=True)
+        seller = SellerProfile.objects.create(
+            user=seller_user, business_name=f'Benchmark {tag}', address_line1='-', city='-', state='-',
+            country='-', zip_code='-', phone='-',
+        )
+        User.objects.bulk_create([
+            User(email=f'bench-{tag}-{index}@example.com', name=f'bench {index}') for index in range(options['users'])
+        ])
+        users = list(User.objects.filter(email__startswith=f'bench-{tag}-'))
+        coupon = Coupon(
+            code=f'BENCH-{tag.upper()}', name='Redemption benchmark', discount_type='fixed', discount_value=1,
+            max_uses=options['max_uses'], max_uses_per_user=options['max_uses_per_user'],
+            valid_from=now, valid_until=now + timedelta(days=1),
+        )
+        coupon.save()
+        if options['stripes']:
+            CouponCounterStripe.objects.filter(coupon=coupon).delete()
+            allocate_stripes(coupon, stripes=options['stripes'])
+
+        def attempt(index):
+            user = random.choice(users)
+            started = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(
+                        user=user, seller=seller, subtotal=10, total_amount=9, shipping_address='-',
+                        shipping_city='-', shipping_state='-', shipping_country='-', shipping_zip_code='-',
+                        shipping_phone='-',
+                    )
+                    redeem(coupon, user, order, 1)
+                redeemed = True
+            except CouponLimitReached:
+                redeemed = False
+            finally:
+                connection.close()
+            return redeemed, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['redeemers']) as executor:
+            results = list(executor.map(attempt, range(options['attempts'])))
+        elapsed = time.perf_counter() - started
+
+        redeemed = sum(1 for ok, _ in results if ok)
+        latencies = sorted(latency for _, latency in results)
+        usages = CouponUsage.objects.filter(coupon=coupon)
+        per_user = usages.values('user').annotate(uses=Count('id')).aggregate(most=Max('uses'))['most'] or 0
+        striped = CouponCounterStripe.objects.filter(coupon=coupon).aggregate(total=Sum('used'))['total']
+        expected = min(options['attempts'], options['max_uses'], options['users'] * options['max_uses_per_user'])
+
+        self.stdout.write(f'stripes: {CouponCounterStripe.objects.filter(coupon=coupon).count()}')
+        self.stdout.write(f'attempts: {len(results)}, redeemed: {redeemed}, rejected: {len(results) - redeemed}')
+        self.stdout.write(f'elapsed: {elapsed:.2f}s, attempts/s: {len(results) / elapsed:.1f}')
+        self.stdout.write(
+            f'latency p50: {latencies[len(latencies) // 2] * 1000:.1f}ms, '
+            f'p95: {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms, max: {latencies[-1] * 1000:.1f}ms'
+        )
+        consistent = (
+            usages.count() == redeemed == striped
+            and redeemed <= options['max_uses']
+            and per_user <= options['max_uses_per_user']
+        )
+        message = (
+            f'usages: {usages.count()}, stripe total: {striped}, most by one user: {per_user}, '
+            f'expected at most: {expected}'
+        )
+        self.stdout.write(self.style.SUCCESS(message) if consistent else self.style.ERROR(message))
+
+        if not options['keep']:
+            coupon.delete()
+            User.objects.filter(email__startswith=f'bench-{tag}-').delete()
+            seller_user.delete()
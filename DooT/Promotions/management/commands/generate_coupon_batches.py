@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from Promotions.codes import generate_batch
+from Promotions.models import CouponBatch
+
+
+class Command(BaseCommand):
+    help = 'Generate pending coupon batches and resume interrupted ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('batch_ids', nargs='*', type=int, help='Defaults to every pending, running or failed batch')
+        parser.add_argument('--batch-size', type=int, help='Coupons per insert; defaults to COUPON_BATCH_INSERT_SIZE')
+
+    def handle(self, *args, **options):
+        batch_ids = options['batch_ids'] or list(
+            CouponBatch.objects.filter(status__in=['pending', 'running', 'failed'])
+            .order_by('id').values_list('id', flat=True)
+        )
+        for batch_id in batch_ids:
+            batch = generate_batch(batch_id, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Batch {batch.id}: {batch.status}, {batch.generated}/{batch.quantity} coupons'
+            ))
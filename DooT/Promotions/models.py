@@ -56,6 +56,7 @@ class Coupon(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='created_coupons')
+    batch = models.ForeignKey('CouponBatch', on_delete=models.SET_NULL, null=True, blank=True, related_name='coupons')
 
     class Meta:
         ordering = ['-created_at']
@@ -87,7 +88,7 @@ class Coupon(models.Model):
         if self.max_order_value and order_value > self.max_order_value:
             return False, f"Maximum order value is {self.max_order_value}"
         
-        if self.first_time_users_only and user.orders.exists():
+        if self.first_time_users_only and (user.orders.exists() or user.archived_orders.exists()):
             return False, "Coupon is for first-time users only"
         
         # Check usage per user
@@ -125,6 +126,101 @@ class CouponUsage(models.Model):
     def __str__(self):
         return f"{self.coupon.code} used by {self.user.name}"
 
+class CouponBatch(models.Model):
+    """A run of generated coupon codes that share one set of rules.
+
+    ``Promotions.codes`` inserts the coupons in batches and commits
+    ``generated`` with each batch, so an interrupted run resumes where it
+    stopped.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=255)
+    campaign = models.ForeignKey('Campaign', on_delete=models.SET_NULL, null=True, blank=True, related_name='coupon_batches')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='coupon_batches')
+
+    # Codes: prefix followed by code_length characters from alphabet
+    quantity = models.PositiveIntegerField()
+    prefix = models.CharField(max_length=20, blank=True)
+    code_length = models.PositiveSmallIntegerField()
+    alphabet = models.CharField(max_length=64)
+
+    # Rules given to every coupon
+    discount_type = models.CharField(max_length=20, choices=Coupon.DISCOUNT_TYPE_CHOICES)
+    discount_value = models.DecimalField(max_digits=10, decimal_places=2)
+    max_discount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_uses = models.PositiveIntegerField(null=True, blank=True, default=1)
+    max_uses_per_user = models.PositiveIntegerField(default=1)
+    applicable_to = models.CharField(max_length=20, choices=Coupon.APPLICABLE_TO_CHOICES, default='all')
+    categories = models.ManyToManyField(Category, blank=True, related_name='coupon_batches')
+    products = models.ManyToManyField(Product, blank=True, related_name='coupon_batches')
+    sellers = models.ManyToManyField(SellerProfile, blank=True, related_name='coupon_batches')
+    min_order_value = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    max_order_value = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    valid_from = models.DateTimeField()
+    valid_until = models.DateTimeField()
+    first_time_users_only = models.BooleanField(default=False)
+
+    # Progress
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    generated = models.PositiveIntegerField(default=0)
+    error_message = models.TextField(blank=True)
+
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} - {self.status} ({self.generated}/{self.quantity})"
+
+    @property
+    def progress(self):
+        return round(self.generated * 100 / self.quantity, 2) if self.quantity else 0
+
+class CouponCounterStripe(models.Model):
+    """One slice of a coupon's use counter.
+
+    Redemptions take a use from any stripe with room left instead of
+    incrementing the single Coupon row, so concurrent checkouts rarely wait on
+    each other. The allotments of a coupon's stripes add up to ``max_uses``
+    (they are null when uses are unlimited). See ``Promotions.redemption``.
+    """
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='counter_stripes')
+    stripe = models.PositiveSmallIntegerField()
+    allotment = models.PositiveIntegerField(null=True, blank=True)
+    used = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['coupon', 'stripe'], name='unique_coupon_counter_stripe'),
+        ]
+
+    def __str__(self):
+        return f"{self.coupon_id} stripe {self.stripe}: {self.used}/{self.allotment}"
+
+class CouponUserCounter(models.Model):
+    """Uses of a coupon by one user, taken atomically within ``max_uses_per_user``"""
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='user_counters')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='coupon_counters')
+    uses = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['coupon', 'user'], name='unique_coupon_user_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.coupon_id} by {self.user_id}: {self.uses}"
+
 class Discount(models.Model):
     DISCOUNT_TYPE_CHOICES = [
         ('percentage', 'Percentage'),
@@ -283,6 +379,46 @@ class Campaign(models.Model):
             return 0
         return (self.total_converted / self.total_sent) * 100
 
+class CampaignEngagement(models.Model):
+    """A campaign's sends, opens, clicks and conversions on one day.
+
+    Written in batches by ``Promotions.engagement`` together with the
+    Campaign totals, so rates can be reported over time.
+    """
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='engagement')
+    day = models.DateField()
+    sent = models.PositiveIntegerField(default=0)
+    opened = models.PositiveIntegerField(default=0)
+    clicked = models.PositiveIntegerField(default=0)
+    converted = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'day'], name='unique_campaign_engagement_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.campaign_id} on {self.day}: {self.sent} sent, {self.opened} opened"
+
+    @property
+    def open_rate(self):
+        if self.sent == 0:
+            return 0
+        return (self.opened / self.sent) * 100
+
+    @property
+    def click_rate(self):
+        if self.sent == 0:
+            return 0
+        return (self.clicked / self.sent) * 100
+
+    @property
+    def conversion_rate(self):
+        if self.sent == 0:
+            return 0
+        return (self.converted / self.sent) * 100
+
 class ReferralProgram(models.Model):
     """Referral program for users to earn rewards"""
     name = models.CharField(max_length=255)
@@ -0,0 +1,153 @@
+"""Contention-free coupon redemption.
+
+Many checkouts redeem a popular coupon at the same moment; incrementing
+``Coupon.current_uses`` would queue all of them on that row's lock until each
+checkout commits. Instead a coupon's use counter is split over
+``COUPON_COUNTER_STRIPES`` CouponCounterStripe rows (at most ``max_uses``)
+whose allotments add up to ``max_uses``. A redemption takes a use from a stripe with room left that no
+other transaction holds (SKIP LOCKED where the database supports it), takes
+the per-user limit from the user's own CouponUserCounter row and writes the
+CouponUsage, all in the checkout's transaction, so a checkout that rolls back
+gives its use back. ``sync_current_uses`` copies the striped totals back into
+``Coupon.current_uses`` for display.
+"""
+import random
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from .coupons import record_redemption
+from .models import Coupon, CouponCounterStripe, CouponUsage, CouponUserCounter
+
+
+class CouponLimitReached(Exception):
+    """The coupon, or the user's share of it, has no uses left"""
+
+
+def _shares(remaining, count):
+    """Split ``remaining`` uses as evenly as possible over ``count`` stripes"""
+    base, extra = divmod(remaining, count)
+    return [base + (1 if index < extra else 0) for index in range(count)]
+
+
+def allocate_stripes(coupon, stripes=None):
+    """Create the coupon's stripes, or spread its remaining uses over them again.
+
+    Stripes keep the uses they have already handed out. The stripes are
+    locked while they are rebalanced, e.g. after ``max_uses`` changed.
+    """
+    with transaction.atomic():
+        rows = list(CouponCounterStripe.objects.select_for_update().filter(coupon_id=coupon.id).order_by('stripe'))
+        created = not rows
+        if created:
+            stripes = stripes or settings.COUPON_COUNTER_STRIPES
+            if coupon.max_uses is not None:
+                # No more stripes than uses: a single-use coupon gets one row
+                stripes = max(min(stripes, coupon.max_uses), 1)
+            rows = [CouponCounterStripe(coupon_id=coupon.id, stripe=index) for index in range(stripes)]
+            # Uses counted on the Coupon row before it was striped
+            rows[0].used = Coupon.objects.filter(pk=coupon.id).values_list('current_uses', flat=True).first() or 0
+
+        if coupon.max_uses is None:
+            for row in rows:
+                row.allotment = None
+        else:
+            remaining = max(coupon.max_uses - sum(row.used for row in rows), 0)
+            for row, share in zip(rows, _shares(remaining, len(rows))):
+                row.allotment = row.used + share
+
+        if created:
+            # A concurrent first redemption may have striped the coupon already
+            CouponCounterStripe.objects.bulk_create(rows, ignore_conflicts=True)
+        else:
+            CouponCounterStripe.objects.bulk_update(rows, ['allotment'])
+
+
+def _take_stripe(coupon_id):
+    """Take one use from a stripe with room left; False when every stripe is used up"""
+    available = CouponCounterStripe.objects.filter(coupon_id=coupon_id).filter(
+        Q(allotment__isnull=True) | Q(used__lt=F('allotment'))
+    )
+    if connection.features.has_select_for_update_skip_locked:
+        pk = available.select_for_update(skip_locked=True).order_by('?').values_list('pk', flat=True).first()
+        if pk is not None:
+            CouponCounterStripe.objects.filter(pk=pk).update(used=F('used') + 1)
+            return True
+    # Every stripe with room is held by another checkout: wait for them in random order
+    pks = list(available.values_list('pk', flat=True))
+    random.shuffle(pks)
+    for pk in pks:
+        if available.filter(pk=pk).update(used=F('used') + 1):
+            return True
+    return False
+
+
+def _take_user_use(coupon, user_id):
+    """Take one of the user's ``max_uses_per_user``; False when they are used up"""
+    counter = CouponUserCounter.objects.filter(coupon_id=coupon.id, user_id=user_id)
+    if counter.filter(uses__lt=coupon.max_uses_per_user).update(uses=F('uses') + 1):
+        return True
+    # No counter yet: start from the usages recorded so far
+    used = CouponUsage.objects.filter(coupon_id=coupon.id, user_id=user_id).count()
+    if used >= coupon.max_uses_per_user:
+        return False
+    try:
+        with transaction.atomic():
+            CouponUserCounter.objects.create(coupon_id=coupon.id, user_id=user_id, uses=used + 1)
+        return True
+    except IntegrityError:
+        # The counter exists (possibly just created by a concurrent checkout of this user)
+        return bool(counter.filter(uses__lt=coupon.max_uses_per_user).update(uses=F('uses') + 1))
+
+
+def redeem(coupon, user, order, discount_amount):
+    """Record one use of ``coupon`` by ``user`` for ``order`` in the current transaction.
+
+    ``coupon`` may be a Coupon or a compiled coupon from the index. Raises
+    CouponLimitReached when the coupon or the user's limit is used up.
+    """
+    with transaction.atomic():
+        if not _take_user_use(coupon, user.id):
+            raise CouponLimitReached("Maximum usage limit reached for this user")
+        taken = _take_stripe(coupon.id)
+        if not taken and not CouponCounterStripe.objects.filter(coupon_id=coupon.id).exists():
+            allocate_stripes(coupon)
+            taken = _take_stripe(coupon.id)
+        if not taken:
+            raise CouponLimitReached("Coupon usage limit reached")
+        usage = CouponUsage.objects.create(
+            coupon_id=coupon.id, user=user, order=order, discount_amount=discount_amount
+        )
+    record_redemption(coupon.id, user.id)
+    return usage
+
+
+def sync_current_uses():
+    """Copy the striped totals into ``Coupon.current_uses``; returns the number of coupons updated"""
+    totals = (
+        CouponCounterStripe.objects.filter(coupon=OuterRef('pk'))
+        .values('coupon').annotate(total=Sum('used')).values('total')
+    )
+    striped = CouponCounterStripe.objects.values('coupon_id')
+    return Coupon.objects.filter(pk__in=striped).update(current_uses=Subquery(totals))
+
+
+def _coupon_saved(sender, instance, **kwargs):
+    # Allotments follow max_uses
+    allocate_stripes(instance)
+
+
+def _usage_deleted(sender, instance, **kwargs):
+    # Give the use back to the user and to one stripe
+    CouponUserCounter.objects.filter(
+        coupon_id=instance.coupon_id, user_id=instance.user_id, uses__gt=0
+    ).update(uses=F('uses') - 1)
+    stripes = CouponCounterStripe.objects.filter(coupon_id=instance.coupon_id, used__gt=0)
+    pk = stripes.values_list('pk', flat=True).first()
+    if pk is not None:
+        stripes.filter(pk=pk).update(used=F('used') - 1)
+
+
+def connect():
+    from django.db.models.signals import post_save, post_delete
+    post_save.connect(_coupon_saved, sender=Coupon, dispatch_uid='coupon-stripes-save')
+    post_delete.connect(_usage_deleted, sender=CouponUsage, dispatch_uid='coupon-usage-release')
@@ -0,0 +1,252 @@
+"""Campaign audience segmentation.
+
+A targeting spec (``Campaign.target_audience``) is compiled into one filter
+on the User table. Order counts and spend, categories purchased and
+notification preferences are correlated subqueries on indexed foreign keys.
+``stream_user_ids`` walks the matching users in id order with keyset
+pagination, so no User objects are loaded and each chunk only evaluates the
+users it scans. The bulk notification pipeline walks ``segment_queryset`` in
+the same way (``BulkNotificationJob.audience``).
+
+Spec keys, all optional and combined with AND::
+
+    min_orders, max_orders          orders placed (live and archived, not cancelled/refunded)
+    min_spent, max_spent            total of those orders
+    ordered_within_days             placed an order in the last N days
+    not_ordered_within_days         placed no order in the last N days
+    categories                      bought a product in any of these category ids
+    active_within_days              logged in during the last N days
+    inactive_for_days               no login in the last N days (or never)
+    joined_within_days              registered in the last N days
+    is_seller                       true/false
+    preferences                     {NotificationPreference field: value}
+    segments                        names from SEGMENTS, any of which may match
+    any / all                       lists of nested specs
+    not                             a nested spec that must not match
+"""
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db.models import DecimalField, Exists, IntegerField, OuterRef, Q, Subquery, Sum, Count, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from Notifications.models import NotificationPreference
+from Orders.models import Order, OrderItem, ArchivedOrder
+from Users.models import User
+
+# Orders that never turned into a sale do not count towards orders or spend
+UNCOUNTED_ORDER_STATUSES = ['cancelled', 'refunded']
+
+# Named segments usable in Campaign.user_segments and the ``segments`` key
+SEGMENTS = {
+    'new_customers': {'min_orders': 1, 'max_orders': 1},
+    'repeat_customers': {'min_orders': 2},
+    'never_purchased': {'max_orders': 0},
+    'lapsed_customers': {'min_orders': 1, 'not_ordered_within_days': 90},
+    'recently_active': {'active_within_days': 30},
+    'new_users': {'joined_within_days': 30},
+    'sellers': {'is_seller': True},
+}
+
+# Campaign type -> preference a user must not have turned off
+CHANNEL_PREFERENCES = {
+    'email': 'email_promotions',
+    'sms': 'sms_promotions',
+    'push': 'push_promotions',
+}
+
+PREFERENCE_FIELDS = {
+    field.name: field for field in NotificationPreference._meta.concrete_fields
+    if field.name not in ('id', 'user', 'created_at', 'updated_at')
+}
+
+
+class SegmentError(ValueError):
+    """The targeting spec cannot be compiled"""
+
+
+def _days_ago(value, key):
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        raise SegmentError(f'{key} must be a number of days')
+    return timezone.now() - timedelta(days=days)
+
+
+def _number(value, key):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise SegmentError(f'{key} must be a whole number')
+
+
+def _amount(value, key):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise SegmentError(f'{key} must be an amount')
+
+
+def _order_totals(aggregate, output_field):
+    """Per-user aggregate over live plus archived orders, as a correlated subquery"""
+    parts = []
+    for model in (Order, ArchivedOrder):
+        rows = (
+            model.objects.filter(user=OuterRef('pk')).exclude(status__in=UNCOUNTED_ORDER_STATUSES)
+            .order_by().values('user').annotate(value=aggregate).values('value')
+        )
+        parts.append(Coalesce(Subquery(rows, output_field=output_field), Value(0), output_field=output_field))
+    return parts[0] + parts[1]
+
+
+def _ordered_since(since):
+    live = Order.objects.filter(user=OuterRef('pk'), created_at__gte=since).exclude(status__in=UNCOUNTED_ORDER_STATUSES)
+    archived = ArchivedOrder.objects.filter(user=OuterRef('pk'), created_at__gte=since).exclude(
+        status__in=UNCOUNTED_ORDER_STATUSES
+    )
+    return Q(Exists(live)) | Q(Exists(archived))
+
+
+def _preference(name, value):
+    field = PREFERENCE_FIELDS.get(name)
+    if field is None:
+        raise SegmentError(f'Unknown notification preference: {name}')
+    if field.choices and value not in dict(field.choices):
+        raise SegmentError(f'Invalid value for {name}: {value}')
+    if field.get_internal_type() == 'BooleanField' and not isinstance(value, bool):
+        raise SegmentError(f'{name} must be true or false')
+    # Users without a preference row have the defaults
+    if value == field.default:
+        return ~Q(Exists(NotificationPreference.objects.filter(user=OuterRef('pk')).exclude(**{name: value})))
+    return Q(Exists(NotificationPreference.objects.filter(user=OuterRef('pk'), **{name: value})))
+
+
+class SegmentCompiler:
+    """Compile a spec into a Q over User plus the aliases it filters on"""
+
+    # Alias -> per-user aggregate over counted orders
+    ORDER_MEASURES = {
+        'segment_orders': (Count('id'), IntegerField()),
+        'segment_spent': (Sum('total_amount'), DecimalField(max_digits=14, decimal_places=2)),
+    }
+
+    def __init__(self):
+        self.aliases = {}
+
+    def _alias(self, name):
+        if name not in self.aliases:
+            self.aliases[name] = _order_totals(*self.ORDER_MEASURES[name])
+        return name
+
+    def compile(self, spec, depth=0):
+        if not isinstance(spec, dict):
+            raise SegmentError('A segment spec must be an object')
+        if depth > 8:
+            raise SegmentError('Segment spec is nested too deeply')
+        condition = Q()
+        for key, value in spec.items():
+            condition &= self._term(key, value, depth)
+        return condition
+
+    def _term(self, key, value, depth):
+        if key == 'min_orders':
+            return Q(**{f"{self._alias('segment_orders')}__gte": _number(value, key)})
+        if key == 'max_orders':
+            return Q(**{f"{self._alias('segment_orders')}__lte": _number(value, key)})
+        if key == 'min_spent':
+            return Q(**{f"{self._alias('segment_spent')}__gte": _amount(value, key)})
+        if key == 'max_spent':
+            return Q(**{f"{self._alias('segment_spent')}__lte": _amount(value, key)})
+        if key == 'ordered_within_days':
+            return _ordered_since(_days_ago(value, key))
+        if key == 'not_ordered_within_days':
+            return ~_ordered_since(_days_ago(value, key))
+        if key == 'categories':
+            if not isinstance(value, list) or not value:
+                raise SegmentError('categories must be a non-empty list of category ids')
+            ids = [_number(category_id, key) for category_id in value]
+            return Q(Exists(OrderItem.objects.filter(
+                order__user=OuterRef('pk'), product__category_id__in=ids
+            ).exclude(order__status__in=UNCOUNTED_ORDER_STATUSES)))
+        if key == 'active_within_days':
+            return Q(last_login__gte=_days_ago(value, key))
+        if key == 'inactive_for_days':
+            return Q(last_login__lt=_days_ago(value, key)) | Q(last_login__isnull=True)
+        if key == 'joined_within_days':
+            return Q(created_at__gte=_days_ago(value, key))
+        if key == 'is_seller':
+            if not isinstance(value, bool):
+                raise SegmentError('is_seller must be true or false')
+            return Q(is_seller=value)
+        if key == 'preferences':
+            if not isinstance(value, dict):
+                raise SegmentError('preferences must be an object')
+            condition = Q()
+            for name, wanted in value.items():
+                condition &= _preference(name, wanted)
+            return condition
+        if key == 'segments':
+            if not isinstance(value, list) or not value:
+                raise SegmentError('segments must be a non-empty list of segment names')
+            unknown = [name for name in value if name not in SEGMENTS]
+            if unknown:
+                raise SegmentError(f"Unknown segments: {', '.join(map(str, unknown))}")
+            return self._any([SEGMENTS[name] for name in value], depth)
+        if key == 'any':
+            return self._any(value, depth)
+        if key == 'all':
+            if not isinstance(value, list):
+                raise SegmentError('all must be a list of specs')
+            condition = Q()
+            for nested in value:
+                condition &= self.compile(nested, depth + 1)
+            return condition
+        if key == 'not':
+            return ~self.compile(value, depth + 1)
+        raise SegmentError(f'Unknown targeting key: {key}')
+
+    def _any(self, specs, depth):
+        if not isinstance(specs, list) or not specs:
+            raise SegmentError('any must be a non-empty list of specs')
+        condition = Q(pk__in=[])
+        for nested in specs:
+            condition |= self.compile(nested, depth + 1)
+        return condition
+
+
+def validate_spec(spec):
+    """Raise SegmentError unless ``spec`` compiles"""
+    SegmentCompiler().compile(spec or {})
+
+
+def segment_queryset(spec, users=None):
+    """Active users matching ``spec``"""
+    compiler = SegmentCompiler()
+    condition = compiler.compile(spec or {})
+    users = User.objects.filter(is_active=True) if users is None else users
+    if compiler.aliases:
+        users = users.alias(**compiler.aliases)
+    return users.filter(condition)
+
+
+def stream_user_ids(spec, chunk_size=None, after_id=0):
+    """Yield lists of matching user ids in id order, ``chunk_size`` at a time"""
+    chunk_size = chunk_size or settings.CAMPAIGN_SEGMENT_CHUNK_SIZE
+    users = segment_queryset(spec).order_by('id')
+    while True:
+        ids = list(users.filter(id__gt=after_id).values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def campaign_audience(campaign):
+    """The full spec for a campaign: its target_audience, any of its user_segments and channel opt-in"""
+    spec = {'all': [campaign.target_audience or {}]}
+    if campaign.user_segments:
+        spec['segments'] = list(campaign.user_segments)
+    preference = CHANNEL_PREFERENCES.get(campaign.campaign_type)
+    if preference:
+        spec['preferences'] = {preference: True}
+    return spec
@@ -1,6 +1,10 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Coupon, CouponUsage, Discount, Promotion, Campaign, ReferralProgram, Referral
-from django.utils import timezone
+from .models import Coupon, CouponBatch, CouponUsage, Discount, Promotion, Campaign, ReferralProgram, Referral
+from Notifications.models import Notification
+from .codes import CodeSpaceError, check_code_space
+from .coupons import get_coupon
+from .segments import SEGMENTS, SegmentError, validate_spec
 
 class CouponSerializer(serializers.ModelSerializer):
     usage_count = serializers.SerializerMethodField()
@@ -12,11 +16,11 @@ class CouponSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_usage_count(self, obj):
-        return obj.usage.count()
+        return obj.current_uses
     
     def get_remaining_uses(self, obj):
         if obj.max_uses:
-            return max(0, obj.max_uses - obj.usage.count())
+            return max(0, obj.max_uses - obj.current_uses)
         return None
 
 class CouponCreateSerializer(serializers.ModelSerializer):
@@ -42,6 +46,46 @@ class CouponUpdateSerializer(serializers.ModelSerializer):
         model = Coupon
         fields = ['is_active', 'description', 'valid_from', 'valid_until', 'max_uses']
 
+class CouponBatchSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = CouponBatch
+        fields = '__all__'
+        read_only_fields = ['id', 'status', 'generated', 'error_message', 'started_at', 'finished_at',
+                            'created_by', 'created_at', 'updated_at']
+
+class CouponBatchCreateSerializer(serializers.ModelSerializer):
+    quantity = serializers.IntegerField(min_value=1, max_value=settings.COUPON_BATCH_MAX_QUANTITY)
+    code_length = serializers.IntegerField(min_value=4, required=False)
+    alphabet = serializers.CharField(max_length=64, required=False)
+
+    class Meta:
+        model = CouponBatch
+        fields = ['name', 'campaign', 'quantity', 'prefix', 'code_length', 'alphabet', 'discount_type',
+                 'discount_value', 'max_discount', 'max_uses', 'max_uses_per_user', 'applicable_to',
+                 'categories', 'products', 'sellers', 'min_order_value', 'max_order_value',
+                 'valid_from', 'valid_until', 'first_time_users_only']
+
+    def validate(self, attrs):
+        if attrs['valid_from'] >= attrs['valid_until']:
+            raise serializers.ValidationError("Valid from date must be before valid until date")
+        if attrs['discount_type'] == 'percentage' and attrs['discount_value'] > 100:
+            raise serializers.ValidationError("Percentage discount cannot exceed 100%")
+        applicable_to = attrs.get('applicable_to', 'all')
+        if applicable_to != 'all' and not attrs.get(applicable_to):
+            raise serializers.ValidationError(f"Select the {applicable_to} the coupons apply to")
+
+        attrs.setdefault('code_length', settings.COUPON_CODE_LENGTH)
+        attrs.setdefault('alphabet', settings.COUPON_CODE_ALPHABET)
+        try:
+            attrs['alphabet'] = check_code_space(
+                attrs['alphabet'], attrs['code_length'], attrs['quantity'], attrs.get('prefix', '')
+            )
+        except CodeSpaceError as e:
+            raise serializers.ValidationError(str(e))
+        return attrs
+
 class CouponUsageSerializer(serializers.ModelSerializer):
     coupon_code = serializers.CharField(source='coupon.code', read_only=True)
     user_name = serializers.CharField(source='user.name', read_only=True)
@@ -92,8 +136,28 @@ class CampaignSerializer(serializers.ModelSerializer):
 class CampaignCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Campaign
-        fields = ['name', 'description', 'campaign_type', 'budget', 'start_date', 
-                 'end_date', 'target_audience', 'channels', 'is_active']
+        fields = ['name', 'description', 'campaign_type', 'status', 'subject', 'message', 'html_content',
+                 'target_audience', 'user_segments', 'scheduled_at', 'start_date', 'end_date']
+
+    def validate_target_audience(self, value):
+        try:
+            validate_spec(value)
+        except SegmentError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_user_segments(self, value):
+        if not isinstance(value, list):
+            raise serializers.ValidationError("Expected a list of segment names")
+        unknown = [name for name in value if name not in SEGMENTS]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown segments: {', '.join(map(str, unknown))}")
+        return value
+
+class CampaignSendSerializer(serializers.Serializer):
+    context_data = serializers.JSONField(required=False)
+    priority = serializers.ChoiceField(choices=Notification.PRIORITY_CHOICES, required=False)
+    scheduled_at = serializers.DateTimeField(required=False)
 
 class ReferralProgramSerializer(serializers.ModelSerializer):
     class Meta:
@@ -128,35 +192,38 @@ class ReferralCreateSerializer(serializers.Serializer):
 
 class CouponValidationSerializer(serializers.Serializer):
     code = serializers.CharField()
-    order_amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    order_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    cart_id = serializers.IntegerField(required=False)
     
     def validate_code(self, value):
-        try:
-            coupon = Coupon.objects.get(code=value, is_active=True)
-            return coupon
-        except Coupon.DoesNotExist:
+        coupon = get_coupon(value)
+        if coupon is None:
             raise serializers.ValidationError("Invalid coupon code")
+        return coupon
     
     def validate(self, attrs):
         coupon = attrs['code']
-        order_amount = attrs['order_amount']
-        
-        # Check if coupon is expired
-        if coupon.valid_until and timezone.now() > coupon.valid_until:
-            raise serializers.ValidationError("Coupon has expired")
-        
-        # Check if coupon is not yet valid
-        if coupon.valid_from and timezone.now() < coupon.valid_from:
-            raise serializers.ValidationError("Coupon is not yet valid")
-        
-        # Check minimum order amount
-        if coupon.min_order_amount and order_amount < coupon.min_order_amount:
-            raise serializers.ValidationError(f"Minimum order amount is ${coupon.min_order_amount}")
+        request = self.context.get('request')
+        user = request.user if request else None
         
-        # Check usage limit
-        if coupon.max_uses and coupon.usage.count() >= coupon.max_uses:
-            raise serializers.ValidationError("Coupon usage limit reached")
+        if attrs.get('cart_id') is not None:
+            from Orders.models import Cart
+            from Orders.pricing import price_cart
+            if not user or not user.is_authenticated:
+                raise serializers.ValidationError("Authentication is required to validate a coupon against a cart")
+            try:
+                cart = Cart.objects.get(id=attrs['cart_id'], user=user, is_active=True)
+            except Cart.DoesNotExist:
+                raise serializers.ValidationError("Invalid cart")
+            attrs['quote'] = price_cart(cart, coupon=coupon)
+            # Coupon limits apply to the merchandise total before the coupon itself
+            attrs['order_amount'] = attrs['quote'].merchandise_total + attrs['quote'].coupon_amount
+        elif attrs.get('order_amount') is None:
+            raise serializers.ValidationError("Either order_amount or cart_id is required")
         
+        can_use, message = coupon.check(user, attrs['order_amount'])
+        if not can_use:
+            raise serializers.ValidationError(message)
         return attrs
 
 class PromotionSearchSerializer(serializers.Serializer):
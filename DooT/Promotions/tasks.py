@@ -0,0 +1,43 @@
+"""Background promotion work (see DooT.celery)."""
+import logging
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from .codes import generate_batch
+from .redemption import sync_current_uses
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def sync_coupon_uses():
+    """Periodic refresh of ``Coupon.current_uses`` from the striped counters (schedule every few minutes)"""
+    return {'coupons': sync_current_uses()}
+
+
+@shared_task(acks_late=True)
+def generate_coupon_batch(batch_id):
+    """Generate a CouponBatch's coupons; safe to re-run, it resumes after the last committed batch"""
+    batch = generate_batch(batch_id)
+    return {'batch_id': batch.id, 'status': batch.status, 'generated': batch.generated}
+
+
+def enqueue_coupon_batch(batch_id):
+    """Start generating once the transaction that created the batch commits.
+
+    A batch of hundreds of thousands of codes needs a Celery broker
+    (``CELERY_BROKER_URL``). Without one tasks run eagerly inside the
+    request; the batch is left pending for ``manage.py generate_coupon_batches``
+    instead.
+    """
+    def dispatch():
+        if settings.CELERY_TASK_ALWAYS_EAGER:
+            logger.info('No Celery broker: coupon batch %s waits for generate_coupon_batches', batch_id)
+            return
+        try:
+            generate_coupon_batch.delay(batch_id)
+        except Exception:
+            # The batch stays pending and can be generated with `manage.py generate_coupon_batches`
+            logger.exception('Could not queue coupon batch %s', batch_id)
+
+    transaction.on_commit(dispatch)
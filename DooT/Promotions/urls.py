@@ -11,6 +11,12 @@ urlpatterns = [
     path('coupons/<int:pk>/update/', views.CouponUpdateView.as_view(), name='coupon-update'),
     path('coupons/validate/', views.validate_coupon, name='validate-coupon'),
     
+    # Coupon Batches
+    path('coupon-batches/', views.CouponBatchListView.as_view(), name='coupon-batch-list'),
+    path('coupon-batches/create/', views.CouponBatchCreateView.as_view(), name='coupon-batch-create'),
+    path('coupon-batches/<int:pk>/', views.CouponBatchDetailView.as_view(), name='coupon-batch-detail'),
+    path('coupon-batches/<int:pk>/codes/', views.CouponBatchCodesView.as_view(), name='coupon-batch-codes'),
+    
     # Coupon Usage
     path('coupon-usage/', views.CouponUsageListView.as_view(), name='coupon-usage-list'),
     path('coupon-usage/<int:pk>/', views.CouponUsageDetailView.as_view(), name='coupon-usage-detail'),
@@ -33,6 +39,11 @@ urlpatterns = [
     path('campaigns/create/', views.CampaignCreateView.as_view(), name='campaign-create'),
     path('campaigns/<int:pk>/', views.CampaignDetailView.as_view(), name='campaign-detail'),
     path('campaigns/<int:pk>/update/', views.CampaignUpdateView.as_view(), name='campaign-update'),
+    path('campaigns/<int:pk>/audience/', views.CampaignAudienceView.as_view(), name='campaign-audience'),
+    path('campaigns/<int:pk>/send/', views.CampaignSendView.as_view(), name='campaign-send'),
+    path('campaigns/<int:pk>/engagement/', views.CampaignEngagementView.as_view(), name='campaign-engagement'),
+    path('campaigns/<int:pk>/track/open/', views.track_campaign_open, name='campaign-track-open'),
+    path('campaigns/<int:pk>/track/click/', views.track_campaign_click, name='campaign-track-click'),
     
     # Referral Programs
     path('referrals/', views.ReferralProgramListView.as_view(), name='referral-program-list'),
@@ -5,16 +5,30 @@ from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 from django.db.models import Q, Sum, Count
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.utils import timezone
-from .models import Coupon, CouponUsage, Discount, Promotion, Campaign, ReferralProgram, Referral
+from django.utils.dateparse import parse_date
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_GET
+from Notifications.models import BulkNotificationJob, NotificationTemplate
+from Notifications.serializers import BulkNotificationJobSerializer
+from Notifications.tasks import enqueue_bulk_job
+from Notifications.templating import TemplateError, compile_template
+from Orders.pricing import money
+from .models import Coupon, CouponBatch, CouponUsage, Discount, Promotion, Campaign, ReferralProgram, Referral
 from .serializers import (
     CouponSerializer, CouponCreateSerializer, CouponUpdateSerializer,
     CouponUsageSerializer, DiscountSerializer, DiscountCreateSerializer,
     PromotionSerializer, PromotionCreateSerializer, CampaignSerializer,
     CampaignCreateSerializer, ReferralProgramSerializer, ReferralProgramCreateSerializer,
     ReferralSerializer, ReferralCreateSerializer, CouponValidationSerializer,
-    PromotionSearchSerializer
+    PromotionSearchSerializer, CampaignSendSerializer, CouponBatchSerializer, CouponBatchCreateSerializer
 )
+from .codes import batch_csv_rows
+from .engagement import engagement_by_day, track
+from .segments import CHANNEL_PREFERENCES, SegmentError, campaign_audience, segment_queryset, validate_spec
+from .tasks import enqueue_coupon_batch
 
 # Keep generics for simple listing and retrieval
 class CouponListView(generics.ListAPIView):
@@ -27,6 +41,17 @@ class CouponDetailView(generics.RetrieveAPIView):
     serializer_class = CouponSerializer
     permission_classes = [permissions.IsAdminUser]
 
+class CouponBatchListView(generics.ListAPIView):
+    queryset = CouponBatch.objects.all()
+    serializer_class = CouponBatchSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+class CouponBatchDetailView(generics.RetrieveAPIView):
+    """Progress of a coupon batch"""
+    queryset = CouponBatch.objects.all()
+    serializer_class = CouponBatchSerializer
+    permission_classes = [permissions.IsAdminUser]
+
 class CouponUsageListView(generics.ListAPIView):
     serializer_class = CouponUsageSerializer
     permission_classes = [permissions.IsAdminUser]
@@ -116,6 +141,40 @@ class CouponCreateView(APIView):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class CouponBatchCreateView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        """Queue the generation of a batch of unique coupon codes"""
+        serializer = CouponBatchCreateSerializer(data=request.data)
+        if serializer.is_valid():
+            try:
+                with transaction.atomic():
+                    batch = serializer.save(created_by=request.user)
+                    enqueue_coupon_batch(batch.id)
+
+                return Response({
+                    'message': 'Coupon batch queued',
+                    'batch': CouponBatchSerializer(batch).data
+                }, status=status.HTTP_202_ACCEPTED)
+
+            except Exception as e:
+                return Response({
+                    'error': f'Error creating coupon batch: {str(e)}'
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class CouponBatchCodesView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, pk):
+        """Stream a batch's coupon codes as CSV"""
+        batch = get_object_or_404(CouponBatch, pk=pk)
+        response = StreamingHttpResponse(batch_csv_rows(batch), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="coupon-batch-{batch.id}.csv"'
+        return response
+
 class CouponUpdateView(APIView):
     permission_classes = [permissions.IsAdminUser]
     
@@ -314,6 +373,107 @@ class CampaignUpdateView(APIView):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class CampaignAudienceView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, pk):
+        """Size of a campaign's audience and a sample of its user ids"""
+        campaign = get_object_or_404(Campaign, pk=pk)
+        try:
+            users = segment_queryset(campaign_audience(campaign))
+            return Response({
+                'campaign': campaign.id,
+                'audience_size': users.count(),
+                'sample_user_ids': list(users.order_by('id').values_list('id', flat=True)[:20]),
+            })
+
+        except SegmentError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({
+                'error': f'Error computing campaign audience: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class CampaignSendView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, pk):
+        """Queue a bulk notification job for a campaign's audience"""
+        campaign = get_object_or_404(Campaign, pk=pk)
+        if campaign.campaign_type not in CHANNEL_PREFERENCES:
+            return Response({
+                'error': f'{campaign.get_campaign_type_display()} campaigns are not sent as notifications'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if campaign.status in ('completed', 'cancelled'):
+            return Response({'error': f'Campaign is {campaign.status}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = CampaignSendSerializer(data=request.data)
+        if serializer.is_valid():
+            try:
+                spec = campaign_audience(campaign)
+                validate_spec(spec)
+                with transaction.atomic():
+                    template = NotificationTemplate.objects.create(
+                        name=f'Campaign: {campaign.name}'[:100],
+                        notification_type=campaign.campaign_type,
+                        trigger='custom',
+                        subject=campaign.subject,
+                        message=campaign.message,
+                        html_template=campaign.html_content,
+                    )
+                    compile_template(template, validate=True)
+                    job = BulkNotificationJob.objects.create(
+                        template=template,
+                        campaign=campaign,
+                        created_by=request.user,
+                        audience=spec,
+                        context_data=serializer.validated_data.get('context_data', {}),
+                        priority=serializer.validated_data.get('priority', 'normal'),
+                        scheduled_at=serializer.validated_data.get('scheduled_at') or campaign.scheduled_at,
+                    )
+                    campaign.status = 'active'
+                    campaign.save(update_fields=['status', 'updated_at'])
+                    enqueue_bulk_job(job.id)
+
+                return Response({
+                    'message': 'Campaign queued for sending',
+                    'job': BulkNotificationJobSerializer(job).data
+                }, status=status.HTTP_202_ACCEPTED)
+
+            except (SegmentError, TemplateError) as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except Exception as e:
+                return Response({
+                    'error': f'Error sending campaign: {str(e)}'
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class CampaignEngagementView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, pk):
+        """A campaign's totals and its engagement per day"""
+        campaign = get_object_or_404(Campaign, pk=pk)
+        try:
+            since = request.query_params.get('since')
+            return Response({
+                'campaign': campaign.id,
+                'total_sent': campaign.total_sent,
+                'total_opened': campaign.total_opened,
+                'total_clicked': campaign.total_clicked,
+                'total_converted': campaign.total_converted,
+                'open_rate': round(campaign.open_rate, 2),
+                'click_rate': round(campaign.click_rate, 2),
+                'conversion_rate': round(campaign.conversion_rate, 2),
+                'daily': engagement_by_day(campaign, since=parse_date(since) if since else None),
+            })
+
+        except Exception as e:
+            return Response({
+                'error': f'Error retrieving campaign engagement: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class ReferralProgramCreateView(APIView):
     permission_classes = [permissions.IsAdminUser]
     
@@ -467,21 +627,28 @@ class PromotionSearchView(APIView):
 @permission_classes([permissions.AllowAny])
 def validate_coupon(request):
     """Validate coupon code"""
-    serializer = CouponValidationSerializer(data=request.data)
+    serializer = CouponValidationSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         try:
             coupon = serializer.validated_data['code']
             order_amount = serializer.validated_data['order_amount']
+            quote = serializer.validated_data.get('quote')
             
-            # Calculate discount amount
-            if coupon.discount_type == 'percentage':
-                discount_amount = order_amount * (coupon.discount_value / 100)
-            else:
-                discount_amount = coupon.discount_value
+            if quote is not None:
+                # Priced against the actual cart lines the coupon applies to
+                return Response({
+                    'valid': True,
+                    'coupon': CouponSerializer(coupon.as_instance()).data,
+                    'discount_amount': quote.coupon_amount,
+                    'final_amount': quote.total_amount,
+                    'pricing': quote.as_dict()
+                })
+            
+            discount_amount = min(money(coupon.calculate_discount(order_amount)), order_amount)
             
             return Response({
                 'valid': True,
-                'coupon': CouponSerializer(coupon).data,
+                'coupon': CouponSerializer(coupon.as_instance()).data,
                 'discount_amount': discount_amount,
                 'final_amount': order_amount - discount_amount
             })
@@ -535,3 +702,31 @@ def promotion_statistics(request):
         return Response({
             'error': f'Error retrieving statistics: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Engagement tracking
+# Plain Django views: mail clients fetch pixels without credentials or JSON
+# Accept headers. Hits are only buffered here (see Promotions.engagement).
+# Conversions are attributed when orders are placed, not reported by clients.
+TRACKING_PIXEL = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff'
+    b'!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+@require_GET
+def track_campaign_open(request, pk):
+    """1x1 GIF counting an open of the campaign"""
+    track(pk, 'opened')
+    response = HttpResponse(TRACKING_PIXEL, content_type='image/gif')
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@require_GET
+def track_campaign_click(request, pk):
+    """Count a click and redirect to ``next`` when it points at this site"""
+    track(pk, 'clicked')
+    target = request.GET.get('next', '')
+    if target and url_has_allowed_host_and_scheme(target, allowed_hosts={request.get_host()},
+                                                  require_https=request.is_secure()):
+        return HttpResponseRedirect(target)
+    return HttpResponse(status=204)
@@ -0,0 +1,129 @@
+"""Time-window index of promotions.
+
+Promotions reach products directly or through their category or seller, and
+only between ``start_date`` and ``end_date``; working that out per product
+means joining three M2M tables each time. Instead every active promotion that
+has not ended yet is compiled once per process into a ``WindowIndex``. The
+start and end instants of all windows cut time into segments in which the
+set of running promotions does not change; a lookup finds the segment by
+binary search, so windows opening or closing need no rebuild. Each segment
+resolves ``(relation, target id)`` to its running promotions once, after
+which badging a product is three dict lookups.
+
+The index is rebuilt through the ``CompiledCache`` version whenever a
+promotion or its targets change.
+"""
+import threading
+from bisect import bisect_right
+from datetime import timedelta
+from django.utils import timezone
+from Shipping.zones import CompiledCache
+
+RELATIONS = {'products': 'id', 'categories': 'category_id', 'sellers': 'seller_id'}
+# Windows include their end instant
+END_INCLUSIVE = timedelta(microseconds=1)
+
+
+class WindowIndex:
+    def __init__(self, promotions, links):
+        """``promotions`` with ``start_date``/``end_date``; ``links`` as ``(promotion_id, relation, target_id)``"""
+        self.promotions = {promotion.id: promotion for promotion in promotions}
+        self.targets = {}
+        for promotion_id, relation, target_id in links:
+            if promotion_id in self.promotions:
+                self.targets.setdefault((relation, target_id), set()).add(promotion_id)
+
+        # Sweep the window edges into segments: segment i starts at boundaries[i - 1]
+        events = {}
+        for promotion in promotions:
+            events.setdefault(promotion.start_date, [set(), set()])[0].add(promotion.id)
+            events.setdefault(promotion.end_date + END_INCLUSIVE, [set(), set()])[1].add(promotion.id)
+        self.boundaries = sorted(events)
+        self.segments = [frozenset()]
+        running = set()
+        for boundary in self.boundaries:
+            starting, ending = events[boundary]
+            running = (running | starting) - ending
+            self.segments.append(frozenset(running))
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def _segment(self, when):
+        return bisect_right(self.boundaries, when or timezone.now())
+
+    def running(self, when=None):
+        """Ids of the promotions running at ``when`` (default now)"""
+        return self.segments[self._segment(when)]
+
+    def _targets_at(self, segment):
+        resolved = self._resolved.get(segment)
+        if resolved is None:
+            running = self.segments[segment]
+            ordered = sorted(running, key=lambda promotion_id: (-self.promotions[promotion_id].priority, promotion_id))
+            rank = {promotion_id: position for position, promotion_id in enumerate(ordered)}
+            resolved = {}
+            for key, promotion_ids in self.targets.items():
+                live = sorted(promotion_ids & running, key=rank.__getitem__)
+                if live:
+                    resolved[key] = tuple(live)
+            with self._lock:
+                self._resolved[segment] = resolved
+        return resolved
+
+    def ids_for_product(self, product, when=None):
+        """Ids of the promotions running for ``product`` at ``when``, highest priority first"""
+        targets = self._targets_at(self._segment(when))
+        found = []
+        for relation, attr in RELATIONS.items():
+            found.extend(targets.get((relation, getattr(product, attr)), ()))
+        if len(found) > 1:
+            found = sorted(set(found), key=lambda promotion_id: (-self.promotions[promotion_id].priority, promotion_id))
+        return found
+
+    def for_product(self, product, when=None):
+        """The promotions running for ``product`` at ``when``, highest priority first"""
+        return [self.promotions[promotion_id] for promotion_id in self.ids_for_product(product, when)]
+
+
+def build_promotion_index():
+    from .models import Promotion
+    live = {'is_active': True, 'end_date__gte': timezone.now()}
+    promotions = list(Promotion.objects.filter(**live))
+    links = []
+    for relation in RELATIONS:
+        field = getattr(Promotion, relation).field
+        owner, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        rows = field.remote_field.through.objects.filter(
+            **{f'{owner}__{lookup}': value for lookup, value in live.items()}
+        ).values_list(f'{owner}_id', f'{target}_id')
+        links.extend((promotion_id, relation, target_id) for promotion_id, target_id in rows)
+    return WindowIndex(promotions, links)
+
+
+promotion_index = CompiledCache('promotion-index', build_promotion_index, namespace='promotions')
+
+
+def promotions_for_products(products, when=None):
+    """``{product id: [running Promotion, ...]}`` without touching the database when the index is warm"""
+    index = promotion_index.get()
+    return {product.id: index.for_product(product, when) for product in products}
+
+
+def badge(promotion):
+    return {
+        'id': promotion.id,
+        'name': promotion.name,
+        'promotion_type': promotion.promotion_type,
+        'banner_text': promotion.banner_text,
+        'end_date': promotion.end_date,
+    }
+
+
+def connect():
+    from django.db.models.signals import post_save, post_delete, m2m_changed
+    from .models import Promotion
+    post_save.connect(promotion_index.invalidate, sender=Promotion, weak=False, dispatch_uid='promotion-index-save')
+    post_delete.connect(promotion_index.invalidate, sender=Promotion, weak=False, dispatch_uid='promotion-index-delete')
+    for relation in RELATIONS:
+        through = getattr(Promotion, relation).through
+        m2m_changed.connect(promotion_index.invalidate, sender=through, weak=False, dispatch_uid=f'promotion-index-{relation}')
@@ -11,6 +11,7 @@ from Users.serializers import SellerProfileSerializer, SellerProfileCreateSerial
 from .serializers import SellerDashboardSerializer, SellerAnalyticsSerializer
 from Products.models import Product
 from Orders.models import Order
+from Orders.rollups import order_rollup_rows, sum_rows
 
 class SellerRegisterView(APIView):
     permission_classes = [permissions.AllowAny]
@@ -101,22 +102,17 @@ class SellerDashboardView(APIView):
             seller_profile = request.user.seller_profile.id
             # Get seller statistics
             total_products = Product.objects.filter(seller=seller_profile).count()
-            total_orders = Order.objects.filter(seller=seller_profile).count()
-            pending_orders = Order.objects.filter(
-                seller=seller_profile,
-                status__in=['pending', 'processing']
-            ).count()
+            rows = order_rollup_rows(seller=seller_profile)
+            total_orders = sum_rows(rows, 'orders')
+            pending_orders = sum_rows(rows, 'orders', status=['pending', 'processing'])
             
             # Calculate total revenue
-            total_revenue = Order.objects.filter(
-                seller=seller_profile,
-                status='delivered'
-            ).aggregate(total=Sum('total_amount'))['total'] or 0
+            total_revenue = sum_rows(rows, 'amount', status='delivered')
             
             # Get recent orders
             recent_orders = Order.objects.filter(
                 seller=seller_profile
-            ).order_by('-created_at')[:10]
+            ).select_related('user').order_by('-created_at')[:10]
             
             # Get recent products
             recent_products = Product.objects.filter(
@@ -136,7 +132,7 @@ class SellerDashboardView(APIView):
                         'status': order.status,
                         'total_amount': float(order.total_amount),
                         'created_at': order.created_at.isoformat(),
-                        'customer_name': f"{order.user.first_name} {order.user.last_name}" if order.user.first_name else order.user.email
+                        'customer_name': order.user.name or order.user.email
                     }
                     for order in recent_orders
                 ],
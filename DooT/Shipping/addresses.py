@@ -0,0 +1,102 @@
+"""Address normalization.
+
+Addresses are free text everywhere (Address rows, the shipping fields on
+Order, calculator requests). ``normalize_address`` canonicalizes case and
+whitespace, maps country names to ISO codes and formats postal codes; the
+result is LRU-cached on the raw input because the same few addresses are
+normalized over and over by zone matching and rate quotes. The
+``fingerprint`` of a normalized address identifies the place; an address is
+a duplicate when its ``recipient_key`` (name, phone, type) matches too.
+"""
+import hashlib
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+COUNTRY_ALIASES = {
+    'INDIA': 'IN', 'BHARAT': 'IN',
+    'UNITED STATES': 'US', 'UNITED STATES OF AMERICA': 'US', 'USA': 'US', 'U S A': 'US', 'U S': 'US', 'AMERICA': 'US',
+    'UNITED KINGDOM': 'GB', 'UK': 'GB', 'U K': 'GB', 'GREAT BRITAIN': 'GB', 'ENGLAND': 'GB',
+    'CANADA': 'CA', 'AUSTRALIA': 'AU', 'NEW ZEALAND': 'NZ', 'GERMANY': 'DE', 'DEUTSCHLAND': 'DE',
+    'FRANCE': 'FR', 'SPAIN': 'ES', 'ITALY': 'IT', 'NETHERLANDS': 'NL', 'IRELAND': 'IE',
+    'SINGAPORE': 'SG', 'UNITED ARAB EMIRATES': 'AE', 'UAE': 'AE', 'JAPAN': 'JP', 'CHINA': 'CN',
+    'BANGLADESH': 'BD', 'NEPAL': 'NP', 'SRI LANKA': 'LK', 'PAKISTAN': 'PK',
+}
+
+# Canonical display format for postal codes: (compact pattern, formatter)
+POSTAL_FORMATS = {
+    'US': (re.compile(r'^(\d{5})(\d{4})?$'), lambda m: m.group(1) + (f'-{m.group(2)}' if m.group(2) else '')),
+    'CA': (re.compile(r'^([A-Z]\d[A-Z])(\d[A-Z]\d)$'), lambda m: f'{m.group(1)} {m.group(2)}'),
+    'GB': (re.compile(r'^([A-Z]{1,2}\d[A-Z\d]?)(\d[A-Z]{2})$'), lambda m: f'{m.group(1)} {m.group(2)}'),
+}
+
+NON_ALNUM = re.compile(r'[^0-9A-Z]')
+
+NormalizedAddress = namedtuple('NormalizedAddress', ['country', 'state', 'city', 'zip_code', 'line1', 'line2'])
+
+
+def normalize_text(value):
+    """Collapse whitespace and case-fold free text"""
+    return ' '.join(str(value or '').replace(',', ' ').split()).casefold()
+
+
+@lru_cache(maxsize=1024)
+def normalize_country(value):
+    """ISO 3166 alpha-2 code for a country code or (common) name"""
+    value = ' '.join(re.sub(r'[^A-Za-z]', ' ', str(value or '')).upper().split())
+    return COUNTRY_ALIASES.get(value, value)
+
+
+def postal_key(value):
+    """Postal code with spacing and punctuation removed; used for prefix matching"""
+    return NON_ALNUM.sub('', str(value or '').upper())
+
+
+def format_postal_code(country, value):
+    compact = postal_key(value)
+    pattern = POSTAL_FORMATS.get(country)
+    if pattern:
+        match = pattern[0].match(compact)
+        if match:
+            return pattern[1](match)
+    return compact
+
+
+@lru_cache(maxsize=8192)
+def normalize_address(country, state=None, city=None, zip_code=None, line1=None, line2=None):
+    """Canonical form of an address; arguments must be hashable (plain strings or None)"""
+    country = normalize_country(country)
+    return NormalizedAddress(
+        country=country,
+        state=normalize_text(state),
+        city=normalize_text(city),
+        zip_code=format_postal_code(country, zip_code),
+        line1=normalize_text(line1),
+        line2=normalize_text(line2),
+    )
+
+
+def zone_key(address):
+    """``(country, state, city, postal key)`` used by the zone index"""
+    return address.country, address.state, address.city, postal_key(address.zip_code)
+
+
+def fingerprint(address):
+    """Stable hash of a normalized address, used to find duplicates"""
+    return hashlib.sha1('|'.join(address).encode('utf-8')).hexdigest()
+
+
+def recipient_key(address):
+    """Who an address is for and what it is used for; a duplicate must match this as well as the fingerprint"""
+    return (
+        normalize_text(address.first_name), normalize_text(address.last_name),
+        re.sub(r'\D', '', address.phone or ''), address.address_type,
+    )
+
+
+def address_fingerprint(address):
+    """Fingerprint of a Shipping.Address (or anything with the same fields)"""
+    return fingerprint(normalize_address(
+        address.country, address.state, address.city, address.zip_code,
+        address.address_line1, address.address_line2,
+    ))
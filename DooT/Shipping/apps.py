@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class ShippingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Shipping'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from .models import ShippingZone, ShippingMethod, ShippingRate
+        from .zones import zone_index
+        from .rates import rate_table
+        from . import rollups
+        rollups.connect()
+        post_save.connect(zone_index.invalidate, sender=ShippingZone, weak=False, dispatch_uid='zone-index-save')
+        post_delete.connect(zone_index.invalidate, sender=ShippingZone, weak=False, dispatch_uid='zone-index-delete')
+        # Rates are grouped by zone and filtered on zone/method activity
+        for model in (ShippingZone, ShippingMethod, ShippingRate):
+            label = model._meta.model_name
+            post_save.connect(rate_table.invalidate, sender=model, weak=False, dispatch_uid=f'rate-table-save-{label}')
+            post_delete.connect(rate_table.invalidate, sender=model, weak=False, dispatch_uid=f'rate-table-delete-{label}')
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from Shipping.addresses import recipient_key
+from Shipping.models import Address
+
+
+class Command(BaseCommand):
+    help = 'Normalize stored addresses, fill in their fingerprints and deactivate duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report duplicates without deactivating them')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # Backfill in primary key order; bulk_update skips save() and its default handling
+        normalized, last_id = 0, 0
+        while True:
+            batch = list(Address.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            for address in batch:
+                address.normalize()
+            Address.objects.bulk_update(batch, ['country', 'zip_code', 'fingerprint'])
+            normalized += len(batch)
+            last_id = batch[-1].id
+
+        duplicates = (
+            Address.objects.filter(is_active=True).values('user_id', 'fingerprint')
+            .annotate(copies=Count('id')).filter(copies__gt=1).order_by()
+        )
+        deactivated = 0
+        for group in duplicates.iterator():
+            # Same place: only addresses for the same recipient, phone and type are duplicates.
+            # Keep the default address, otherwise the oldest one
+            addresses = (
+                Address.objects.filter(user_id=group['user_id'], fingerprint=group['fingerprint'], is_active=True)
+                .order_by('-is_default', 'created_at', 'id')
+            )
+            kept, extra = set(), []
+            for address in addresses:
+                key = recipient_key(address)
+                if key in kept:
+                    extra.append(address.id)
+                else:
+                    kept.add(key)
+            deactivated += len(extra)
+            if extra and not options['dry_run']:
+                with transaction.atomic():
+                    Address.objects.filter(id__in=extra).update(is_active=False, is_default=False)
+
+        action = 'Would deactivate' if options['dry_run'] else 'Deactivated'
+        self.stdout.write(self.style.SUCCESS(
+            f'Normalized {normalized} addresses. {action} {deactivated} duplicate addresses.'
+        ))
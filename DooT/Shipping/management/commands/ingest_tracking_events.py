@@ -0,0 +1,43 @@
+import gzip
+import sys
+import time
+from django.core.management.base import BaseCommand
+from Shipping.tracking import ingest_lines
+
+
+class Command(BaseCommand):
+    help = 'Ingest carrier tracking events from an NDJSON or CSV file (optionally gzipped, "-" for stdin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='fmt', choices=['ndjson', 'csv'],
+                            help='Defaults to csv for *.csv / *.csv.gz files, ndjson otherwise')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['fmt'] or ('csv' if path.endswith(('.csv', '.csv.gz')) else 'ndjson')
+
+        if path == '-':
+            stream = sys.stdin
+        elif path.endswith('.gz'):
+            stream = gzip.open(path, 'rt', encoding='utf-8', newline='')
+        else:
+            stream = open(path, encoding='utf-8', newline='')
+
+        started = time.monotonic()
+        try:
+            result = ingest_lines(stream, fmt=fmt, batch_size=options['batch_size'])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.monotonic() - started
+
+        rate = result.received / elapsed if elapsed else result.received
+        self.stdout.write(self.style.SUCCESS(
+            f'Ingested {result.created} of {result.received} events in {elapsed:.2f}s ({rate:.0f} events/s)'
+        ))
+        self.stdout.write(
+            f'duplicates={result.duplicates} unknown_tracking_numbers={result.unknown_tracking_numbers} '
+            f'invalid={result.invalid} shipments_updated={result.shipments_updated}'
+        )
@@ -1,3 +1,4 @@
+from decimal import Decimal
 from django.db import models
 from Orders.models import Order
 from django.core.validators import MinValueValidator
@@ -17,18 +18,8 @@ class ShippingZone(models.Model):
 
     def is_address_in_zone(self, country, state=None, city=None, zip_code=None):
         """Check if an address falls within this shipping zone"""
-        if country and country not in self.countries:
-            return False
-        if state and state not in self.states:
-            return False
-        if city and city not in self.cities:
-            return False
-        if zip_code:
-            for pattern in self.zip_codes:
-                if zip_code.startswith(pattern):
-                    return True
-            return False
-        return True
+        from .zones import ZoneIndex
+        return bool(ZoneIndex([self]).match_ids(country, state, city, zip_code))
 
 class ShippingMethod(models.Model):
     METHOD_TYPE_CHOICES = [
@@ -86,7 +77,7 @@ class ShippingRate(models.Model):
         """Calculate shipping cost based on weight, items, and order value"""
         # Check if order qualifies for free shipping
         if self.free_shipping_threshold and order_value >= self.free_shipping_threshold:
-            return 0.00
+            return Decimal('0.00')
         
         # Check weight and item limits
         if order_weight < self.min_weight or (self.max_weight and order_weight > self.max_weight):
@@ -104,7 +95,7 @@ class ShippingRate(models.Model):
         cost += (order_weight * self.per_kg_rate)
         cost += (item_count * self.per_item_rate)
         
-        return max(cost, 0.00)
+        return max(cost, Decimal('0.00'))
 
 class Shipment(models.Model):
     STATUS_CHOICES = [
@@ -126,7 +117,7 @@ class Shipment(models.Model):
     
     # Status & Tracking
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
-    tracking_number = models.CharField(max_length=100, blank=True)
+    tracking_number = models.CharField(max_length=100, blank=True, db_index=True)
     carrier = models.CharField(max_length=100, blank=True)
     tracking_url = models.URLField(blank=True)
     
@@ -175,6 +166,33 @@ class ShipmentTracking(models.Model):
     def __str__(self):
         return f"{self.shipment.shipment_id} - {self.status} at {self.timestamp}"
 
+class ShippingRollup(models.Model):
+    """Daily shipment counters per carrier, method and status.
+
+    ``day`` is the day the shipment was created. Delivered rows also carry the
+    summed delivery time and an hourly histogram of delivery times, which can
+    be merged across days to get percentiles. Rows are recomputed per day by
+    ``Shipping.rollups`` shortly after shipments of that day change, and from
+    scratch with ``manage.py rebuild_statistics_rollups``.
+    """
+    day = models.DateField()
+    carrier = models.CharField(max_length=100, blank=True)
+    shipping_method = models.ForeignKey(ShippingMethod, on_delete=models.CASCADE, related_name='rollups')
+    status = models.CharField(max_length=20, choices=Shipment.STATUS_CHOICES)
+
+    shipment_count = models.IntegerField(default=0)
+    delivered_count = models.IntegerField(default=0)
+    delivery_seconds = models.BigIntegerField(default=0)
+    delivery_histogram = models.JSONField(default=dict, blank=True, help_text="Delivery time in whole hours -> shipments")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'carrier', 'shipping_method', 'status'], name='unique_shipping_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.carrier or 'no carrier'} - {self.status}: {self.shipment_count}"
+
 class Address(models.Model):
     ADDRESS_TYPE_CHOICES = [
         ('billing', 'Billing Address'),
@@ -196,6 +214,8 @@ class Address(models.Model):
     country = models.CharField(max_length=100)
     zip_code = models.CharField(max_length=15)
     phone = models.CharField(max_length=20)
+    # Hash of the normalized address (see Shipping.addresses), for duplicate detection
+    fingerprint = models.CharField(max_length=40, blank=True, editable=False)
     
     # Additional Information
     is_default = models.BooleanField(default=False)
@@ -206,6 +226,9 @@ class Address(models.Model):
     class Meta:
         verbose_name_plural = 'Addresses'
         ordering = ['-is_default', '-created_at']
+        indexes = [
+            models.Index(fields=['user', 'fingerprint'], name='address_user_fingerprint_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.city}, {self.state}"
@@ -218,8 +241,27 @@ class Address(models.Model):
                 address_type__in=[self.address_type, 'both'],
                 is_default=True
             ).exclude(id=self.id).update(is_default=False)
+        self.normalize()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'country', 'zip_code', 'fingerprint'}
         super().save(*args, **kwargs)
 
+    def normalize(self):
+        """Store the country as an ISO code and the postal code in its canonical format"""
+        from .addresses import address_fingerprint, format_postal_code, normalize_country
+        self.country = normalize_country(self.country)
+        self.zip_code = format_postal_code(self.country, self.zip_code)
+        self.fingerprint = address_fingerprint(self)
+
+    def find_duplicate(self):
+        """An active address of the same user for the same place, recipient, phone and type"""
+        from .addresses import address_fingerprint, recipient_key
+        key = recipient_key(self)
+        candidates = Address.objects.filter(
+            user_id=self.user_id, fingerprint=address_fingerprint(self), is_active=True
+        ).exclude(id=self.id)
+        return next((address for address in candidates if recipient_key(address) == key), None)
+
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
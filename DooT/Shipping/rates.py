@@ -0,0 +1,131 @@
+"""In-memory shipping rate quotes.
+
+The active rate table (active rates of active methods, grouped by zone) is
+loaded once per process and invalidated like the zone index, so quoting is
+pure Python: resolve the destination through ``Shipping.zones`` and apply
+``ShippingRate.calculate_shipping_cost`` to the zone's rates.
+``quote_many`` quotes any number of (destination, weight, items, value)
+requests in one call, which is what multi-seller cart quotes need.
+"""
+from decimal import Decimal
+from .zones import CompiledCache, zone_index
+
+ZERO = Decimal('0.00')
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value or 0))
+
+
+class RateOption:
+    """A shipping rate together with the method details quotes need"""
+    __slots__ = ('rate', 'zone_id', 'zone_name', 'method_id', 'method_name', 'method_type', 'estimated_days')
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.zone_id = rate.shipping_zone_id
+        self.zone_name = rate.shipping_zone.name
+        self.method_id = rate.shipping_method_id
+        self.method_name = rate.shipping_method.name
+        self.method_type = rate.shipping_method.method_type
+        self.estimated_days = rate.shipping_method.estimated_days
+
+
+def build_rate_table():
+    """Active rates per zone id"""
+    from .models import ShippingRate
+    table = {}
+    rates = ShippingRate.objects.filter(
+        is_active=True, shipping_method__is_active=True, shipping_zone__is_active=True
+    ).select_related('shipping_zone', 'shipping_method').order_by('id')
+    for rate in rates:
+        table.setdefault(rate.shipping_zone_id, []).append(RateOption(rate))
+    return table
+
+
+rate_table = CompiledCache('rate-table', build_rate_table)
+
+
+def _destination(destination):
+    """Accept a dict with country/state/city/zip_code keys or a tuple in that order"""
+    if isinstance(destination, dict):
+        return (destination.get('country'), destination.get('state'),
+                destination.get('city'), destination.get('zip_code'))
+    return tuple(destination) + (None,) * (4 - len(destination))
+
+
+def quote(destination, weight, item_count, order_value, zones=None, rates=None):
+    """Applicable shipping options for one package, cheapest (then fastest) first.
+
+    A method offered by several matching zones is quoted once, at its
+    cheapest rate.
+    """
+    zones = zones or zone_index.get()
+    rates = rates if rates is not None else rate_table.get()
+    weight, order_value = _decimal(weight), _decimal(order_value)
+
+    best = {}
+    for zone_id in zones.match_ids(*_destination(destination)):
+        for option in rates.get(zone_id, ()):
+            cost = option.rate.calculate_shipping_cost(weight, item_count, order_value)
+            if cost is None:
+                continue
+            current = best.get(option.method_id)
+            if current is None or cost < current[1]:
+                best[option.method_id] = (option, cost)
+
+    options = [
+        {
+            'rate_id': option.rate.id,
+            'method_id': option.method_id,
+            'method': option.method_name,
+            'method_type': option.method_type,
+            'estimated_days': option.estimated_days,
+            'zone': option.zone_name,
+            'base_cost': option.rate.base_rate,
+            'total_cost': cost.quantize(Decimal('0.01')),
+        }
+        for option, cost in best.values()
+    ]
+    options.sort(key=lambda option: (option['total_cost'], option['estimated_days']))
+    return options
+
+
+def quote_many(requests):
+    """Quote many ``(destination, weight, item_count, order_value)`` tuples at once"""
+    zones, rates = zone_index.get(), rate_table.get()
+    return [quote(*request, zones=zones, rates=rates) for request in requests]
+
+
+def package_for_lines(lines):
+    """``(weight, item_count, order_value)`` of priced cart lines (see Orders.pricing)"""
+    weight = sum((_decimal(line.product.weight) * line.quantity for line in lines), ZERO)
+    item_count = sum(line.quantity for line in lines)
+    order_value = sum((line.total for line in lines), ZERO)
+    return weight, item_count, order_value
+
+
+def quote_sellers(seller_lines, destination):
+    """Shipping options per seller for a multi-vendor cart, in one batched call.
+
+    ``seller_lines`` maps each seller to its priced lines.
+    """
+    sellers = list(seller_lines)
+    results = quote_many([(destination, *package_for_lines(seller_lines[seller])) for seller in sellers])
+    return dict(zip(sellers, results))
+
+
+def rate_shipping(destination, fallback=None):
+    """Shipping hook for ``Orders.pricing``: cheapest quoted option per seller.
+
+    When no rate covers the destination, ``fallback`` (the flat
+    ``ORDER_FLAT_SHIPPING`` by default) is used so checkout still works.
+    """
+    from Orders.pricing import flat_shipping
+    fallback = fallback or flat_shipping
+    zones, rates = zone_index.get(), rate_table.get()
+
+    def shipping(seller, lines):
+        options = quote(destination, *package_for_lines(lines), zones=zones, rates=rates)
+        return options[0]['total_cost'] if options else fallback(seller, lines)
+    return shipping
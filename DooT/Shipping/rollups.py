@@ -0,0 +1,169 @@
+"""Daily shipping rollups for the admin statistics.
+
+Shipment status changes arrive through single saves and through bulk tracking
+ingestion (``QuerySet.bulk_update``, which sends no signals), so rather than
+applying deltas the rollups are recomputed one creation day at a time: each
+day is a bounded GROUP BY, and only days whose shipments changed are redone.
+Saves and ``Shipping.tracking`` batches mark their days dirty once their
+transaction commits; a background thread refreshes the dirty days every
+``SHIPPING_ROLLUP_REFRESH_INTERVAL`` seconds, so a busy day is recomputed
+once per interval rather than once per save. Nothing is tracked unless
+``SHIPPING_STATISTICS_USE_ROLLUPS`` is on. Days marked by a process that is
+killed before refreshing them are fixed by ``manage.py rebuild_statistics_rollups``.
+"""
+import atexit
+import logging
+import threading
+import time as clock
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+from Orders.rollups import rollup_day, bulk_create_chunked
+
+logger = logging.getLogger(__name__)
+
+
+def _day_bounds(day):
+    """Start and end of ``day`` in the current time zone, like TruncDate"""
+    start = datetime.combine(day, time.min)
+    if settings.USE_TZ:
+        start = timezone.make_aware(start)
+    return start, start + timedelta(days=1)
+
+
+def compute_day(day):
+    """ShippingRollup rows (unsaved) for shipments created on ``day``"""
+    from .models import Shipment, ShippingRollup
+    start, end = _day_bounds(day)
+    shipments = Shipment.objects.filter(created_at__gte=start, created_at__lt=end)
+
+    rows = {}
+    grouped = shipments.values('carrier', 'shipping_method_id', 'status').annotate(shipments=Count('id')).order_by()
+    for group in grouped:
+        key = (group['carrier'], group['shipping_method_id'], group['status'])
+        rows[key] = ShippingRollup(
+            day=day, carrier=group['carrier'], shipping_method_id=group['shipping_method_id'],
+            status=group['status'], shipment_count=group['shipments'],
+        )
+
+    # Delivery times of one day's deliveries are bounded, so bucket them here
+    delivered = shipments.filter(status='delivered', delivered_at__isnull=False).values_list(
+        'carrier', 'shipping_method_id', 'created_at', 'delivered_at'
+    )
+    for carrier, method_id, created_at, delivered_at in delivered.iterator():
+        row = rows[(carrier, method_id, 'delivered')]
+        seconds = max(int((delivered_at - created_at).total_seconds()), 0)
+        bucket = str(seconds // 3600)
+        row.delivered_count += 1
+        row.delivery_seconds += seconds
+        row.delivery_histogram[bucket] = row.delivery_histogram.get(bucket, 0) + 1
+    return list(rows.values())
+
+
+def refresh_days(days):
+    """Recompute the rollups of the given creation days"""
+    from .models import ShippingRollup
+    for day in sorted(set(days)):
+        rows = compute_day(day)
+        with transaction.atomic():
+            ShippingRollup.objects.filter(day=day).delete()
+            ShippingRollup.objects.bulk_create(rows)
+
+
+def rebuild_shipping_rollups(batch_size=1000):
+    """Recompute every ShippingRollup row"""
+    from .models import Shipment, ShippingRollup
+    days = Shipment.objects.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct()
+    rows = (row for day in sorted(set(days)) for row in compute_day(day))
+    with transaction.atomic():
+        ShippingRollup.objects.all().delete()
+        return bulk_create_chunked(ShippingRollup, rows, batch_size)
+
+
+class DirtyDays:
+    """Creation days waiting to be refreshed in this process"""
+
+    def __init__(self):
+        self._days = set()
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, day):
+        with self._lock:
+            self._days.add(day)
+            if self._flusher is None or not self._flusher.is_alive():
+                # Started lazily, so forked workers get their own
+                self._flusher = threading.Thread(target=self._run, name='shipping-rollup-refresher', daemon=True)
+                self._flusher.start()
+
+    def flush(self):
+        """Refresh the dirty days; returns how many were refreshed"""
+        with self._lock:
+            days, self._days = self._days, set()
+        if not days:
+            return 0
+        try:
+            refresh_days(days)
+        except Exception:
+            logger.exception('Could not refresh shipping rollups')
+            with self._lock:
+                self._days |= days
+            return 0
+        return len(days)
+
+    def _run(self):
+        while True:
+            clock.sleep(settings.SHIPPING_ROLLUP_REFRESH_INTERVAL)
+            close_old_connections()
+            self.flush()
+
+
+dirty_days = DirtyDays()
+atexit.register(dirty_days.flush)
+
+
+def mark_day_dirty(day):
+    """Have ``day`` refreshed once the current transaction commits (dropped on rollback)"""
+    if settings.SHIPPING_STATISTICS_USE_ROLLUPS:
+        transaction.on_commit(lambda: dirty_days.add(day))
+
+
+def _shipment_changed(sender, instance, raw=False, **kwargs):
+    if not raw and instance.created_at:
+        mark_day_dirty(rollup_day(instance.created_at))
+
+
+def connect():
+    from .models import Shipment
+    post_save.connect(_shipment_changed, sender=Shipment, dispatch_uid='shipping-rollups-save')
+    post_delete.connect(_shipment_changed, sender=Shipment, dispatch_uid='shipping-rollups-delete')
+
+
+def merge_histograms(histograms):
+    merged = {}
+    for histogram in histograms:
+        for bucket, count in (histogram or {}).items():
+            merged[int(bucket)] = merged.get(int(bucket), 0) + count
+    return merged
+
+
+def percentiles(histogram, points=(50, 90, 95)):
+    """Delivery-time percentiles in hours from an hourly histogram"""
+    total = sum(histogram.values())
+    if not total:
+        return {f'p{point}': None for point in points}
+    result = {}
+    buckets = sorted(histogram.items())
+    for point in points:
+        target = total * point / 100
+        seen = 0
+        for hours, count in buckets:
+            seen += count
+            if seen >= target:
+                result[f'p{point}'] = hours
+                break
+    return result
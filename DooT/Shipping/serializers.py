@@ -88,3 +88,9 @@ class ShippingCalculatorSerializer(serializers.Serializer):
         if attrs['order_value'] <= 0:
             raise serializers.ValidationError("Order value must be greater than 0")
         return attrs
+
+class CartShippingQuoteSerializer(serializers.Serializer):
+    country = serializers.CharField()
+    state = serializers.CharField(required=False)
+    city = serializers.CharField(required=False)
+    zip_code = serializers.CharField(required=False)
@@ -0,0 +1,196 @@
+"""Bulk ingestion of carrier tracking events.
+
+Carriers send status updates as NDJSON or CSV files and webhook batches.
+``ingest_events`` consumes any iterable of event dicts in batches: it
+resolves shipments by tracking number with one indexed query per batch,
+drops events it has already stored, ``bulk_create``s the new
+ShipmentTracking rows and moves every affected shipment to its latest
+status with a single ``bulk_update``.
+
+An event needs ``tracking_number``, ``status`` and ``timestamp`` (ISO 8601);
+``location`` and ``description`` are optional.
+"""
+import csv
+import json
+from datetime import timezone as dt_timezone
+from itertools import islice
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from Orders.rollups import rollup_day
+from .models import Shipment, ShipmentTracking
+from .rollups import mark_day_dirty
+
+SHIPMENT_STATUSES = {value for value, label in Shipment.STATUS_CHOICES}
+SHIPPED_STATUSES = {'picked_up', 'in_transit', 'out_for_delivery', 'delivered'}
+
+
+def read_ndjson(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # Counted as invalid by ingest_batch
+                yield None
+
+
+def read_csv(lines):
+    yield from csv.DictReader(lines)
+
+
+READERS = {'ndjson': read_ndjson, 'csv': read_csv}
+
+
+def shipment_status(status):
+    """Map a carrier status onto Shipment.STATUS_CHOICES, or None if it has no equivalent"""
+    status = status.strip().lower().replace(' ', '_').replace('-', '_')
+    return status if status in SHIPMENT_STATUSES else None
+
+
+class IngestResult:
+    """Counters reported back to the carrier / command line"""
+
+    def __init__(self):
+        self.received = 0
+        self.created = 0
+        self.duplicates = 0
+        self.unknown_tracking_numbers = 0
+        self.invalid = 0
+        self.shipments_updated = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def _clean(raw):
+    """Normalise one raw event; returns None when required fields are missing or malformed"""
+    try:
+        tracking_number = str(raw['tracking_number']).strip()
+        status = str(raw['status']).strip()
+        timestamp = parse_datetime(str(raw['timestamp']).strip())
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    if not tracking_number or not status or timestamp is None:
+        return None
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+    return {
+        'tracking_number': tracking_number,
+        'status': status[:50],
+        'timestamp': timestamp,
+        'location': str(raw.get('location') or '')[:255],
+        'description': str(raw.get('description') or ''),
+    }
+
+
+def ingest_batch(raw_events, result):
+    events = []
+    for raw in raw_events:
+        event = _clean(raw)
+        if event is None:
+            result.invalid += 1
+        else:
+            events.append(event)
+    if not events:
+        return
+
+    shipments = {
+        shipment.tracking_number: shipment
+        for shipment in Shipment.objects.filter(
+            tracking_number__in={event['tracking_number'] for event in events}
+        ).only('id', 'tracking_number', 'status', 'created_at', 'shipped_at', 'delivered_at', 'updated_at')
+    }
+
+    resolved = []
+    for event in events:
+        shipment = shipments.get(event['tracking_number'])
+        if shipment is None:
+            result.unknown_tracking_numbers += 1
+        else:
+            resolved.append((shipment, event))
+    if not resolved:
+        return
+
+    # Existing events for the batch's shipments and time range, for deduplication
+    shipment_ids = {shipment.id for shipment, event in resolved}
+    timestamps = [event['timestamp'] for shipment, event in resolved]
+    seen = set(
+        ShipmentTracking.objects.filter(
+            shipment_id__in=shipment_ids,
+            timestamp__gte=min(timestamps), timestamp__lte=max(timestamps),
+        ).values_list('shipment_id', 'status', 'timestamp')
+    )
+    latest_known = dict(
+        ShipmentTracking.objects.filter(shipment_id__in=shipment_ids)
+        .values('shipment_id').annotate(latest=Max('timestamp')).values_list('shipment_id', 'latest')
+    )
+
+    rows = []
+    latest = {}
+    for shipment, event in resolved:
+        key = (shipment.id, event['status'], event['timestamp'])
+        if key in seen:
+            result.duplicates += 1
+            continue
+        seen.add(key)
+        rows.append(ShipmentTracking(
+            shipment=shipment,
+            status=event['status'],
+            location=event['location'],
+            description=event['description'],
+            timestamp=event['timestamp'],
+        ))
+        new_status = shipment_status(event['status'])
+        known = latest_known.get(shipment.id)
+        if new_status and (known is None or event['timestamp'] >= known):
+            current = latest.get(shipment.id)
+            if current is None or event['timestamp'] >= current[1]:
+                latest[shipment.id] = (new_status, event['timestamp'])
+
+    changed = []
+    fields = {'status'}
+    by_id = {shipment.id: shipment for shipment in shipments.values()}
+    for shipment_id, (new_status, timestamp) in latest.items():
+        shipment = by_id[shipment_id]
+        if shipment.status == new_status:
+            continue
+        shipment.status = new_status
+        if new_status in SHIPPED_STATUSES and shipment.shipped_at is None:
+            shipment.shipped_at = timestamp
+            fields.add('shipped_at')
+        if new_status == 'delivered':
+            shipment.delivered_at = timestamp
+            fields.add('delivered_at')
+        changed.append(shipment)
+
+    with transaction.atomic():
+        ShipmentTracking.objects.bulk_create(rows)
+        if changed:
+            # Only the columns that actually vary go into the CASE expressions
+            Shipment.objects.bulk_update(changed, sorted(fields))
+            Shipment.objects.filter(id__in=[shipment.id for shipment in changed]).update(updated_at=timezone.now())
+            # bulk_update sends no signals; mark the affected days for the rollup refresher
+            for day in {rollup_day(shipment.created_at) for shipment in changed}:
+                mark_day_dirty(day)
+    result.created += len(rows)
+    result.shipments_updated += len(changed)
+
+
+def ingest_events(events, batch_size=5000):
+    """Ingest an iterable of raw event dicts; returns an ``IngestResult``"""
+    result = IngestResult()
+    events = iter(events)
+    while True:
+        batch = list(islice(events, batch_size))
+        if not batch:
+            return result
+        result.received += len(batch)
+        ingest_batch(batch, result)
+
+
+def ingest_lines(lines, fmt='ndjson', batch_size=5000):
+    """Ingest a stream of text lines in ``ndjson`` or ``csv`` format"""
+    return ingest_events(READERS[fmt](lines), batch_size=batch_size)
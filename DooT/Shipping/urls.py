@@ -23,9 +23,11 @@ urlpatterns = [
     path('<int:pk>/', views.ShipmentDetailView.as_view(), name='shipment-detail'),
     path('<int:pk>/update/', views.ShipmentUpdateView.as_view(), name='shipment-update'),
     path('<int:shipment_id>/tracking/', views.ShipmentTrackingView.as_view(), name='shipment-tracking'),
+    path('tracking/ingest/', views.TrackingEventIngestView.as_view(), name='tracking-ingest'),
     
     # Shipping Calculator
     path('calculate/', views.ShippingCalculatorView.as_view(), name='shipping-calculator'),
+    path('calculate/cart/', views.CartShippingQuoteView.as_view(), name='cart-shipping-quote'),
     
     # Admin Functions
     path('admin/update-rates/', views.update_shipping_rates, name='update-rates'),
@@ -1,16 +1,24 @@
+import codecs
 from rest_framework import status, generics, permissions, filters
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Sum, Count
+from django.conf import settings
+from django.db.models import Q, Sum, Count, Avg, F, ExpressionWrapper, DurationField
 from django.utils import timezone
-from .models import ShippingZone, ShippingMethod, ShippingRate, Shipment, ShipmentTracking, Address
+from Orders.models import Cart
+from Orders.pricing import price_cart
+from .rates import quote, quote_sellers
+from .tracking import ingest_events, ingest_lines, SHIPPED_STATUSES
+from .rollups import dirty_days, merge_histograms, percentiles
+from .models import ShippingZone, ShippingMethod, ShippingRate, Shipment, ShipmentTracking, Address, ShippingRollup
 from .serializers import (
     ShippingZoneSerializer, ShippingMethodSerializer, ShippingRateSerializer,
     ShipmentSerializer, ShipmentCreateSerializer, ShipmentUpdateSerializer,
-    AddressSerializer, AddressCreateSerializer, ShippingCalculatorSerializer
+    AddressSerializer, AddressCreateSerializer, ShippingCalculatorSerializer,
+    CartShippingQuoteSerializer
 )
 
 # Keep generics for simple listing and retrieval
@@ -67,6 +75,14 @@ class AddressCreateView(APIView):
         serializer = AddressCreateSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             try:
+                # Return the existing address instead of storing the same one again
+                duplicate = Address(user=request.user, **serializer.validated_data).find_duplicate()
+                if duplicate:
+                    return Response({
+                        'message': 'Address already exists',
+                        'address': AddressSerializer(duplicate).data
+                    }, status=status.HTTP_200_OK)
+
                 # Check if this is the first address (make it default)
                 if not Address.objects.filter(user=request.user).exists():
                     serializer.validated_data['is_default'] = True
@@ -211,7 +227,8 @@ class ShipmentCreateView(APIView):
                     shipment=shipment,
                     status='created',
                     location='Origin',
-                    notes='Shipment created and ready for pickup'
+                    description='Shipment created and ready for pickup',
+                    timestamp=timezone.now()
                 )
                 
                 return Response({
@@ -252,7 +269,14 @@ class ShipmentUpdateView(APIView):
                 old_status = shipment.status
                 new_status = serializer.validated_data.get('status')
                 
-                serializer.save()
+                timestamps = {}
+                if new_status and new_status != old_status:
+                    if new_status in SHIPPED_STATUSES and not shipment.shipped_at:
+                        timestamps['shipped_at'] = timezone.now()
+                    if new_status == 'delivered':
+                        timestamps['delivered_at'] = timezone.now()
+                
+                serializer.save(**timestamps)
                 
                 # Create tracking event if status changed
                 if new_status and new_status != old_status:
@@ -260,8 +284,9 @@ class ShipmentUpdateView(APIView):
                     ShipmentTracking.objects.create(
                         shipment=shipment,
                         status=new_status,
-                        location=serializer.validated_data.get('location', 'In Transit'),
-                        notes=tracking_notes
+                        location=request.data.get('location', 'In Transit'),
+                        description=tracking_notes,
+                        timestamp=timezone.now()
                     )
                 
                 return Response({
@@ -293,7 +318,7 @@ class ShipmentTrackingView(APIView):
                     order__user=request.user
                 )
             
-            tracking_events = ShipmentTracking.objects.filter(shipment=shipment).order_by('created_at')
+            tracking_events = ShipmentTracking.objects.filter(shipment=shipment).order_by('timestamp')
             
             return Response({
                 'shipment_id': shipment.shipment_id,
@@ -306,8 +331,8 @@ class ShipmentTrackingView(APIView):
                     {
                         'status': event.status,
                         'location': event.location,
-                        'notes': event.notes,
-                        'timestamp': event.created_at
+                        'notes': event.description,
+                        'timestamp': event.timestamp
                     }
                     for event in tracking_events
                 ]
@@ -320,6 +345,34 @@ class ShipmentTrackingView(APIView):
                 'error': f'Error retrieving tracking info: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class TrackingEventIngestView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    
+    def post(self, request):
+        """Ingest a batch of carrier tracking events.
+        
+        The body is NDJSON (default), CSV (Content-Type: text/csv) or a JSON
+        object with an ``events`` list; it is streamed, not loaded whole.
+        """
+        try:
+            content_type = request.content_type or ''
+            if content_type.startswith('application/json'):
+                result = ingest_events(request.data.get('events', []))
+            else:
+                fmt = 'csv' if content_type.startswith('text/csv') else 'ndjson'
+                lines = codecs.iterdecode(request._request, 'utf-8')
+                result = ingest_lines(lines, fmt=fmt)
+            
+            return Response({
+                'message': 'Tracking events ingested',
+                **result.as_dict()
+            })
+            
+        except Exception as e:
+            return Response({
+                'error': f'Error ingesting tracking events: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class ShippingCalculatorView(APIView):
     permission_classes = [permissions.AllowAny]
     
@@ -334,39 +387,17 @@ class ShippingCalculatorView(APIView):
                 item_count = serializer.validated_data['item_count']
                 order_value = serializer.validated_data['order_value']
                 
-                # Find applicable shipping zones
-                shipping_zones = ShippingZone.objects.filter(
-                    countries__icontains=destination_country,
-                    is_active=True
+                # Quote against the in-memory zone index and rate table
+                available_rates = quote(
+                    {
+                        'country': destination_country,
+                        'state': serializer.validated_data.get('destination_state'),
+                        'city': serializer.validated_data.get('destination_city'),
+                        'zip_code': serializer.validated_data.get('destination_zip'),
+                    },
+                    package_weight, item_count, order_value
                 )
                 
-                available_rates = []
-                
-                for zone in shipping_zones:
-                    rates = ShippingRate.objects.filter(
-                        shipping_zone=zone,
-                        is_active=True
-                    )
-                    
-                    for rate in rates:
-                        # Calculate shipping cost
-                        shipping_cost = self._calculate_shipping_cost(
-                            rate, package_weight, item_count, order_value
-                        )
-                        
-                        if shipping_cost > 0:
-                            available_rates.append({
-                                'method': rate.shipping_method.name,
-                                'carrier': rate.shipping_method.carrier,
-                                'estimated_days': rate.estimated_days,
-                                'base_cost': rate.base_rate,
-                                'total_cost': shipping_cost,
-                                'zone': zone.name
-                            })
-                
-                # Sort by cost and delivery time
-                available_rates.sort(key=lambda x: (x['total_cost'], x['estimated_days']))
-                
                 return Response({
                     'origin': origin_country,
                     'destination': destination_country,
@@ -382,25 +413,49 @@ class ShippingCalculatorView(APIView):
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class CartShippingQuoteView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
     
-    def _calculate_shipping_cost(self, rate, weight, item_count, order_value):
-        """Calculate shipping cost based on rate structure"""
-        cost = rate.base_rate
-        
-        # Add weight-based cost
-        if weight > rate.weight_threshold:
-            extra_weight = weight - rate.weight_threshold
-            cost += extra_weight * rate.weight_rate
-        
-        # Add item-based cost
-        if item_count > 1:
-            cost += (item_count - 1) * rate.item_rate
-        
-        # Add value-based cost for high-value orders
-        if order_value > rate.value_threshold:
-            cost += (order_value - rate.value_threshold) * rate.value_rate
+    def post(self, request):
+        """Quote shipping for every seller in the user's active cart"""
+        serializer = CartShippingQuoteSerializer(data=request.data)
+        if serializer.is_valid():
+            try:
+                cart = Cart.objects.get(user=request.user, is_active=True)
+                destination = {
+                    'country': serializer.validated_data['country'],
+                    'state': serializer.validated_data.get('state'),
+                    'city': serializer.validated_data.get('city'),
+                    'zip_code': serializer.validated_data.get('zip_code'),
+                }
+                
+                # Packages are priced after discounts so free-shipping thresholds apply correctly
+                cart_quote = price_cart(cart)
+                seller_quotes = quote_sellers(
+                    {seller.seller: seller.lines for seller in cart_quote.sellers}, destination
+                )
+                
+                return Response({
+                    'destination': destination,
+                    'sellers': [
+                        {
+                            'seller_id': seller.id,
+                            'seller_name': seller.business_name,
+                            'available_rates': options
+                        }
+                        for seller, options in seller_quotes.items()
+                    ]
+                })
+                
+            except Cart.DoesNotExist:
+                return Response({'message': 'No active cart found'}, status=status.HTTP_404_NOT_FOUND)
+            except Exception as e:
+                return Response({
+                    'error': f'Error calculating shipping: {str(e)}'
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        return round(cost, 2)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # Admin shipping management
 @api_view(['POST'])
@@ -442,34 +497,82 @@ def update_shipping_rates(request):
 def shipping_statistics(request):
     """Get shipping statistics for admin dashboard"""
     try:
-        total_shipments = Shipment.objects.count()
-        pending_shipments = Shipment.objects.filter(status='pending').count()
-        in_transit = Shipment.objects.filter(status='in_transit').count()
-        delivered = Shipment.objects.filter(status='delivered').count()
+        if settings.SHIPPING_STATISTICS_USE_ROLLUPS:
+            # Include this process's changes that are still waiting for the refresher
+            dirty_days.flush()
+            return Response(_shipping_statistics_from_rollups())
         
-        # Calculate average delivery time
-        delivered_shipments = Shipment.objects.filter(
-            status='delivered',
-            delivered_at__isnull=False
+        # One conditional aggregation; delivery time is computed in SQL
+        delivered = Q(status='delivered', delivered_at__isnull=False)
+        stats = Shipment.objects.aggregate(
+            total_shipments=Count('id'),
+            pending_shipments=Count('id', filter=Q(status='pending')),
+            in_transit=Count('id', filter=Q(status='in_transit')),
+            delivered=Count('id', filter=Q(status='delivered')),
+            average_delivery_time=Avg(
+                ExpressionWrapper(F('delivered_at') - F('created_at'), output_field=DurationField()),
+                filter=delivered
+            ),
         )
-        
-        avg_delivery_time = 0
-        if delivered_shipments.exists():
-            total_time = sum([
-                (shipment.delivered_at - shipment.created_at).days
-                for shipment in delivered_shipments
-            ])
-            avg_delivery_time = total_time / delivered_shipments.count()
+        average = stats.pop('average_delivery_time')
         
         return Response({
-            'total_shipments': total_shipments,
-            'pending_shipments': pending_shipments,
-            'in_transit': in_transit,
-            'delivered': delivered,
-            'average_delivery_time_days': round(avg_delivery_time, 1)
+            **stats,
+            'average_delivery_time_days': round(average.total_seconds() / 86400, 1) if average else 0
         })
         
     except Exception as e:
         return Response({
             'error': f'Error retrieving statistics: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _shipping_statistics_from_rollups():
+    """Dashboard numbers from ShippingRollup, with per-carrier/method breakdown and percentiles"""
+    rows = list(
+        ShippingRollup.objects.values('status', 'carrier', 'shipping_method__name')
+        .annotate(shipments=Sum('shipment_count'), delivered_count=Sum('delivered_count'),
+                  seconds=Sum('delivery_seconds'))
+        .order_by()
+    )
+    histograms = {}
+    for carrier, method, histogram in ShippingRollup.objects.filter(status='delivered').values_list(
+        'carrier', 'shipping_method__name', 'delivery_histogram'
+    ).iterator():
+        histograms.setdefault((carrier, method), []).append(histogram)
+    
+    def count(status_value):
+        return sum(row['shipments'] for row in rows if row['status'] == status_value)
+    
+    delivered_count = sum(row['delivered_count'] for row in rows)
+    delivered_seconds = sum(row['seconds'] for row in rows)
+    
+    breakdown = {}
+    for row in rows:
+        key = (row['carrier'], row['shipping_method__name'])
+        entry = breakdown.setdefault(key, {
+            'carrier': row['carrier'],
+            'shipping_method': row['shipping_method__name'],
+            'total_shipments': 0,
+            'delivered': 0,
+            'delivery_seconds': 0,
+        })
+        entry['total_shipments'] += row['shipments']
+        entry['delivered'] += row['delivered_count']
+        entry['delivery_seconds'] += row['seconds']
+    
+    by_carrier = []
+    for key, entry in breakdown.items():
+        seconds = entry.pop('delivery_seconds')
+        entry['average_delivery_time_days'] = round(seconds / entry['delivered'] / 86400, 1) if entry['delivered'] else 0
+        entry['delivery_time_hours'] = percentiles(merge_histograms(histograms.get(key, [])))
+        by_carrier.append(entry)
+    
+    return {
+        'total_shipments': sum(row['shipments'] for row in rows),
+        'pending_shipments': count('pending'),
+        'in_transit': count('in_transit'),
+        'delivered': count('delivered'),
+        'average_delivery_time_days': round(delivered_seconds / delivered_count / 86400, 1) if delivered_count else 0,
+        'delivery_time_hours': percentiles(merge_histograms(h for hs in histograms.values() for h in hs)),
+        'by_carrier': by_carrier
+    }
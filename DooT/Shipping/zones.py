@@ -0,0 +1,149 @@
+"""Precompiled shipping-zone matcher.
+
+Active ShippingZone rows are compiled once per process into lookup maps
+(country, state and city sets) and a zip-prefix trie, so resolving an address
+to its zones costs a few dict lookups plus one step per zip character instead
+of a JSON ``icontains`` query and a linear scan of every pattern.
+
+Compiled structures are invalidated through a version number kept in the
+cache, bumped whenever a zone (or, for ``Shipping.rates``, a rate or method)
+changes, so every process rebuilds on its next lookup. That only reaches
+other processes through a shared cache (``REDIS_URL``); whatever the cache,
+a structure older than ``COMPILED_INDEX_MAX_AGE_SECONDS`` is rebuilt anyway.
+"""
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .addresses import normalize_address, normalize_country, normalize_text, postal_key, zone_key
+
+
+class CompiledCache:
+    """A per-process compiled structure, rebuilt when its cache version changes"""
+
+    def __init__(self, name, build, namespace='shipping'):
+        self.version_key = f'{namespace}:{name}:version'
+        self.build = build
+        self._lock = threading.Lock()
+        self._compiled = None
+        self._version = None
+        self._built_at = 0.0
+
+    def _stale(self, version):
+        return (
+            self._compiled is None or version != self._version
+            or time.monotonic() - self._built_at > settings.COMPILED_INDEX_MAX_AGE_SECONDS
+        )
+
+    def get(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # Cold (or evicted) cache: start a fresh version so other processes rebuild too
+            cache.add(self.version_key, 1, timeout=None)
+            version = cache.get(self.version_key)
+        if self._stale(version):
+            with self._lock:
+                if self._stale(version):
+                    self._compiled = self.build()
+                    self._version = version
+                    self._built_at = time.monotonic()
+        return self._compiled
+
+    def invalidate(self, **kwargs):
+        """Signal receiver: make every process rebuild once the change is committed"""
+        transaction.on_commit(self._bump)
+
+    def _bump(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, timeout=None)
+        self._compiled = None
+
+
+class ZoneIndex:
+    """Resolve addresses to active shipping zones.
+
+    An empty ``countries``/``states``/``cities``/``zip_codes`` list on a zone
+    means the zone does not restrict on that part of the address; address
+    parts that are not given are not checked, as in
+    ``ShippingZone.is_address_in_zone``.
+    """
+
+    def __init__(self, zones):
+        self.zones = {zone.id: zone for zone in zones}
+        self.all_ids = frozenset(self.zones)
+        self.countries = self._build_map(zones, 'countries', normalize_country)
+        self.states = self._build_map(zones, 'states', normalize_text)
+        self.cities = self._build_map(zones, 'cities', normalize_text)
+        self.zip_trie = {}
+        self.any_zip = set()
+        for zone in zones:
+            patterns = [postal_key(pattern) for pattern in zone.zip_codes or []]
+            patterns = [pattern for pattern in patterns if pattern]
+            if not patterns:
+                self.any_zip.add(zone.id)
+            for pattern in patterns:
+                node = self.zip_trie
+                for char in pattern:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, set()).add(zone.id)
+
+    @staticmethod
+    def _build_map(zones, attr, normalize):
+        """``(value -> zone ids, ids of zones without restriction)``"""
+        mapping, unrestricted = {}, set()
+        for zone in zones:
+            values = {normalize(value) for value in getattr(zone, attr) or []}
+            values.discard('')
+            if not values:
+                unrestricted.add(zone.id)
+            for value in values:
+                mapping.setdefault(value, set()).add(zone.id)
+        return mapping, frozenset(unrestricted)
+
+    @staticmethod
+    def _lookup(index, value):
+        mapping, unrestricted = index
+        return unrestricted | mapping.get(value, set())
+
+    def _zip_matches(self, zip_code):
+        matched = set(self.any_zip)
+        node = self.zip_trie
+        for char in zip_code:
+            node = node.get(char)
+            if node is None:
+                break
+            matched |= node.get(None, set())
+        return matched
+
+    def match_ids(self, country=None, state=None, city=None, zip_code=None):
+        # Zone lists are compiled with the same canonicalization, so e.g. "USA" matches "US"
+        country, state, city, zip_code = zone_key(normalize_address(country, state, city, zip_code))
+        candidates = self.all_ids
+        for index, value in ((self.countries, country), (self.states, state), (self.cities, city)):
+            if value:
+                candidates = candidates & self._lookup(index, value)
+                if not candidates:
+                    return []
+        if zip_code:
+            candidates = candidates & self._zip_matches(zip_code)
+        return sorted(candidates)
+
+    def match(self, country=None, state=None, city=None, zip_code=None):
+        """Active zones containing the address, ordered by id"""
+        return [self.zones[zone_id] for zone_id in self.match_ids(country, state, city, zip_code)]
+
+
+def build_zone_index():
+    from .models import ShippingZone
+    return ZoneIndex(list(ShippingZone.objects.filter(is_active=True).order_by('id')))
+
+
+zone_index = CompiledCache('zone-index', build_zone_index)
+
+
+def zones_for_address(country, state=None, city=None, zip_code=None):
+    """Active shipping zones for an address"""
+    return zone_index.get().match(country, state, city, zip_code)